@@ -1,13 +1,22 @@
 ﻿import os
 import logging
-from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from urllib.parse import urlparse, parse_qsl, quote, urlencode, urlunparse
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # ============================================================
 # DATABASE URL
 # ============================================================
@@ -36,27 +45,244 @@ DATABASE_URL = add_param(
     options="-c idle_in_transaction_session_timeout=60000"
 )
 
+
+def libpq_dsn(url: str | None = None, application_name: str = "azurenet_engine") -> str:
+    """
+    DSN per psycopg.connect() diretto (es. LISTEN del dispatcher): accetta
+    URL SQLAlchemy (postgresql+psycopg://) o libpq e applica gli stessi
+    parametri degli engine (sslmode, connect_timeout, application_name).
+    Default: DATABASE_URL.
+    """
+    u = urlparse(url or DATABASE_URL)
+    scheme = u.scheme.split("+", 1)[0]
+    if scheme == "postgres":
+        scheme = "postgresql"
+    q = dict(parse_qsl(u.query))
+    q.setdefault("sslmode", "require")
+    q.setdefault("connect_timeout", "15")
+    q["application_name"] = application_name
+    # libpq decodifica solo %XX ("+" resterebbe letterale nelle options)
+    return urlunparse(u._replace(scheme=scheme, query=urlencode(q, quote_via=quote)))
+
 # ============================================================
-# SQLALCHEMY ENGINE (BATCH SAFE)
+# SQLALCHEMY ENGINE — PROFILI DI POOL PER CARICO
 # ============================================================
+# Un pool per tipo di carico, così una sync lunga non toglie
+# connessioni ai job al minuto:
+# - oltp:  AS24 / ASM, podcast, job brevi (default, = `engine`),
+#          anche audit rescan / sospensioni DMAX (psycopg_connection)
+# - batch: sync Motornet (usato / nuovo / vic / immagini), WLTP e snapshot
+#          publish details: sessioni lunghe, fino a 5 job sovrapposti
+# - bulk:  import CSV stock (COPY + upsert set-based), una connessione
+#          per import parallelo; claim / errori restano su oltp
+# Override via env: DB_POOL_<PROFILO>_SIZE / _OVERFLOW / _TIMEOUT / _STATEMENT_TIMEOUT_MS
+# Gli engine non-oltp vengono creati al primo uso.
 SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
 
-engine = create_engine(
-    DATABASE_URL,
-    echo=SQL_ECHO,
-    pool_size=3,
-    max_overflow=2,
-    pool_pre_ping=True,
-    pool_recycle=1800,
-    pool_timeout=30,
-    connect_args={
+DB_POOL_WAIT_WARN_SECONDS = float(os.getenv("DB_POOL_WAIT_WARN_SECONDS", "1"))
+
+
+@dataclass(frozen=True)
+class EngineProfile:
+    name: str
+    pool_size: int
+    max_overflow: int
+    pool_timeout: float
+    statement_timeout_ms: int
+
+
+def _profile(name: str, pool_size: int, max_overflow: int, pool_timeout: float, statement_timeout_ms: int) -> EngineProfile:
+    env = f"DB_POOL_{name.upper()}"
+    return EngineProfile(
+        name=name,
+        pool_size=int(os.getenv(f"{env}_SIZE", pool_size)),
+        max_overflow=int(os.getenv(f"{env}_OVERFLOW", max_overflow)),
+        pool_timeout=float(os.getenv(f"{env}_TIMEOUT", pool_timeout)),
+        statement_timeout_ms=int(os.getenv(f"{env}_STATEMENT_TIMEOUT_MS", statement_timeout_ms)),
+    )
+
+
+ENGINE_PROFILES = {
+    p.name: p
+    for p in (
+        _profile("oltp", pool_size=3, max_overflow=2, pool_timeout=30, statement_timeout_ms=30000),
+        _profile("batch", pool_size=3, max_overflow=2, pool_timeout=120, statement_timeout_ms=30000),
+        _profile("bulk", pool_size=2, max_overflow=0, pool_timeout=300, statement_timeout_ms=300000),
+    )
+}
+
+
+# ============================================================
+# TELEMETRIA POOL (attesa al checkout / tempo di possesso)
+# ============================================================
+class PoolMetrics:
+    """Contatori per finestra (azzerati da log_pool_stats)."""
+
+    def __init__(self, profile: str):
+        self.profile = profile
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.slow_waits = 0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+        self.checkins = 0
+
+    def record_wait(self, seconds: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+                self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if seconds >= DB_POOL_WAIT_WARN_SECONDS:
+                self.slow_waits += 1
+
+        if timed_out:
+            logger.error("[DB POOL] %s esaurito: timeout dopo %.1fs in attesa di una connessione", self.profile, seconds)
+        elif seconds >= DB_POOL_WAIT_WARN_SECONDS:
+            logger.warning("[DB POOL] %s: checkout atteso %.2fs (pool saturo)", self.profile, seconds)
+
+    def record_hold(self, seconds: float) -> None:
+        with self._lock:
+            self.checkins += 1
+            self.hold_total += seconds
+            self.hold_max = max(self.hold_max, seconds)
+
+    def snapshot(self, pool, reset: bool = False) -> dict:
+        with self._lock:
+            snap = {
+                "profile": self.profile,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "slow_waits": self.slow_waits,
+                "wait_avg": self.wait_total / self.checkouts if self.checkouts else 0.0,
+                "wait_max": self.wait_max,
+                "hold_avg": self.hold_total / self.checkins if self.checkins else 0.0,
+                "hold_max": self.hold_max,
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(0, pool.overflow()),
+            }
+            if reset:
+                self._reset()
+        return snap
+
+
+def _timed_pool_class(metrics: PoolMetrics):
+    """QueuePool che misura l'attesa del checkout (incluso il connect in overflow)."""
+
+    class TimedQueuePool(QueuePool):
+        def _do_get(self):
+            t0 = time.perf_counter()
+            try:
+                conn = super()._do_get()
+            except PoolTimeoutError:
+                metrics.record_wait(time.perf_counter() - t0, timed_out=True)
+                raise
+            metrics.record_wait(time.perf_counter() - t0)
+            return conn
+
+    return TimedQueuePool
+
+
+def _attach_hold_timer(eng, metrics: PoolMetrics) -> None:
+    @event.listens_for(eng, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checkout_at"] = time.perf_counter()
+
+    @event.listens_for(eng, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop("checkout_at", None)
+        if started is not None:
+            metrics.record_hold(time.perf_counter() - started)
+
+
+def _connect_args(profile: EngineProfile, application_name: str) -> dict:
+    return {
         "sslmode": "require",
         "connect_timeout": 15,
-        "application_name": "azurenet_engine",
-        "options": "-c statement_timeout=30000",
+        "application_name": application_name,
+        "options": f"-c statement_timeout={profile.statement_timeout_ms}",
         "prepare_threshold": None,
-    },
-)
+    }
+
+
+def _create_engine(profile: EngineProfile):
+    metrics = PoolMetrics(profile.name)
+    eng = create_engine(
+        DATABASE_URL,
+        echo=SQL_ECHO,
+        poolclass=_timed_pool_class(metrics),
+        pool_size=profile.pool_size,
+        max_overflow=profile.max_overflow,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        pool_timeout=profile.pool_timeout,
+        connect_args=_connect_args(
+            profile,
+            "azurenet_engine" if profile.name == "oltp" else f"azurenet_engine_{profile.name}",
+        ),
+    )
+    _attach_hold_timer(eng, metrics)
+    _pool_metrics[profile.name] = metrics
+    return eng
+
+
+_engines: dict = {}
+_pool_metrics: dict[str, PoolMetrics] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(profile: str = "oltp"):
+    """Engine del profilo (creato al primo uso)."""
+    eng = _engines.get(profile)
+    if eng is None:
+        with _engines_lock:
+            eng = _engines.get(profile)
+            if eng is None:
+                eng = _engines[profile] = _create_engine(ENGINE_PROFILES[profile])
+    return eng
+
+
+engine = get_engine("oltp")
+
+
+def pool_stats(reset: bool = False) -> list[dict]:
+    """Snapshot della telemetria per ogni engine già creato."""
+    return [
+        _pool_metrics[name].snapshot(eng.pool, reset=reset)
+        for name, eng in list(_engines.items())
+    ]
+
+
+def log_pool_stats() -> None:
+    """Log della finestra corrente per profilo (poi azzerata). Schedulato da app/scheduler."""
+    for s in pool_stats(reset=True):
+        if not (s["checkouts"] or s["timeouts"] or s["checked_out"]):
+            continue
+        log = logger.warning if s["timeouts"] or s["slow_waits"] else logger.info
+        log(
+            "[DB POOL] %s | checkout=%d timeout=%d lenti=%d attesa avg=%.3fs max=%.2fs "
+            "possesso avg=%.2fs max=%.1fs | in uso=%d/%d overflow=%d",
+            s["profile"],
+            s["checkouts"],
+            s["timeouts"],
+            s["slow_waits"],
+            s["wait_avg"],
+            s["wait_max"],
+            s["hold_avg"],
+            s["hold_max"],
+            s["checked_out"],
+            s["pool_size"],
+            s["overflow"],
+        )
 
 
 
@@ -71,16 +297,61 @@ SessionLocal = sessionmaker(
     bind=engine,
 )
 
+_sessionmakers = {"oltp": SessionLocal}
+
+
+def get_sessionmaker(profile: str = "oltp"):
+    """sessionmaker legato all'engine del profilo."""
+    factory = _sessionmakers.get(profile)
+    if factory is None:
+        bind = get_engine(profile)
+        with _engines_lock:
+            factory = _sessionmakers.get(profile)
+            if factory is None:
+                factory = _sessionmakers[profile] = sessionmaker(
+                    autocommit=False,
+                    autoflush=False,
+                    bind=bind,
+                )
+    return factory
+
 # ============================================================
 # SESSION CONTEXT (BATCH)
 # ============================================================
+@contextmanager
+def psycopg_connection(profile: str = "oltp"):
+    """
+    Connessione psycopg nativa presa dal pool SQLAlchemy del profilo
+    (pre-ping / recycle / telemetria come per le sessioni), per il codice
+    che usa direttamente psycopg: Jsonb, COPY, cursori.
+    Stessa semantica di `with psycopg.connect()`: commit a fine blocco,
+    rollback su errore; poi la connessione torna al pool.
+    """
+    proxied = get_engine(profile).raw_connection()
+    try:
+        conn = proxied.driver_connection
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+    finally:
+        proxied.close()
+
+
 class DBSession:
     """
     Context manager per job batch.
     Commit esplicito, rollback sicuro.
+    profile: pool da usare (vedi ENGINE_PROFILES), default oltp.
     """
+    def __init__(self, profile: str = "oltp"):
+        self.profile = profile
+
     def __enter__(self):
-        self.db = SessionLocal()
+        self.db = get_sessionmaker(self.profile)()
         return self.db
 
     def __exit__(self, exc_type, exc, tb):
@@ -94,3 +365,52 @@ class DBSession:
             self.db.close()
 
 
+# ============================================================
+# ASYNC ENGINE (JOB ASYNCIO)
+# ============================================================
+# Per i job che girano dentro asyncio.run (Motornet): le query non
+# bloccano più l'event loop, DB e HTTP si alternano sullo stesso loop.
+# Stesso driver (psycopg 3, modalità async) e impostazioni del profilo batch.
+# NullPool: asyncio.run crea un loop nuovo a ogni run e una connessione
+# async non sopravvive al suo loop; AsyncDBSession tiene quindi UNA
+# connessione per tutto il blocco (i commit intermedi non la rilasciano).
+_async_engine = None
+
+
+def get_async_engine():
+    """AsyncEngine (creato al primo uso)."""
+    global _async_engine
+    if _async_engine is None:
+        with _engines_lock:
+            if _async_engine is None:
+                _async_engine = create_async_engine(
+                    DATABASE_URL,
+                    echo=SQL_ECHO,
+                    poolclass=NullPool,
+                    connect_args=_connect_args(ENGINE_PROFILES["batch"], "azurenet_engine_async"),
+                )
+    return _async_engine
+
+
+class AsyncDBSession:
+    """
+    Come DBSession, per coroutine: `async with AsyncDBSession() as db`.
+    Commit a fine blocco, rollback su errore; una connessione per blocco.
+    """
+    async def __aenter__(self):
+        self.conn = await get_async_engine().connect()
+        self.db = AsyncSession(bind=self.conn, autoflush=False, expire_on_commit=False)
+        return self.db
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type:
+                await self.db.rollback()
+                logging.exception("DB ERROR in azurenet-engine (async)")
+            else:
+                await self.db.commit()
+        finally:
+            try:
+                await self.db.close()
+            finally:
+                await self.conn.close()
@@ -0,0 +1,123 @@
+"""AutoSuperMarket (ASM) — caricamento contesto batch per asm_sync_job.
+
+Stesso schema di autoscout_context: un numero costante di query set-based
+per batch claimato (chiavi: id_auto / dealer_id / codice_motornet_uni)
+invece di 6 SELECT per listing.
+"""
+
+import logging
+from dataclasses import dataclass, field
+
+from sqlalchemy import text
+
+from app.jobs.marketplace_engine import by_key, load_dealer_configs as _load_dealer_configs, load_vetrina_media
+from app.jobs.mnet_publish_details import load_publish_details
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AsmListingContext:
+    """Tutto ciò che serve per costruire il payload ASM di UN listing."""
+    listing: dict
+    auto: dict | None = None
+    usatoin: dict | None = None
+    det_base: dict | None = None
+    det_auto: dict | None = None
+    config: dict | None = None
+    image_urls: list[str] = field(default_factory=list)
+
+
+@dataclass
+class AsmBatchContext:
+    listings: dict = field(default_factory=dict)        # asm_listings.id → AsmListingContext
+
+    def get(self, listing_id) -> AsmListingContext | None:
+        return self.listings.get(listing_id)
+
+
+def load_dealer_configs(session, dealer_ids) -> dict:
+    """dealer_id → asm_dealer_config (solo enabled)."""
+    return _load_dealer_configs(session, dealer_ids, table="asm_dealer_config")
+
+
+def load_asm_contexts(session, listings) -> AsmBatchContext:
+    """
+    Carica il contesto per tutti i listing del batch.
+    I listing con dati mancanti hanno i campi a None: la validazione
+    (e i RuntimeError) resta nel job.
+    """
+    batch = AsmBatchContext()
+
+    for listing in listings:
+        batch.listings[listing["id"]] = AsmListingContext(listing=dict(listing))
+
+    if not batch.listings:
+        return batch
+
+    id_autos = sorted({str(l["id_auto"]) for l in listings if l["id_auto"] is not None})
+
+    autos = by_key(
+        session.execute(
+            text("""
+                SELECT *
+                FROM azlease_usatoauto
+                WHERE id = ANY(CAST(:ids AS uuid[]))
+            """),
+            {"ids": id_autos},
+        ).mappings().all(),
+        "id",
+        as_str=True,
+    )
+
+    media = load_vetrina_media(session, id_autos)
+
+    usatoin_ids = sorted({a["id_usatoin"] for a in autos.values() if a.get("id_usatoin") is not None}, key=str)
+    usatoin = {}
+    if usatoin_ids:
+        usatoin = by_key(
+            session.execute(
+                text("""
+                    SELECT *
+                    FROM azlease_usatoin
+                    WHERE id = ANY(:ids)
+                """),
+                {"ids": usatoin_ids},
+            ).mappings().all(),
+            "id",
+        )
+
+    codici = sorted({a["codice_motornet"] for a in autos.values() if a.get("codice_motornet")})
+    details = load_publish_details(session, codici)
+
+    configs = load_dealer_configs(session, (l["dealer_id"] for l in listings))
+
+    for ctx in batch.listings.values():
+        key = str(ctx.listing["id_auto"])
+        auto = autos.get(key)
+
+        ctx.config = configs.get(ctx.listing["dealer_id"])
+        ctx.image_urls = [m["media_url"] for m in media.get(key, []) if m.get("media_url")]
+
+        if not auto:
+            continue
+
+        ctx.auto = auto
+        ctx.usatoin = usatoin.get(auto.get("id_usatoin"))
+
+        det = details.get(auto.get("codice_motornet"))
+        if det:
+            ctx.det_base = det["base"]
+            # Dettagli AUTO (usati solo per catalog=auto)
+            if det["base"].get("catalog") == "auto":
+                ctx.det_auto = det["det_auto"]
+
+    logger.info(
+        "[ASM_CTX] Contesto batch caricato | listings=%d auto=%d codici=%d dealer=%d",
+        len(batch.listings),
+        len(autos),
+        len(codici),
+        len(configs),
+    )
+
+    return batch
@@ -1,273 +1,122 @@
 """AutoSuperMarket (ASM) — sync job per annunci usato.
 
 Polling DB queue: PENDING_CREATE / UPDATE_REQUIRED / DELETE_REQUIRED
-Pattern identico a autoscout_sync.py ma senza model mapping e image pre-upload.
+Claim, worker pool, quote, retry e metriche: marketplace_engine (come AS24).
+Qui solo payload builder + client ASM (senza model mapping e image pre-upload).
 """
 
 import logging
-from datetime import datetime
+import os
+from dataclasses import dataclass
 
-from sqlalchemy import text
-
-from app.database import SessionLocal
 from app.external.autosupermarket import (
     create_listing,
     update_listing,
     delete_listing,
-    AsmClientError,
 )
 from app.external.autosupermarket_payload import build_asm_payload
+from app.jobs.asm_context import load_asm_contexts, load_dealer_configs
+from app.jobs.marketplace_engine import MarketplaceChannel, PublishLimiter, Stage, run_channel
 
 logger = logging.getLogger(__name__)
 
 BATCH_SIZE = 10
 
+ASM_WORKERS = int(os.getenv("ASM_WORKERS", "1"))
+MAX_BATCH_SIZE = int(os.getenv("ASM_MAX_BATCH_SIZE", "20"))
+MAX_CONCURRENCY = int(os.getenv("ASM_MAX_CONCURRENCY", "2"))
+MAX_CONCURRENCY_PER_DEALER = int(os.getenv("ASM_MAX_CONCURRENCY_PER_DEALER", "1"))
 
-def asm_sync_job():
-    session = SessionLocal()
-
-    try:
-        # ============================================================
-        # 0. DELETE_REQUIRED — priorità assoluta
-        # ============================================================
-        delete_rows = session.execute(
-            text("""
-                SELECT *
-                FROM asm_listings
-                WHERE status = 'DELETE_REQUIRED'
-                ORDER BY requested_at
-                FOR UPDATE SKIP LOCKED
-                LIMIT :limit
-            """),
-            {"limit": BATCH_SIZE},
-        ).mappings().all()
-
-        for row in delete_rows:
-            row_id = row["id"]
-            asm_listing_id = row.get("asm_listing_id")
-
-            # Carica config dealer
-            config = session.execute(
-                text("""
-                    SELECT *
-                    FROM asm_dealer_config
-                    WHERE dealer_id = :dealer_id AND enabled = true
-                """),
-                {"dealer_id": row["dealer_id"]},
-            ).mappings().first()
-
-            if not config:
-                logger.warning("[ASM_DELETE] Config mancante, elimino record locale | id=%s", row_id)
-                session.execute(text("DELETE FROM asm_listings WHERE id = :id"), {"id": row_id})
-                session.commit()
-                continue
+publish_limiter = PublishLimiter(MAX_CONCURRENCY, MAX_CONCURRENCY_PER_DEALER)
 
-            if config.get("disable_asm_listing_sync"):
-                logger.info("[ASM_DELETE] Skip API (solo pubblicazione) | id=%s", row_id)
-                session.execute(text("DELETE FROM asm_listings WHERE id = :id"), {"id": row_id})
-                session.commit()
-                continue
 
-            if asm_listing_id:
-                try:
-                    delete_listing(token=config["api_token"], listing_id=asm_listing_id)
-                except AsmClientError as exc:
-                    logger.warning("[ASM_DELETE] Errore API | id=%s err=%s", row_id, exc)
-                    session.execute(
-                        text("""
-                            UPDATE asm_listings
-                            SET status = 'ERROR', last_error = :err,
-                                retry_count = retry_count + 1, last_attempt_at = NOW()
-                            WHERE id = :id
-                        """),
-                        {"id": row_id, "err": str(exc)},
-                    )
-                    session.commit()
-                    continue
+@dataclass
+class AsmPublishPlan:
+    """Record tra gli stadi build → upsert."""
+    row_id: object
+    asm_listing_id: int | None
+    token: str
+    payload: dict
 
-            session.execute(text("DELETE FROM asm_listings WHERE id = :id"), {"id": row_id})
-            session.commit()
 
-        # ============================================================
-        # 1. PENDING_CREATE + UPDATE_REQUIRED
-        # ============================================================
-        listings = session.execute(
-            text("""
-                SELECT *
-                FROM asm_listings
-                WHERE status IN ('PENDING_CREATE', 'UPDATE_REQUIRED')
-                ORDER BY requested_at
-                FOR UPDATE SKIP LOCKED
-                LIMIT :limit
-            """),
-            {"limit": BATCH_SIZE},
-        ).mappings().all()
+class AsmChannel(MarketplaceChannel):
+    name = "ASM"
+    table = "asm_listings"
+    config_table = "asm_dealer_config"
+    remote_id_column = "asm_listing_id"
+    skip_sync_flag = "disable_asm_listing_sync"
 
-        if not listings:
-            session.commit()
-            return
+    batch_size = BATCH_SIZE
+    max_batch_size = MAX_BATCH_SIZE
+    workers = ASM_WORKERS
+    limiter = publish_limiter
 
-        for listing in listings:
-            row_id = listing["id"]
-            dealer_id = listing["dealer_id"]
-            id_auto = listing["id_auto"]
-            asm_listing_id = listing.get("asm_listing_id")
+    def load_configs(self, session, dealer_ids) -> dict:
+        return load_dealer_configs(session, dealer_ids)
 
-            logger.info("[ASM_SYNC] Processing | id=%s dealer=%s auto=%s status=%s",
-                        row_id, dealer_id, id_auto, listing["status"])
+    def load_contexts(self, session, listings):
+        return load_asm_contexts(session, listings)
 
-            # Skip UPDATE se sync disabilitato
-            if listing["status"] == "UPDATE_REQUIRED":
-                skip_cfg = session.execute(
-                    text("""
-                        SELECT COALESCE(disable_asm_listing_sync, false) AS v
-                        FROM asm_dealer_config
-                        WHERE dealer_id = :dealer_id AND enabled = true
-                    """),
-                    {"dealer_id": dealer_id},
-                ).mappings().first()
+    def delete_remote(self, config: dict, listing: dict) -> None:
+        delete_listing(token=config["api_token"], listing_id=listing["asm_listing_id"])
 
-                if skip_cfg and skip_cfg.get("v"):
-                    logger.info("[ASM_SYNC] Skip UPDATE (solo pubblicazione) | id=%s", row_id)
-                    session.execute(
-                        text("""
-                            UPDATE asm_listings
-                            SET status = 'PUBLISHED', last_attempt_at = NOW(), last_error = NULL
-                            WHERE id = :id
-                        """),
-                        {"id": row_id},
-                    )
-                    session.commit()
-                    continue
+    def stages(self) -> list[Stage]:
+        return [
+            Stage("build", self.build, quota=False),
+            Stage("upsert", self.upsert),
+        ]
 
-            try:
-                # Carica auto
-                auto = session.execute(
-                    text("SELECT * FROM azlease_usatoauto WHERE id = :id"),
-                    {"id": id_auto},
-                ).mappings().first()
+    def build(self, listing: dict, ctx, batch) -> AsmPublishPlan:
+        if not ctx.auto:
+            raise RuntimeError("Auto tecnica non trovata")
 
-                if not auto:
-                    raise RuntimeError("Auto tecnica non trovata")
+        if not ctx.usatoin:
+            raise RuntimeError("Contesto usatoin non trovato")
 
-                # Carica usatoin
-                usatoin = session.execute(
-                    text("SELECT * FROM azlease_usatoin WHERE id = :id"),
-                    {"id": auto["id_usatoin"]},
-                ).mappings().first()
+        if not ctx.det_base:
+            raise RuntimeError(f"Dettagli Motornet non trovati: {ctx.auto['codice_motornet']}")
 
-                if not usatoin:
-                    raise RuntimeError("Contesto usatoin non trovato")
+        config = ctx.config
+        if not config:
+            raise RuntimeError("Configurazione ASM dealer mancante")
 
-                # Carica dettagli Motornet (vista unificata)
-                det_base = session.execute(
-                    text("""
-                        SELECT * FROM v_mnet_dettagli_unificati
-                        WHERE codice_motornet_uni = :codice
-                    """),
-                    {"codice": auto["codice_motornet"]},
-                ).mappings().first()
+        # Build payload
+        payload = build_asm_payload(
+            auto=ctx.auto,
+            usatoin=ctx.usatoin,
+            det_base=ctx.det_base,
+            det_auto=ctx.det_auto,
+            dealer_asm_id=config["dealer_asm_id"],
+            images=ctx.image_urls or None,
+        )
 
-                if not det_base:
-                    raise RuntimeError(f"Dettagli Motornet non trovati: {auto['codice_motornet']}")
+        return AsmPublishPlan(
+            row_id=listing["id"],
+            asm_listing_id=listing.get("asm_listing_id"),
+            token=config["api_token"],
+            payload=payload,
+        )
 
-                # Dettagli AUTO (solo per catalog=auto)
-                det_auto = None
-                if det_base.get("catalog") == "auto":
-                    det_auto = session.execute(
-                        text("""
-                            SELECT tipo, alimentazione, cambio, kw, cilindrata,
-                                   cilindri, peso_vuoto, posti, porte
-                            FROM mnet_dettagli_usato
-                            WHERE codice_motornet = :codice
-                        """),
-                        {"codice": auto["codice_motornet"]},
-                    ).mappings().first()
+    def upsert(self, plan: AsmPublishPlan):
+        # CREATE o UPDATE
+        if not plan.asm_listing_id:
+            # POST → crea annuncio
+            new_id = create_listing(token=plan.token, payload=plan.payload)
+            logger.info("[ASM_SYNC] Creato listing ASM | id=%s asm_listing_id=%s", plan.row_id, new_id)
+            return new_id
 
-                # Config ASM dealer
-                config = session.execute(
-                    text("""
-                        SELECT * FROM asm_dealer_config
-                        WHERE dealer_id = :dealer_id AND enabled = true
-                    """),
-                    {"dealer_id": dealer_id},
-                ).mappings().first()
+        # PATCH → aggiorna annuncio
+        update_listing(token=plan.token, listing_id=plan.asm_listing_id, payload=plan.payload)
+        logger.info("[ASM_SYNC] Aggiornato listing ASM | id=%s asm_listing_id=%s", plan.row_id, plan.asm_listing_id)
+        return plan.asm_listing_id
 
-                if not config:
-                    raise RuntimeError("Configurazione ASM dealer mancante")
 
-                # Immagini dalla vetrina
-                images_rows = session.execute(
-                    text("""
-                        SELECT media_url
-                        FROM usato_vetrina
-                        WHERE id_auto = :id_auto
-                        ORDER BY sort_order, created_at
-                    """),
-                    {"id_auto": id_auto},
-                ).fetchall()
+ASM_CHANNEL = AsmChannel()
 
-                image_urls = [r[0] for r in images_rows if r[0]] if images_rows else []
 
-                # Build payload
-                payload = build_asm_payload(
-                    auto=dict(auto),
-                    usatoin=dict(usatoin),
-                    det_base=dict(det_base),
-                    det_auto=dict(det_auto) if det_auto else None,
-                    dealer_asm_id=config["dealer_asm_id"],
-                    images=image_urls or None,
-                )
-
-                # CREATE o UPDATE
-                if not asm_listing_id:
-                    # POST → crea annuncio
-                    new_id = create_listing(token=config["api_token"], payload=payload)
-                    session.execute(
-                        text("""
-                            UPDATE asm_listings
-                            SET status = 'PUBLISHED', asm_listing_id = :asm_id,
-                                last_attempt_at = NOW(), last_error = NULL, retry_count = 0
-                            WHERE id = :id
-                        """),
-                        {"id": row_id, "asm_id": new_id},
-                    )
-                    logger.info("[ASM_SYNC] Creato listing ASM | id=%s asm_listing_id=%s", row_id, new_id)
-                else:
-                    # PATCH → aggiorna annuncio
-                    update_listing(token=config["api_token"], listing_id=asm_listing_id, payload=payload)
-                    session.execute(
-                        text("""
-                            UPDATE asm_listings
-                            SET status = 'PUBLISHED', last_attempt_at = NOW(),
-                                last_error = NULL, retry_count = 0
-                            WHERE id = :id
-                        """),
-                        {"id": row_id},
-                    )
-                    logger.info("[ASM_SYNC] Aggiornato listing ASM | id=%s asm_listing_id=%s", row_id, asm_listing_id)
-
-                session.commit()
-
-            except Exception as exc:
-                logger.exception("[ASM_SYNC] Errore processing | id=%s", row_id)
-                session.rollback()
-                session.execute(
-                    text("""
-                        UPDATE asm_listings
-                        SET status = 'ERROR', last_error = :err,
-                            retry_count = retry_count + 1, last_attempt_at = NOW()
-                        WHERE id = :id
-                    """),
-                    {"id": row_id, "err": str(exc)[:500]},
-                )
-                session.commit()
-
-    except Exception:
-        logger.exception("[ASM_SYNC] Errore fatale nel job")
-        session.rollback()
-    finally:
-        session.close()
+def asm_sync_job():
+    """Ritorna il numero di righe lavorate (usato dal dispatcher per rilanciare)."""
+    return run_channel(ASM_CHANNEL)
 
 
 if __name__ == "__main__":
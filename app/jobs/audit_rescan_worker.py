@@ -10,11 +10,11 @@ from __future__ import annotations
 
 import concurrent.futures as cf
 import logging
-import os
 import time
 
 import psycopg
 
+from app.database import psycopg_connection
 from app.jobs.audit_scanner import audit_domain
 
 logger = logging.getLogger(__name__)
@@ -23,10 +23,6 @@ BATCH_SIZE = 50
 WORKERS = 10
 
 
-def _get_db_url() -> str:
-    return os.environ["DATABASE_URL"]
-
-
 def _fetch_pending(conn: psycopg.Connection, limit: int) -> list[str]:
     with conn.cursor() as cur:
         cur.execute(
@@ -114,11 +110,9 @@ def _insert_scan(conn: psycopg.Connection, res, triggered_by: str = "worker_resc
 
 def audit_rescan_batch():
     """Processa un batch di domini pending. Chiamato dallo scheduler."""
-    db_url = _get_db_url()
-
-    conn = psycopg.connect(db_url, prepare_threshold=None)
-    pending = _fetch_pending(conn, BATCH_SIZE)
-    conn.close()
+    # Connessioni dal pool condiviso (app.database): niente connect / handshake SSL per run
+    with psycopg_connection() as conn:
+        pending = _fetch_pending(conn, BATCH_SIZE)
 
     if not pending:
         return  # niente da fare
@@ -139,15 +133,15 @@ def audit_rescan_batch():
 
     # Persist batch
     ok = err = 0
-    conn = psycopg.connect(db_url, prepare_threshold=None)
-    for res in results:
-        try:
-            _insert_scan(conn, res)
-            ok += 1
-        except Exception as e:
-            err += 1
-            logger.warning(f"[audit-rescan] db insert {res.domain}: {e}")
-    conn.close()
+    with psycopg_connection() as conn:
+        for res in results:
+            try:
+                _insert_scan(conn, res)
+                ok += 1
+            except Exception as e:
+                err += 1
+                conn.rollback()  # transazione abortita: le insert successive devono poter andare
+                logger.warning(f"[audit-rescan] db insert {res.domain}: {e}")
 
     elapsed = time.time() - t0
     logger.info(f"[audit-rescan] batch done: ok={ok} err={err} in {elapsed:.1f}s")
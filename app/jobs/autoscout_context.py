@@ -0,0 +1,204 @@
+"""AutoScout24 — caricamento contesto batch per autoscout_sync_job.
+
+Invece di 12+ SELECT per ogni listing, carica tutto il contesto necessario
+al payload builder per l'intero batch claimato con query set-based
+(chiavi: id_auto / dealer_id / codice_motornet_uni).
+I dettagli Motornet arrivano dallo snapshot mnet_publish_details.
+Le tabelle di mapping AS24 non si interrogano qui: vedi autoscout_reference_cache.
+
+Il numero di query per batch è costante, indipendente da BATCH_SIZE.
+"""
+
+import logging
+from dataclasses import dataclass, field
+
+from sqlalchemy import text
+
+from app.jobs.autoscout_reference_cache import AutoscoutReferenceCache, get_reference_cache
+from app.jobs.marketplace_engine import by_key, load_dealer_configs as _load_dealer_configs, load_vetrina_media
+from app.jobs.mnet_publish_details import load_publish_details
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================
+# CONTESTI TIPIZZATI
+# ============================================================
+
+@dataclass
+class AutoscoutListingContext:
+    """Tutto ciò che serve per costruire il payload di UN listing."""
+    listing: dict
+    auto: dict | None = None
+    autoscout_attrs: dict | None = None
+    usatoin: dict | None = None
+    det_base: dict | None = None
+    det_auto: dict | None = None
+    det_vic: dict | None = None
+    config: dict | None = None
+    mapping: dict | None = None
+    equipment_ids: list[int] = field(default_factory=list)
+    media: list[dict] = field(default_factory=list)
+
+
+@dataclass
+class AutoscoutBatchContext:
+    """Contesto dell'intero batch + cache delle mappe di riferimento AS24."""
+    ref: AutoscoutReferenceCache
+    listings: dict = field(default_factory=dict)        # autoscout_listings.id → AutoscoutListingContext
+    customer_ids: dict = field(default_factory=dict)    # dealer_id → customerId AS24 (o errore di risoluzione)
+
+    def get(self, listing_id) -> AutoscoutListingContext | None:
+        return self.listings.get(listing_id)
+
+    def customer_id(self, dealer_id) -> str:
+        """customerId AS24 del dealer, risolto una volta per batch (AutoscoutChannel.load_contexts)."""
+        value = self.customer_ids.get(dealer_id)
+        if isinstance(value, Exception):
+            raise RuntimeError(f"customerId AS24 non risolto: {value}") from value
+        if not value:
+            raise RuntimeError("customerId AS24 non risolto")
+        return value
+
+
+# ============================================================
+# QUERY SET-BASED
+# ============================================================
+
+def load_dealer_configs(session, dealer_ids) -> dict:
+    """dealer_id → autoscout_dealer_config (solo enabled)."""
+    return _load_dealer_configs(session, dealer_ids, table="autoscout_dealer_config")
+
+
+def load_autoscout_contexts(session, listings) -> AutoscoutBatchContext:
+    """
+    Carica il contesto per tutti i listing del batch.
+    I listing con dati mancanti hanno i campi a None: la validazione
+    (e i RuntimeError) resta nel job, come prima.
+    Mapping modello / fuel / bodyType arrivano dalla cache di processo.
+    """
+    ref = get_reference_cache(session)
+    batch = AutoscoutBatchContext(ref=ref)
+
+    for listing in listings:
+        batch.listings[listing["id"]] = AutoscoutListingContext(listing=dict(listing))
+
+    if not batch.listings:
+        return batch
+
+    id_autos = sorted({str(l["id_auto"]) for l in listings if l["id_auto"] is not None})
+
+    # ------------------------------------------------------------
+    # 1️⃣ Auto tecnica + attributi AS24 + equipment + vetrina (per id_auto)
+    # ------------------------------------------------------------
+    autos = by_key(
+        session.execute(
+            text("""
+                SELECT *
+                FROM azlease_usatoauto
+                WHERE id = ANY(CAST(:ids AS uuid[]))
+            """),
+            {"ids": id_autos},
+        ).mappings().all(),
+        "id",
+        as_str=True,
+    )
+
+    attrs = by_key(
+        session.execute(
+            text("""
+                SELECT
+                    id_auto,
+                    as24_body_color_id,
+                    as24_upholstery_color_id,
+                    as24_upholstery_type_code,
+                    is_metallic
+                FROM autoscout_vehicle_attributes
+                WHERE id_auto = ANY(CAST(:ids AS uuid[]))
+            """),
+            {"ids": id_autos},
+        ).mappings().all(),
+        "id_auto",
+        as_str=True,
+    )
+
+    equipment: dict = {}
+    for row in session.execute(
+        text("""
+            SELECT DISTINCT id_auto, as24_equipment_id
+            FROM public.autousato_equipaggiamenti
+            WHERE id_auto = ANY(CAST(:ids AS uuid[]))
+              AND presente = true
+              AND as24_equipment_id IS NOT NULL
+        """),
+        {"ids": id_autos},
+    ).mappings().all():
+        equipment.setdefault(str(row["id_auto"]), []).append(row["as24_equipment_id"])
+
+    media = load_vetrina_media(session, id_autos)
+
+    # ------------------------------------------------------------
+    # 2️⃣ Contesto commerciale (usatoin)
+    # ------------------------------------------------------------
+    usatoin_ids = sorted({a["id_usatoin"] for a in autos.values() if a.get("id_usatoin") is not None}, key=str)
+    usatoin = {}
+    if usatoin_ids:
+        usatoin = by_key(
+            session.execute(
+                text("""
+                    SELECT *
+                    FROM azlease_usatoin
+                    WHERE id = ANY(:ids)
+                """),
+                {"ids": usatoin_ids},
+            ).mappings().all(),
+            "id",
+        )
+
+    # ------------------------------------------------------------
+    # 3️⃣ Dettagli Motornet (snapshot mnet_publish_details, point read)
+    # ------------------------------------------------------------
+    codici = sorted({a["codice_motornet"] for a in autos.values() if a.get("codice_motornet")})
+    details = load_publish_details(session, codici)
+
+    # ------------------------------------------------------------
+    # 4️⃣ Config dealer
+    # ------------------------------------------------------------
+    configs = load_dealer_configs(session, (l["dealer_id"] for l in listings))
+
+    # ------------------------------------------------------------
+    # 5️⃣ Assemblaggio per listing
+    # ------------------------------------------------------------
+    for ctx in batch.listings.values():
+        key = str(ctx.listing["id_auto"])
+        auto = autos.get(key)
+
+        ctx.config = configs.get(ctx.listing["dealer_id"])
+        ctx.equipment_ids = equipment.get(key, [])
+        ctx.media = media.get(key, [])
+
+        if not auto:
+            continue
+
+        ctx.auto = auto
+        if key in attrs:
+            ctx.autoscout_attrs = {k: v for k, v in attrs[key].items() if k != "id_auto"}
+        ctx.usatoin = usatoin.get(auto.get("id_usatoin"))
+
+        codice = auto.get("codice_motornet")
+        ctx.mapping = ref.model_mapping(codice)
+        det = details.get(codice)
+        if det:
+            ctx.det_base = det["base"]
+            ctx.det_auto = det["det_auto"]
+            ctx.det_vic = det["det_vic"]
+
+    logger.info(
+        "[AUTOSCOUT_CTX] Contesto batch caricato | listings=%d auto=%d codici=%d dealer=%d",
+        len(batch.listings),
+        len(autos),
+        len(codici),
+        len(configs),
+    )
+
+    return batch
@@ -2,6 +2,7 @@
 from typing import Optional, Tuple, Dict
 from sqlalchemy import text
 from app.database import SessionLocal
+from app.jobs.autoscout_reference_cache import invalidate_reference_cache
 
 
 # ============================================================
@@ -257,6 +258,7 @@ def populate_autoscout_model_map_v2():
 
     db.commit()
     db.close()
+    invalidate_reference_cache()
 
     print(f"[DONE] processed={len(rows)} inserted={inserted} skipped={skipped}")
 
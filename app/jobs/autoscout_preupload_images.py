@@ -10,6 +10,7 @@ from app.external.autoscout import (
     update_listing_images,
     AutoScoutClientError,
 )
+from app.jobs.marketplace_images import normalize_image
 
 logger = logging.getLogger(__name__)
 
@@ -122,10 +123,15 @@ def autoscout_preupload_images_job():
                 resp = requests.get(r["media_url"], timeout=15)
                 resp.raise_for_status()
 
+                image_bytes, content_type = normalize_image(
+                    resp.content,
+                    resp.headers.get("Content-Type", "image/jpeg").split(";")[0].lower(),
+                )
+
                 image_id = upload_image(
                     customer_id=customer_id,
-                    image_bytes=resp.content,
-                    content_type=resp.headers.get("Content-Type", "image/jpeg"),
+                    image_bytes=image_bytes,
+                    content_type=content_type,
                     test_mode=test_mode,
                 )
 
@@ -0,0 +1,172 @@
+"""AutoScout24 — cache in-process delle tabelle di riferimento.
+
+autoscout_fuel_map, autoscout_bodytype_map e autoscout_model_map_v2 sono
+piccole e quasi statiche: vengono caricate una volta per processo e servite
+con lookup O(1) (dict). autoscout_reference_models non è in cache: la usano
+solo i job batch di model alignment, con una query filtrata per run.
+
+Staleness check economico: firma = contatori modifiche di pg_stat_user_tables
+(n_tup_ins + n_tup_upd + n_tup_del) per le tabelle in cache, verificata al
+massimo ogni CHECK_INTERVAL_SECONDS. Nessuna scansione delle tabelle.
+
+Invalidazione esplicita: invalidate_reference_cache() dopo i job di model
+alignment (scrivono autoscout_model_map_v2).
+"""
+
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL_SECONDS = 60
+
+REFERENCE_TABLES = (
+    "autoscout_fuel_map",
+    "autoscout_bodytype_map",
+    "autoscout_model_map_v2",
+)
+
+
+class AutoscoutReferenceCache:
+    """Mappe AS24 versionate, thread-safe (i job APScheduler girano in thread)."""
+
+    def __init__(self, check_interval: int = CHECK_INTERVAL_SECONDS):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+
+        self.fuel_map: dict = {}            # mnet_alimentazione → {as24_primary_fuel_type, as24_fuel_category}
+        self.bodytype_map: dict = {}        # mnet_tipo → as24_bodytype_id (AUTO)
+        self.bodytype_map_vic: dict = {}    # mnet_tipo → as24_bodytype_id (vehicle_type = 'X')
+        self.model_map: dict = {}           # codice_motornet_uni → {as24_make_id, as24_model_id, as24_vehicle_type}
+
+    @property
+    def version(self):
+        return self._version
+
+    # ------------------------------------------------------------
+    # Lookup O(1)
+    # ------------------------------------------------------------
+    def fuel(self, mnet_alimentazione: str | None) -> dict | None:
+        return self.fuel_map.get(mnet_alimentazione)
+
+    def bodytype(self, mnet_tipo: str | None) -> int | None:
+        return self.bodytype_map.get(mnet_tipo)
+
+    def bodytype_vic(self, mnet_tipo: str | None) -> int | None:
+        return self.bodytype_map_vic.get(mnet_tipo)
+
+    def model_mapping(self, codice_motornet_uni: str | None) -> dict | None:
+        return self.model_map.get(codice_motornet_uni)
+
+    # ------------------------------------------------------------
+    # Versioning
+    # ------------------------------------------------------------
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version = None
+            self._checked_at = 0.0
+        logger.info("[AUTOSCOUT_REF_CACHE] Invalidata")
+
+    def _signature(self, session) -> tuple:
+        rows = session.execute(
+            text("""
+                SELECT relname, n_tup_ins + n_tup_upd + n_tup_del AS changes
+                FROM pg_stat_user_tables
+                WHERE schemaname = 'public'
+                  AND relname = ANY(:tables)
+                ORDER BY relname
+            """),
+            {"tables": list(REFERENCE_TABLES)},
+        ).all()
+        return tuple((r[0], r[1]) for r in rows)
+
+    def ensure_fresh(self, session) -> "AutoscoutReferenceCache":
+        """Ricarica le mappe solo se la firma è cambiata (o dopo invalidate)."""
+        now = time.monotonic()
+
+        with self._lock:
+            if self._version is not None and now - self._checked_at < self.check_interval:
+                return self
+
+            signature = self._signature(session)
+            self._checked_at = now
+
+            if signature == self._version:
+                return self
+
+            self._load(session)
+            self._version = signature
+
+        return self
+
+    def _load(self, session) -> None:
+        t0 = time.monotonic()
+
+        fuel_map = {
+            r["mnet_alimentazione"]: dict(r)
+            for r in session.execute(
+                text("""
+                    SELECT
+                        mnet_alimentazione,
+                        as24_primary_fuel_type,
+                        as24_fuel_category
+                    FROM autoscout_fuel_map
+                """)
+            ).mappings().all()
+        }
+
+        bodytype_map: dict = {}
+        bodytype_map_vic: dict = {}
+        for r in session.execute(
+            text("""
+                SELECT mnet_tipo, vehicle_type, as24_bodytype_id
+                FROM public.autoscout_bodytype_map
+            """)
+        ).mappings().all():
+            bodytype_map.setdefault(r["mnet_tipo"], r["as24_bodytype_id"])
+            if r["vehicle_type"] == "X":
+                bodytype_map_vic[r["mnet_tipo"]] = r["as24_bodytype_id"]
+
+        model_map = {
+            r["codice_motornet_uni"]: dict(r)
+            for r in session.execute(
+                text("""
+                    SELECT
+                        codice_motornet_uni,
+                        as24_make_id,
+                        as24_model_id,
+                        as24_vehicle_type
+                    FROM public.autoscout_model_map_v2
+                """)
+            ).mappings().all()
+        }
+
+        self.fuel_map = fuel_map
+        self.bodytype_map = bodytype_map
+        self.bodytype_map_vic = bodytype_map_vic
+        self.model_map = model_map
+
+        logger.info(
+            "[AUTOSCOUT_REF_CACHE] Caricata | fuel=%d bodytype=%d model_map=%d in %.2fs",
+            len(fuel_map),
+            len(bodytype_map),
+            len(model_map),
+            time.monotonic() - t0,
+        )
+
+
+# Singleton di processo
+reference_cache = AutoscoutReferenceCache()
+
+
+def get_reference_cache(session) -> AutoscoutReferenceCache:
+    return reference_cache.ensure_fresh(session)
+
+
+def invalidate_reference_cache() -> None:
+    reference_cache.invalidate()
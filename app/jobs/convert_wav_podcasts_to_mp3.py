@@ -2,6 +2,8 @@
 One-shot: converte tutti i podcast in formato WAV → MP3.
 Scarica il WAV da Supabase, converte con ffmpeg, re-uploada come MP3,
 aggiorna la riga vehicle_podcasts.
+Con STORAGE_CACHE_DIR impostata i WAV restano in cache su disco: un
+rilancio dopo errori non li riscarica.
 
 Uso:
     python app/jobs/convert_wav_podcasts_to_mp3.py
@@ -18,7 +20,6 @@ import sys
 import tempfile
 from pathlib import Path
 
-import httpx
 from dotenv import load_dotenv
 from sqlalchemy import text
 
@@ -27,7 +28,7 @@ if str(_PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(_PROJECT_ROOT))
 
 from app.database import SessionLocal
-from app.storage import upload_bytes_and_get_public_url
+from app.storage import open_download_buffer, storage_cache_stats, upload_bytes_and_get_public_url
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
@@ -35,7 +36,8 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(mess
 PODCAST_BUCKET = "vehicle_podcasts"
 
 
-def convert_wav_to_mp3(wav_bytes: bytes) -> bytes:
+def convert_wav_to_mp3(wav_bytes) -> bytes:
+    """wav_bytes: bytes o buffer (mmap dalla cache storage)."""
     with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tf:
         tf.write(wav_bytes)
         wav_path = tf.name
@@ -79,24 +81,22 @@ def main():
         row_id = row.id
         id_auto = row.id_auto
         wav_url = row.audio_url.split("?")[0]  # rimuovi cache-bust
+        wav_path = wav_url.split(f"/{PODCAST_BUCKET}/", 1)[-1]
 
         logging.info(f"[{id_auto}] download WAV...")
         try:
-            with httpx.Client(timeout=60) as client:
-                r = client.get(wav_url)
-                r.raise_for_status()
-                wav_bytes = r.content
+            with open_download_buffer(PODCAST_BUCKET, wav_path) as wav_bytes:
+                wav_size = len(wav_bytes)
+                logging.info(f"[{id_auto}] converting {wav_size} bytes WAV → MP3...")
+                try:
+                    mp3_bytes = convert_wav_to_mp3(wav_bytes)
+                except Exception as e:
+                    logging.error(f"[{id_auto}] ffmpeg failed: {e}")
+                    continue
         except Exception as e:
             logging.error(f"[{id_auto}] download failed: {e}")
             continue
 
-        logging.info(f"[{id_auto}] converting {len(wav_bytes)} bytes WAV → MP3...")
-        try:
-            mp3_bytes = convert_wav_to_mp3(wav_bytes)
-        except Exception as e:
-            logging.error(f"[{id_auto}] ffmpeg failed: {e}")
-            continue
-
         logging.info(f"[{id_auto}] uploading MP3 ({len(mp3_bytes)} bytes)...")
         try:
             mp3_url = upload_bytes_and_get_public_url(
@@ -123,13 +123,20 @@ def main():
                 "row_id": row_id,
             })
             db.commit()
-            logging.info(f"[{id_auto}] OK: {len(wav_bytes)} WAV → {len(mp3_bytes)} MP3 ({100 - len(mp3_bytes) * 100 // len(wav_bytes)}% ridotto)")
+            logging.info(f"[{id_auto}] OK: {wav_size} WAV → {len(mp3_bytes)} MP3 ({100 - len(mp3_bytes) * 100 // wav_size}% ridotto)")
         except Exception as e:
             db.rollback()
             logging.error(f"[{id_auto}] DB update failed: {e}")
         finally:
             db.close()
 
+    stats = storage_cache_stats()
+    if stats:
+        logging.info(
+            "Cache storage: hit rate %.0f%% (%d hit, %d rivalidati, %d miss)",
+            stats["hit_rate"] * 100, stats["hits"], stats["revalidated"], stats["misses"],
+        )
+
 
 if __name__ == "__main__":
     main()
@@ -22,7 +22,7 @@ from openai import OpenAI
 from sqlalchemy import text
 
 from app.database import SessionLocal
-from app.storage import upload_bytes_and_get_public_url
+from app.storage import upload_file_and_get_public_url
 
 logger = logging.getLogger(__name__)
 
@@ -146,28 +146,23 @@ def _preprocess_tts(dialogue, domain):
         dialogue = re.compile(re.escape(c), re.IGNORECASE).sub(ph, dialogue)
     return dialogue
 
-def _pcm_to_wav(pcm, sr=24000):
+def _write_wav(pcm, wav_path, sr=24000):
     nc, bps = 1, 16
     br = sr * nc * bps // 8
     ba = nc * bps // 8
-    fmt = struct.pack("<4sIHHIIHH", b"fmt ", 16, 1, nc, sr, br, ba, bps)
-    dat = struct.pack("<4sI", b"data", len(pcm)) + pcm
-    return struct.pack("<4sI4s", b"RIFF", 36 + len(pcm), b"WAVE") + fmt + dat
-
-def _wav_to_mp3(wav_bytes):
+    with open(wav_path, "wb") as f:
+        f.write(struct.pack("<4sI4s", b"RIFF", 36 + len(pcm), b"WAVE"))
+        f.write(struct.pack("<4sIHHIIHH", b"fmt ", 16, 1, nc, sr, br, ba, bps))
+        f.write(struct.pack("<4sI", b"data", len(pcm)))
+        f.write(pcm)
+
+def _wav_to_mp3(wav_path):
+    mp3_path = wav_path.with_suffix(".mp3")
     try:
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tf:
-            tf.write(wav_bytes); wav_path = tf.name
-        mp3_path = wav_path.replace(".wav", ".mp3")
-        try:
-            subprocess.run(["ffmpeg", "-y", "-i", wav_path, "-codec:a", "libmp3lame",
-                            "-b:a", "128k", "-ar", "24000", mp3_path],
-                           check=True, capture_output=True, timeout=120)
-            return Path(mp3_path).read_bytes()
-        finally:
-            for p in (wav_path, mp3_path):
-                try: os.remove(p)
-                except: pass
+        subprocess.run(["ffmpeg", "-y", "-i", str(wav_path), "-codec:a", "libmp3lame",
+                        "-b:a", "128k", "-ar", "24000", str(mp3_path)],
+                       check=True, capture_output=True, timeout=120)
+        return mp3_path
     except Exception as e:
         logger.warning("[DEALER-PODCAST] ffmpeg failed: %s", e)
         return None
@@ -317,16 +312,21 @@ def _process_dealer(dealer_public_id, attempts):
     pcm = base64.b64decode(b64)
     duration_sec = max(1, int(len(pcm) / 48000))
 
-    wav = _pcm_to_wav(pcm)
-    mp3 = _wav_to_mp3(wav)
-    audio_bytes = mp3 if mp3 else wav
-    audio_mime = "audio/mpeg" if mp3 else "audio/wav"
-    ext = "mp3" if mp3 else "wav"
-
-    filename = f"dealer_{dealer_public_id}.{ext}"
-    audio_url = upload_bytes_and_get_public_url(
-        bucket=PODCAST_BUCKET, path=filename, content=audio_bytes, content_type=audio_mime,
-    )
+    # WAV / MP3 su file temporanei, upload in streaming (resumable se grande)
+    with tempfile.TemporaryDirectory(prefix="dealer-podcast-") as tmp_dir:
+        wav_path = Path(tmp_dir) / f"dealer_{dealer_public_id}.wav"
+        _write_wav(pcm, wav_path)
+        del pcm
+        mp3_path = _wav_to_mp3(wav_path)
+        audio_path = mp3_path or wav_path
+        audio_mime = "audio/mpeg" if mp3_path else "audio/wav"
+        ext = "mp3" if mp3_path else "wav"
+        audio_size = audio_path.stat().st_size
+
+        filename = f"dealer_{dealer_public_id}.{ext}"
+        audio_url = upload_file_and_get_public_url(
+            bucket=PODCAST_BUCKET, path=filename, file_path=audio_path, content_type=audio_mime,
+        )
     audio_url_v = f"{audio_url}?v={int(datetime.utcnow().timestamp())}"
 
     # UPDATE ready
@@ -342,7 +342,7 @@ def _process_dealer(dealer_public_id, attempts):
                 failed_reason = NULL, generated_at = NOW()
             WHERE dealer_id = :did
         """), {
-            "url": audio_url_v, "dur": duration_sec, "size": len(audio_bytes),
+            "url": audio_url_v, "dur": duration_sec, "size": audio_size,
             "mime": audio_mime, "title": title, "desc": description,
             "transcript": dialogue, "vm": VOICE_MARCO, "vf": VOICE_LUCIA,
             "tts": GEMINI_TTS_MODEL, "sm": GPT_MODEL, "did": dealer_public_id,
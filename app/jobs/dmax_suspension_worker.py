@@ -31,6 +31,8 @@ from datetime import datetime, timedelta, timezone
 import psycopg
 import stripe
 
+from app.database import psycopg_connection
+
 logger = logging.getLogger(__name__)
 
 # Se past_due al momento del check, posticipo di questi giorni prima di
@@ -41,10 +43,6 @@ PAST_DUE_POSTPONE_DAYS = 7
 BATCH_SIZE = 500
 
 
-def _get_db_url() -> str:
-    return os.environ["DATABASE_URL"]
-
-
 def _configure_stripe() -> str | None:
     key = os.getenv("STRIPE_SECRET_KEY")
     if key:
@@ -133,7 +131,7 @@ def dmax_suspension_worker() -> None:
     postponed = 0
     errors = 0
 
-    with psycopg.connect(_get_db_url(), autocommit=False) as conn:
+    with psycopg_connection() as conn:
         due = _fetch_due_dealers(conn, BATCH_SIZE)
         if not due:
             logger.info("[DMAX SUSP] nessun dealer pending: idle")
@@ -0,0 +1,229 @@
+"""Marketplace dispatcher — LISTEN/NOTIFY per AutoScout24 e ASM.
+
+I trigger su autoscout_listings / asm_listings (sql/001_marketplace_queue_notify.sql)
+fanno pg_notify quando una riga entra in coda. Il dispatcher tiene una
+connessione dedicata in LISTEN e sveglia subito il job relativo, invece di
+aspettare il tick del cron. Il cron resta come fallback lento.
+
+Note:
+- LISTEN richiede una connessione di sessione (NO pooler in transaction mode):
+  se DATABASE_URL punta al pooler, impostare DISPATCHER_DATABASE_URL diretto.
+- Le esecuzioni (cron + dispatcher) sono serializzate per job da run_exclusive:
+  una notifica arrivata durante un run resta "dirty" e riparte appena finisce.
+- Se il job ritorna un numero di righe lavorate > 0 viene rilanciato subito,
+  così un backlog più grande di un batch si svuota senza aspettare il cron.
+- I retry schedulati (ERROR con next_attempt_at) e i lease scaduti non fanno
+  NOTIFY: il dispatcher legge la prossima scadenza per tabella e sveglia il
+  job a quell'ora.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg
+
+from app.database import libpq_dsn
+
+logger = logging.getLogger(__name__)
+
+# Attesa massima su notifies(): scandisce retry dei job occupati e stop
+POLL_TIMEOUT_SECONDS = 1.0
+# Attesa dopo la prima notifica per accorpare le raffiche (es. import stock)
+DEBOUNCE_SECONDS = 0.3
+RECONNECT_BACKOFF_MAX = 60
+# Rilettura periodica delle scadenze retry / lease (oltre a quella dopo ogni run)
+DUE_REFRESH_SECONDS = 60
+# Rilettura dopo un run: non subito, così una riga scaduta ma non claimabile
+# non fa ripartire il job a ogni giro
+DUE_REFRESH_AFTER_RUN_SECONDS = 5
+
+
+# ============================================================
+# ESECUZIONE ESCLUSIVA PER JOB
+# ============================================================
+
+_job_locks: dict = {}
+_job_locks_guard = threading.Lock()
+
+
+def _job_lock(job_id: str) -> threading.Lock:
+    with _job_locks_guard:
+        lock = _job_locks.get(job_id)
+        if lock is None:
+            lock = threading.Lock()
+            _job_locks[job_id] = lock
+        return lock
+
+
+def run_exclusive(job_id: str, func) -> bool:
+    """Esegue func solo se non c'è già un run dello stesso job. True se eseguito."""
+    lock = _job_lock(job_id)
+    if not lock.acquire(blocking=False):
+        return False
+    try:
+        func()
+    except Exception:
+        logger.exception("[DISPATCHER] Errore job %s", job_id)
+    finally:
+        lock.release()
+    return True
+
+
+def exclusive(job_id: str, func):
+    """Wrapper per lo scheduler: il run cron salta se il dispatcher sta già lavorando."""
+    def _run():
+        if not run_exclusive(job_id, func):
+            logger.info("[DISPATCHER] %s già in esecuzione → tick saltato", job_id)
+    _run.__name__ = getattr(func, "__name__", job_id)
+    return _run
+
+
+# ============================================================
+# DISPATCHER
+# ============================================================
+
+class MarketplaceDispatcher(threading.Thread):
+    """
+    channels: canale NOTIFY → (job_id, func, tabella coda).
+    Un thread in LISTEN + un executor con un worker per job.
+    """
+
+    def __init__(self, channels: dict, dsn: str | None = None):
+        super().__init__(name="marketplace-dispatcher", daemon=True)
+        self.channels = channels
+        self.dsn = libpq_dsn(
+            dsn or os.getenv("DISPATCHER_DATABASE_URL"),
+            application_name="azurenet_engine_dispatcher",
+        )
+        self._stop_event = threading.Event()
+        # _dirty / _due / _refresh_at: scritti dal thread LISTEN e dai thread _wake
+        self._lock = threading.Lock()
+        self._dirty: set = set()
+        self._due: dict = {}            # canale → time.monotonic() della prossima scadenza
+        self._refresh_at = 0.0
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(channels),
+            thread_name_prefix="marketplace-dispatch",
+        )
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        backoff = 1
+
+        while not self._stop_event.is_set():
+            try:
+                with psycopg.connect(self.dsn, autocommit=True, prepare_threshold=None) as conn:
+                    for channel in self.channels:
+                        conn.execute(f'LISTEN "{channel}"')
+
+                    logger.info("[DISPATCHER] LISTEN attivo su %s", ", ".join(self.channels))
+                    backoff = 1
+
+                    # Al (ri)avvio svuota comunque le code: notifiche perse durante il down
+                    self._mark_dirty(*self.channels)
+
+                    while not self._stop_event.is_set():
+                        for notify in conn.notifies(timeout=POLL_TIMEOUT_SECONDS):
+                            if notify.channel in self.channels:
+                                self._mark_dirty(notify.channel)
+                        self._check_due(conn)
+                        self._dispatch()
+
+            except Exception:
+                if self._stop_event.is_set():
+                    break
+                logger.exception("[DISPATCHER] Connessione LISTEN persa, retry tra %ss", backoff)
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+
+        self._executor.shutdown(wait=True)
+        logger.info("[DISPATCHER] Fermato")
+
+    def _mark_dirty(self, *channels: str) -> None:
+        with self._lock:
+            self._dirty.update(channels)
+
+    def _check_due(self, conn) -> None:
+        """
+        Sveglia i job con retry / lease scaduti (nessuna NOTIFY per questi).
+        Le scadenze si rileggono dal DB dopo ogni run e ogni DUE_REFRESH_SECONDS.
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            refresh = now >= self._refresh_at
+            if refresh:
+                self._refresh_at = now + DUE_REFRESH_SECONDS
+
+        if refresh:
+            due = {}
+            for channel, (_job_id, _func, table) in self.channels.items():
+                # secondi alla prossima scadenza (<= 0 = già dovuta), None = niente in attesa
+                seconds = conn.execute(
+                    f"""
+                    SELECT extract(epoch FROM min(due_at) - now())
+                    FROM (
+                        SELECT min(next_attempt_at) AS due_at
+                        FROM {table}
+                        WHERE status = 'ERROR'
+                          AND retry_status IS NOT NULL
+                          AND next_attempt_at IS NOT NULL
+                        UNION ALL
+                        SELECT min(lease_expires_at)
+                        FROM {table}
+                        WHERE status = 'PROCESSING'
+                    ) s
+                    """
+                ).fetchone()[0]
+                if seconds is not None:
+                    due[channel] = now + max(float(seconds), 0.0)
+            with self._lock:
+                self._due = due
+
+        with self._lock:
+            for channel, due_at in list(self._due.items()):
+                if due_at <= now:
+                    del self._due[channel]
+                    self._dirty.add(channel)
+
+    def _dispatch(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+
+        time.sleep(DEBOUNCE_SECONDS)
+
+        with self._lock:
+            for channel in list(self._dirty):
+                job_id, func, _table = self.channels[channel]
+                lock = _job_lock(job_id)
+
+                if lock.locked():
+                    # run in corso: resta dirty, riprovo al prossimo giro
+                    continue
+
+                self._dirty.discard(channel)
+                logger.info("[DISPATCHER] wake %s (%s)", job_id, channel)
+                self._executor.submit(self._wake, channel, job_id, func)
+
+    def _wake(self, channel: str, job_id: str, func) -> None:
+        result = {}
+
+        def _call():
+            result["processed"] = func()
+
+        if not run_exclusive(job_id, _call):
+            # partito un run cron nel frattempo: la notifica non va persa
+            self._mark_dirty(channel)
+        elif result.get("processed"):
+            # il job ha lavorato righe: potrebbe esserci backlog residuo
+            self._mark_dirty(channel)
+
+        # il run può aver schedulato retry: scadenze da rileggere
+        with self._lock:
+            self._refresh_at = min(self._refresh_at, time.monotonic() + DUE_REFRESH_AFTER_RUN_SECONDS)
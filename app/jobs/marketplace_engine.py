@@ -0,0 +1,812 @@
+"""Marketplace publishing engine — condiviso da AutoScout24 e AutoSuperMarket.
+
+Il motore implementa una volta sola:
+- DELETE_REQUIRED con priorità assoluta, raggruppati per dealer (DELETE concorrenti,
+  un solo statement per le righe confermate)
+- claim a transazione breve: FOR UPDATE SKIP LOCKED → status PROCESSING con
+  lease, commit immediato; le chiamate HTTP girano fuori da ogni transazione
+  e l'esito viene scritto solo se il lease è ancora nostro. Lease scaduti
+  (worker morto, deploy) tornano claimabili (sql/004_marketplace_processing_lease.sql)
+- claim backlog-aware, worker pool + quote
+- skip UPDATE per i dealer "solo pubblicazione"
+- pipeline a stadi: ogni stadio ha il suo executor, quindi lo stadio N+1 di
+  un listing gira mentre lo stadio N del listing successivo è in corso
+  (es. mapping del listing B durante l'upload immagini del listing A)
+- stato PUBLISHED / retry schedulati (marketplace_retry) / commit per riga
+- metriche per run, con tempi per stadio
+
+Ogni portale fornisce solo un MarketplaceChannel: stadi (payload builder +
+client HTTP), delete_remote e il loader del contesto batch.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.database import SessionLocal
+from app.jobs.marketplace_retry import as_operation, due_filter, schedule_retry
+from app.sql_stats import propagate
+
+logger = logging.getLogger(__name__)
+
+# Durata del lease PROCESSING: oltre, la riga torna claimabile
+LEASE_SECONDS = int(os.getenv("MARKETPLACE_LEASE_SECONDS", "1800"))
+
+# DELETE_REQUIRED per run e DELETE remoti concorrenti per dealer
+DELETE_BATCH_SIZE = int(os.getenv("MARKETPLACE_DELETE_BATCH_SIZE", "100"))
+DELETE_CONCURRENCY = int(os.getenv("MARKETPLACE_DELETE_CONCURRENCY", "4"))
+
+
+# ============================================================
+# QUOTE (GLOBALE + PER DEALER)
+# ============================================================
+
+class PublishLimiter:
+    """
+    Semafori globale + per dealer: tengono i worker dentro le quote del portale.
+    Condiviso tra i run del job (un run alla volta per canale).
+    """
+
+    def __init__(self, max_concurrency: int, max_per_customer: int):
+        self._global = threading.BoundedSemaphore(max_concurrency)
+        self._max_per_customer = max_per_customer
+        self._per_customer: dict = {}
+        self._lock = threading.Lock()
+
+    def _customer_semaphore(self, key):
+        with self._lock:
+            sem = self._per_customer.get(key)
+            if sem is None:
+                sem = threading.BoundedSemaphore(self._max_per_customer)
+                self._per_customer[key] = sem
+            return sem
+
+    @contextmanager
+    def slot(self, key):
+        customer_sem = self._customer_semaphore(key)
+        with customer_sem:
+            with self._global:
+                yield
+
+
+# ============================================================
+# STADI PIPELINE
+# ============================================================
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    Uno stadio della pipeline di pubblicazione.
+    Il primo stadio riceve (listing, ctx, batch), i successivi il record
+    tipizzato prodotto dallo stadio precedente; l'ultimo ritorna l'id remoto.
+    quota=True → eseguito dentro uno slot del PublishLimiter (chiamate al portale).
+    Gli stadi NON usano la sessione DB: le scritture restano al worker.
+    """
+    name: str
+    fn: Callable
+    quota: bool = True
+
+
+# ============================================================
+# CANALE (PLUG-IN PER PORTALE)
+# ============================================================
+
+class MarketplaceChannel:
+    """
+    Punto di estensione per un portale. Le sottoclassi definiscono gli
+    attributi e implementano load_contexts / stages / delete_remote.
+    """
+
+    name = ""                 # prefisso log, es. "AUTOSCOUT"
+    table = ""                # coda, es. "autoscout_listings"
+    config_table = ""         # es. "autoscout_dealer_config"
+    remote_id_column = ""     # id annuncio sul portale, es. "listing_id"
+    skip_sync_flag = ""       # flag config "solo pubblicazione"
+
+    batch_size = 5            # claim minimo per worker
+    max_batch_size = 20       # claim massimo per worker con backlog
+    delete_batch_size = DELETE_BATCH_SIZE
+    delete_concurrency = DELETE_CONCURRENCY
+    workers = 1
+    stage_concurrency = 1     # thread per stadio (per worker)
+    limiter: PublishLimiter = None
+
+    def load_configs(self, session, dealer_ids) -> dict:
+        return load_dealer_configs(session, dealer_ids, table=self.config_table)
+
+    def load_contexts(self, session, listings):
+        """Contesto batch: oggetto con .get(listing_id) → ctx con attributo .config."""
+        raise NotImplementedError
+
+    def stages(self) -> list[Stage]:
+        """Stadi CREATE / UPDATE, in ordine. L'ultimo ritorna l'id remoto."""
+        raise NotImplementedError
+
+    def delete_target(self, config: dict):
+        """Risolto una volta per dealer prima dei DELETE (default: la config)."""
+        return config
+
+    def delete_remote(self, target, listing: dict) -> None:
+        """DELETE sul portale. Solleva eccezione se non confermato."""
+        raise NotImplementedError
+
+    def on_error(self, session, listing: dict, exc: Exception) -> bool:
+        """Gestione errori specifica del portale. True = gestito (niente retry)."""
+        return False
+
+
+# ============================================================
+# METRICHE
+# ============================================================
+
+class StageTimings:
+    """Tempi per stadio (chiamate, secondi totali, max). Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: dict = {}        # nome → [chiamate, secondi, max]
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            entry = self.stages.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    @contextmanager
+    def measure(self, name: str):
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - t0)
+
+    def merge(self, other: "StageTimings") -> None:
+        with self._lock:
+            for name, (calls, seconds, peak) in other.stages.items():
+                entry = self.stages.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += calls
+                entry[1] += seconds
+                entry[2] = max(entry[2], peak)
+
+    def summary(self) -> str:
+        return " ".join(
+            f"{name}={calls}x/{seconds:.2f}s(max {peak:.2f}s)"
+            for name, (calls, seconds, peak) in self.stages.items()
+        )
+
+
+@dataclass
+class RunStats:
+    deleted: int = 0
+    claimed: int = 0
+    published: int = 0
+    skipped: int = 0
+    failed: int = 0
+    timings: StageTimings = field(default_factory=StageTimings)
+
+    def merge(self, other: "RunStats") -> "RunStats":
+        self.deleted += other.deleted
+        self.claimed += other.claimed
+        self.published += other.published
+        self.skipped += other.skipped
+        self.failed += other.failed
+        self.timings.merge(other.timings)
+        return self
+
+    @property
+    def processed(self) -> int:
+        return self.deleted + self.claimed
+
+
+# ============================================================
+# QUERY CONDIVISE
+# ============================================================
+
+def load_dealer_configs(session, dealer_ids, table: str) -> dict:
+    """dealer_id → config portale (solo enabled)."""
+    dealer_ids = sorted({d for d in dealer_ids if d is not None})
+    if not dealer_ids:
+        return {}
+
+    rows = session.execute(
+        text(f"""
+            SELECT *
+            FROM {table}
+            WHERE dealer_id = ANY(:dealer_ids)
+              AND enabled = true
+        """),
+        {"dealer_ids": dealer_ids},
+    ).mappings().all()
+
+    return {r["dealer_id"]: dict(r) for r in rows}
+
+
+def by_key(rows, key: str, as_str: bool = False) -> dict:
+    """Righe → dict per colonna chiave (as_str: chiave come stringa, es. uuid)."""
+    if as_str:
+        return {str(r[key]): dict(r) for r in rows}
+    return {r[key]: dict(r) for r in rows}
+
+
+def load_vetrina_media(session, id_autos) -> dict:
+    """id_auto (str) → media vetrina ordinati (foto / AI), con media_url risolto."""
+    media: dict = {}
+    for row in session.execute(
+        text("""
+            SELECT
+                v.id_auto,
+                v.media_type,
+                v.media_id,
+                v.priority,
+                v.created_at,
+                CASE v.media_type
+                    WHEN 'foto' THEN img.foto
+                    WHEN 'ai'   THEN leo.public_url
+                END AS media_url
+            FROM usato_vetrina v
+            LEFT JOIN azlease_usatoimg img ON img.id = v.media_id
+            LEFT JOIN usato_leonardo leo ON leo.id = v.media_id
+            WHERE v.id_auto = ANY(CAST(:ids AS uuid[]))
+                AND v.media_type IN ('foto', 'ai')
+                AND (
+                    (v.media_type = 'foto' AND img.foto IS NOT NULL)
+                    OR (v.media_type = 'ai'   AND leo.public_url IS NOT NULL)
+                )
+            ORDER BY
+                v.id_auto,
+                v.priority ASC NULLS LAST,
+                v.created_at ASC
+        """),
+        {"ids": list(id_autos)},
+    ).mappings().all():
+        media.setdefault(str(row["id_auto"]), []).append(dict(row))
+    return media
+
+
+def _mark_published(session, channel: MarketplaceChannel, listing: dict, remote_id=None) -> bool:
+    """
+    Esito OK, solo se il lease è ancora nostro. Se nel frattempo CoreAPI ha
+    rimesso la riga in coda (es. UPDATE_REQUIRED / DELETE_REQUIRED) lo status
+    resta il suo. False = lease perso (scaduto e riclaimato da un altro run):
+    l'id remoto viene salvato comunque, altrimenti l'annuncio appena creato
+    resterebbe orfano sul portale (nessun DELETE possibile).
+    """
+    res = session.execute(
+        text(f"""
+            UPDATE {channel.table}
+            SET
+                {channel.remote_id_column} = COALESCE(:remote_id, {channel.remote_id_column}),
+                status = CASE WHEN status = 'PROCESSING' THEN 'PUBLISHED' ELSE status END,
+                last_attempt_at = now(),
+                last_error = NULL,
+                retry_count = 0,
+                next_attempt_at = NULL,
+                lease_token = NULL,
+                lease_expires_at = NULL
+            WHERE id = :id
+              AND lease_token = CAST(:lease_token AS uuid)
+        """),
+        {"id": listing["id"], "remote_id": remote_id, "lease_token": listing["lease_token"]},
+    )
+
+    if res.rowcount:
+        return True
+
+    logger.warning(
+        "[%s_SYNC] Lease perso, esito non salvato | id=%s remote_id=%s",
+        channel.name,
+        listing["id"],
+        remote_id,
+    )
+
+    if remote_id is not None:
+        saved = session.execute(
+            text(f"""
+                UPDATE {channel.table}
+                SET {channel.remote_id_column} = :remote_id
+                WHERE id = :id
+                  AND ({channel.remote_id_column} IS NULL OR {channel.remote_id_column} = :remote_id)
+            """),
+            {"id": listing["id"], "remote_id": remote_id},
+        ).rowcount
+        if not saved:
+            logger.error(
+                "[%s_SYNC] Annuncio remoto orfano (riga eliminata o con altro id) | id=%s remote_id=%s",
+                channel.name,
+                listing["id"],
+                remote_id,
+            )
+    return False
+
+
+# ============================================================
+# CLAIM CON LEASE (TRANSAZIONE BREVE)
+# ============================================================
+
+def _claim(channel: MarketplaceChannel, session, operations: tuple, limit: int) -> list[dict]:
+    """
+    Claim atomico: righe dovute (in coda, ERROR scadute, lease scaduti)
+    → status PROCESSING + lease, poi COMMIT. Nessun lock resta aperto
+    durante le chiamate ai portali.
+    Ritorna le righe con status = operazione effettiva e lease_token.
+    """
+    lease_token = str(uuid.uuid4())
+
+    rows = session.execute(
+        text(f"""
+            WITH picked AS (
+                SELECT id, status AS prev_status
+                FROM {channel.table}
+                WHERE {due_filter(*operations)}
+                ORDER BY COALESCE(next_attempt_at, requested_at)
+                FOR UPDATE SKIP LOCKED
+                LIMIT :limit
+            )
+            UPDATE {channel.table} t
+            SET
+                lease_operation = CASE
+                    WHEN t.status = 'ERROR' THEN t.retry_status
+                    WHEN t.status = 'PROCESSING' THEN t.lease_operation
+                    ELSE t.status
+                END,
+                status = 'PROCESSING',
+                lease_token = CAST(:lease_token AS uuid),
+                lease_expires_at = now() + make_interval(secs => :lease_seconds)
+            FROM picked
+            WHERE t.id = picked.id
+            RETURNING t.*, picked.prev_status
+        """),
+        {"limit": limit, "lease_token": lease_token, "lease_seconds": LEASE_SECONDS},
+    ).mappings().all()
+    session.commit()
+
+    recovered = sum(1 for r in rows if r["prev_status"] == "PROCESSING")
+    if recovered:
+        logger.warning(
+            "[%s_SYNC] Recuperati %d lease scaduti (%s)",
+            channel.name,
+            recovered,
+            ", ".join(operations),
+        )
+
+    claimed = []
+    for row in rows:
+        row = as_operation(row)
+        row["lease_token"] = lease_token
+        claimed.append(row)
+    return claimed
+
+
+def _release_lease(channel: MarketplaceChannel, session, lease_token: str) -> None:
+    """
+    Worker in errore fatale: rimette in coda subito le righe ancora in PROCESSING
+    e libera il lease anche su quelle già rimesse in coda da CoreAPI.
+    """
+    try:
+        res = session.execute(
+            text(f"""
+                UPDATE {channel.table}
+                SET
+                    status = CASE WHEN status = 'PROCESSING' THEN lease_operation ELSE status END,
+                    lease_token = NULL,
+                    lease_expires_at = NULL
+                WHERE lease_token = CAST(:lease_token AS uuid)
+            """),
+            {"lease_token": lease_token},
+        )
+        session.commit()
+        if res.rowcount:
+            logger.warning("[%s_SYNC] Rilasciati %d lease", channel.name, res.rowcount)
+    except SQLAlchemyError:
+        session.rollback()
+        logger.exception("[%s_SYNC] Rilascio lease fallito (recupero a scadenza)", channel.name)
+
+
+# ============================================================
+# 0️⃣ DELETE_REQUIRED — PRIORITÀ ASSOLUTA (BATCH PER DEALER)
+# ============================================================
+
+def _delete_group(channel: MarketplaceChannel, config: dict, rows: list) -> tuple[list, list]:
+    """
+    DELETE remoti di un dealer: una sola risoluzione target (es. customerId AS24),
+    chiamate concorrenti entro channel.delete_concurrency.
+    Ritorna (id confermati, [(id, errore)]).
+    """
+    try:
+        target = channel.delete_target(config)
+    except Exception as exc:
+        return [], [(r["id"], str(exc)) for r in rows]
+
+    def _one(row):
+        try:
+            channel.delete_remote(target, dict(row))
+            return row["id"], None
+        except Exception as exc:
+            return row["id"], str(exc)
+
+    confirmed, failed = [], []
+    workers = max(1, min(channel.delete_concurrency, len(rows)))
+    with ThreadPoolExecutor(
+        max_workers=workers,
+        thread_name_prefix=f"{channel.name.lower()}-delete",
+    ) as ex:
+        for row_id, error in ex.map(_one, rows):
+            if error is None:
+                confirmed.append(row_id)
+            else:
+                failed.append((row_id, error))
+
+    return confirmed, failed
+
+
+def process_deletes(channel: MarketplaceChannel, session) -> int:
+    rows = _claim(channel, session, ("DELETE_REQUIRED",), channel.delete_batch_size)
+
+    if not rows:
+        return 0
+
+    lease_token = rows[0]["lease_token"]
+    try:
+        _delete_claimed(channel, session, rows, lease_token)
+    except Exception:
+        # niente righe bloccate in PROCESSING fino a scadenza del lease
+        session.rollback()
+        _release_lease(channel, session, lease_token)
+        raise
+
+    return len(rows)
+
+
+def _delete_claimed(channel: MarketplaceChannel, session, rows: list, lease_token: str) -> None:
+    configs = channel.load_configs(session, (r["dealer_id"] for r in rows))
+    session.commit()
+
+    to_delete: list = []        # righe da eliminare localmente (confermate o senza API)
+    remote_groups: dict = {}    # dealer_id → righe con DELETE remoto
+
+    for row in rows:
+        config = configs.get(row["dealer_id"])
+
+        if not config:
+            logger.warning(
+                "[%s_DELETE] Config dealer mancante, elimino record locale | id=%s dealer_id=%s",
+                channel.name,
+                row["id"],
+                row["dealer_id"],
+            )
+            to_delete.append(row["id"])
+        elif config.get(channel.skip_sync_flag):
+            # solo pubblicazione dealer: niente API
+            to_delete.append(row["id"])
+        elif row.get(channel.remote_id_column):
+            remote_groups.setdefault(row["dealer_id"], []).append(row)
+        else:
+            to_delete.append(row["id"])
+
+    failed: list = []
+    for dealer_id, group in remote_groups.items():
+        confirmed, group_failed = _delete_group(channel, configs[dealer_id], group)
+        to_delete.extend(confirmed)
+        failed.extend(group_failed)
+
+        logger.info(
+            "[%s_DELETE] Dealer %s: %d DELETE confermati, %d falliti",
+            channel.name,
+            dealer_id,
+            len(confirmed),
+            len(group_failed),
+        )
+
+    # Un solo statement per tutte le righe confermate (solo col nostro lease)
+    if to_delete:
+        session.execute(
+            text(f"""
+                DELETE FROM {channel.table}
+                WHERE id = ANY(:ids)
+                  AND lease_token = CAST(:lease_token AS uuid)
+            """),
+            {"ids": to_delete, "lease_token": lease_token},
+        )
+
+    for row_id, error in failed:
+        logger.warning(
+            "[%s_DELETE] DELETE non confermato, retry schedulato | id=%s err=%s",
+            channel.name,
+            row_id,
+            error,
+        )
+        schedule_retry(session, channel.table, row_id, error, "DELETE_REQUIRED", lease_token=lease_token)
+
+    session.commit()
+
+    logger.info(
+        "[%s_DELETE] Batch completato | righe=%d dealer=%d eliminate=%d retry=%d",
+        channel.name,
+        len(rows),
+        len(remote_groups),
+        len(to_delete),
+        len(failed),
+    )
+
+
+# ============================================================
+# 1️⃣ CLAIM BACKLOG-AWARE
+# ============================================================
+
+def count_backlog(channel: MarketplaceChannel, session) -> int:
+    return session.execute(
+        text(f"""
+            SELECT count(*)
+            FROM {channel.table}
+            WHERE {due_filter('PENDING_CREATE', 'UPDATE_REQUIRED')}
+        """)
+    ).scalar() or 0
+
+
+def plan_claims(channel: MarketplaceChannel, backlog: int) -> tuple[int, int]:
+    """
+    Ritorna (worker da avviare, listing da claimare per worker).
+    Coda piccola → 1 worker, batch_size; coda grande → tutti i worker,
+    batch più grandi (max max_batch_size).
+    """
+    if backlog <= 0:
+        return 0, 0
+
+    workers = max(1, min(channel.workers, math.ceil(backlog / channel.batch_size)))
+    claim_size = min(channel.max_batch_size, max(channel.batch_size, math.ceil(backlog / workers)))
+    return workers, claim_size
+
+
+# ============================================================
+# 2️⃣ CREATE / UPDATE — PIPELINE A STADI
+# ============================================================
+
+def _skip_publish_only(channel: MarketplaceChannel, session, listing: dict, batch, stats: RunStats) -> bool:
+    """Solo pubblicazione: niente UPDATE su annunci già esistenti. True = gestito."""
+    ctx = batch.get(listing["id"])
+    config = ctx.config if ctx else None
+
+    if not (config and config.get(channel.skip_sync_flag)):
+        return False
+    if listing["status"] != "UPDATE_REQUIRED" and not listing.get(channel.remote_id_column):
+        return False
+
+    logger.info(
+        "[%s_SYNC] Skip UPDATE (solo pubblicazione dealer) | id=%s",
+        channel.name,
+        listing["id"],
+    )
+    _mark_published(session, channel, listing)
+    session.commit()
+    stats.skipped += 1
+    return True
+
+
+class _Pipeline:
+    """
+    Un executor per stadio: i listing scorrono in ordine, ogni stadio lavora
+    su un listing diverso in parallelo. Errori di uno stadio saltano gli
+    stadi successivi dello stesso listing (la Future finale solleva).
+    """
+
+    def __init__(self, channel: MarketplaceChannel, timings: StageTimings):
+        self.channel = channel
+        self.timings = timings
+        self.stages = channel.stages()
+        self.executors = [
+            ThreadPoolExecutor(
+                max_workers=channel.stage_concurrency,
+                thread_name_prefix=f"{channel.name.lower()}-{stage.name}",
+            )
+            for stage in self.stages
+        ]
+
+    def _run(self, stage: Stage, dealer_id, args):
+        if stage.quota:
+            with self.channel.limiter.slot(dealer_id):
+                with self.timings.measure(stage.name):
+                    return stage.fn(*args)
+        with self.timings.measure(stage.name):
+            return stage.fn(*args)
+
+    def _task(self, stage: Stage, dealer_id, prev):
+        # prev: argomenti del primo stadio oppure Future dello stadio precedente
+        args = (prev.result(),) if isinstance(prev, Future) else prev
+        return self._run(stage, dealer_id, args)
+
+    def submit(self, listing: dict, ctx, batch) -> Future:
+        prev = (listing, ctx, batch)
+        for stage, executor in zip(self.stages, self.executors):
+            prev = executor.submit(self._task, stage, listing["dealer_id"], prev)
+        return prev
+
+    def shutdown(self) -> None:
+        for executor in self.executors:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _complete_listing(channel: MarketplaceChannel, session, listing: dict, future: Future, stats: RunStats) -> None:
+    """Attende la fine della pipeline del listing e scrive lo stato (thread del worker)."""
+    listing_id = listing["id"]
+
+    logger.info(
+        "[%s_SYNC] Preso record | id=%s dealer_id=%s id_auto=%s status=%s",
+        channel.name,
+        listing_id,
+        listing["dealer_id"],
+        listing["id_auto"],
+        listing["status"],
+    )
+
+    try:
+        remote_id = future.result()
+
+        with stats.timings.measure("db_write"):
+            saved = _mark_published(session, channel, listing, remote_id)
+            session.commit()
+        if saved:
+            stats.published += 1
+
+    except Exception as exc:
+        session.rollback()
+        stats.failed += 1
+
+        if channel.on_error(session, listing, exc):
+            session.commit()
+            return
+
+        logger.error(
+            "[%s_SYNC] ERRORE su id=%s",
+            channel.name,
+            listing_id,
+            exc_info=exc,
+        )
+
+        try:
+            schedule_retry(
+                session,
+                channel.table,
+                listing_id,
+                str(exc)[:2000],
+                listing["status"],
+                lease_token=listing["lease_token"],
+            )
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            logger.exception(
+                "[%s_SYNC] Errore nel salvataggio stato ERROR | id=%s",
+                channel.name,
+                listing_id,
+            )
+
+
+def _publish_worker(channel: MarketplaceChannel, worker_no: int, limit: int) -> RunStats:
+    """
+    Worker: claim del proprio batch (PROCESSING + lease, già committato),
+    contesto in una transazione di sola lettura, poi pubblicazione senza
+    transazioni aperte: la sessione torna al pool tra una scrittura e l'altra.
+    """
+    stats = RunStats()
+    session = SessionLocal()
+    listings = []
+
+    try:
+        with stats.timings.measure("claim"):
+            listings = _claim(channel, session, ("PENDING_CREATE", "UPDATE_REQUIRED"), limit)
+
+        if not listings:
+            return stats
+
+        stats.claimed = len(listings)
+        logger.info("[%s_SYNC] Worker %s: claimati %d listing", channel.name, worker_no, len(listings))
+
+        with stats.timings.measure("load_context"):
+            batch = channel.load_contexts(session, listings)
+            session.commit()
+
+        pending = [
+            listing
+            for listing in listings
+            if not _skip_publish_only(channel, session, listing, batch, stats)
+        ]
+
+        pipeline = _Pipeline(channel, stats.timings)
+        try:
+            futures = [
+                (listing, pipeline.submit(listing, batch.get(listing["id"]), batch))
+                for listing in pending
+            ]
+            for listing, future in futures:
+                _complete_listing(channel, session, listing, future, stats)
+        finally:
+            pipeline.shutdown()
+
+    except Exception:
+        logger.exception("[%s_SYNC] ERRORE FATALE WORKER %s", channel.name, worker_no)
+        session.rollback()
+        if listings:
+            _release_lease(channel, session, listings[0]["lease_token"])
+
+    finally:
+        session.close()
+
+    return stats
+
+
+# ============================================================
+# ENTRYPOINT JOB
+# ============================================================
+
+def run_channel(channel: MarketplaceChannel) -> int:
+    """
+    Un run completo del canale. Ritorna le righe lavorate
+    (usato dal dispatcher per rilanciare se c'è backlog residuo).
+    """
+    t0 = time.monotonic()
+    stats = RunStats()
+
+    session = SessionLocal()
+    try:
+        with stats.timings.measure("delete"):
+            stats.deleted = process_deletes(channel, session)
+        backlog = count_backlog(channel, session)
+        session.commit()
+    except Exception:
+        logger.exception("[%s_SYNC] ERRORE FATALE JOB (DELETE)", channel.name)
+        session.rollback()
+        return 0
+    finally:
+        session.close()
+
+    workers, claim_size = plan_claims(channel, backlog)
+
+    if workers:
+        logger.info(
+            "[%s_SYNC] Backlog=%d → workers=%d claim_size=%d",
+            channel.name,
+            backlog,
+            workers,
+            claim_size,
+        )
+
+        if workers == 1:
+            stats.merge(_publish_worker(channel, 1, claim_size))
+        else:
+            with ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix=f"{channel.name.lower()}-worker",
+            ) as ex:
+                for worker_stats in ex.map(
+                    propagate(lambda n: _publish_worker(channel, n, claim_size)),
+                    range(1, workers + 1),
+                ):
+                    stats.merge(worker_stats)
+
+    if stats.processed:
+        logger.info(
+            "[%s_SYNC] Run completato | deleted=%d claimed=%d published=%d skipped=%d failed=%d in %.1fs | stadi: %s",
+            channel.name,
+            stats.deleted,
+            stats.claimed,
+            stats.published,
+            stats.skipped,
+            stats.failed,
+            time.monotonic() - t0,
+            stats.timings.summary() or "-",
+        )
+    else:
+        logger.info("[%s_SYNC] Nessun record in coda", channel.name)
+
+    return stats.processed
@@ -0,0 +1,192 @@
+"""Marketplace — normalizzazione immagini prima dell'upload sui portali.
+
+Le foto della vetrina (azlease_usatoimg / usato_leonardo) arrivano come
+JPEG, PNG o GIF, spesso PNG da diversi MB dalla pipeline AI. Con
+MARKETPLACE_IMAGE_NORMALIZE=true ogni immagine viene:
+- ruotata secondo EXIF e ridimensionata al lato massimo utile del portale
+- convertita in JPEG progressivo (qualità configurabile), alpha su bianco
+- ripulita da EXIF / ICC / commenti
+
+Risultati in cache per hash della sorgente (+ parametri): LRU in memoria e,
+se MARKETPLACE_IMAGE_CACHE_DIR è impostata, su disco (condivisa tra run).
+
+Pillow è in requirements.txt; se manca comunque le immagini passano invariate.
+Il normalizer (e la cache su disco) viene creato al primo uso, solo a feature attiva.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # ambiente senza Pillow: passthrough
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+NORMALIZE_ENABLED = os.getenv("MARKETPLACE_IMAGE_NORMALIZE", "false").lower() == "true"
+MAX_SIDE = int(os.getenv("MARKETPLACE_IMAGE_MAX_SIDE", "1920"))
+JPEG_QUALITY = int(os.getenv("MARKETPLACE_IMAGE_JPEG_QUALITY", "82"))
+CACHE_ITEMS = int(os.getenv("MARKETPLACE_IMAGE_CACHE_ITEMS", "256"))
+CACHE_DIR = os.getenv("MARKETPLACE_IMAGE_CACHE_DIR")
+
+NORMALIZABLE_TYPES = {"image/jpeg", "image/png", "image/gif"}
+
+
+class ImageNormalizer:
+    """Transcoding + cache per hash sorgente. Thread-safe (worker AS24 in parallelo)."""
+
+    def __init__(
+        self,
+        max_side: int = MAX_SIDE,
+        quality: int = JPEG_QUALITY,
+        cache_items: int = CACHE_ITEMS,
+        cache_dir: str | None = CACHE_DIR,
+    ):
+        self.max_side = max_side
+        self.quality = quality
+        self.cache_items = cache_items
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bytes_in": 0, "bytes_out": 0, "failed": 0}
+
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _key(self, content: bytes) -> str:
+        h = hashlib.sha256(content)
+        h.update(f"|{self.max_side}|{self.quality}".encode())
+        return h.hexdigest()
+
+    # ------------------------------------------------------------
+    # Cache (memoria LRU + disco)
+    # ------------------------------------------------------------
+    def _cache_get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                return data
+
+        if self.cache_dir:
+            path = self.cache_dir / f"{key}.jpg"
+            if path.exists():
+                data = path.read_bytes()
+                self._cache_put(key, data, persist=False)
+                return data
+        return None
+
+    def _cache_put(self, key: str, data: bytes, persist: bool = True) -> None:
+        with self._lock:
+            self._cache[key] = data
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_items:
+                self._cache.popitem(last=False)
+
+        if persist and self.cache_dir:
+            tmp = self.cache_dir / f"{key}.tmp.{threading.get_ident()}"
+            tmp.write_bytes(data)
+            tmp.replace(self.cache_dir / f"{key}.jpg")
+
+    # ------------------------------------------------------------
+    # Transcoding
+    # ------------------------------------------------------------
+    def _transcode(self, content: bytes) -> bytes:
+        with Image.open(io.BytesIO(content)) as img:
+            img.seek(0)  # GIF animate → primo frame
+            img = ImageOps.exif_transpose(img)
+
+            if img.mode in ("RGBA", "LA", "P"):
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+
+            img.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+
+            out = io.BytesIO()
+            # Nessun exif / icc_profile passato → metadati rimossi
+            img.save(
+                out,
+                format="JPEG",
+                quality=self.quality,
+                progressive=True,
+                optimize=True,
+            )
+            return out.getvalue()
+
+    def normalize(self, content: bytes, content_type: str) -> tuple[bytes, str]:
+        """Ritorna (bytes, content_type) da caricare. In caso di problemi: sorgente invariata."""
+        if Image is None or content_type not in NORMALIZABLE_TYPES or not content:
+            return content, content_type
+
+        key = self._key(content)
+        cached = self._cache_get(key)
+        if cached is not None:
+            with self._lock:
+                self.stats["hits"] += 1
+            return cached, "image/jpeg"
+
+        try:
+            data = self._transcode(content)
+        except Exception:
+            logger.warning("[MARKETPLACE_IMAGES] Transcoding fallito, uso originale", exc_info=True)
+            with self._lock:
+                self.stats["failed"] += 1
+            return content, content_type
+
+        # JPEG già piccolo e nei limiti: tengo l'originale se il transcoding non guadagna
+        if content_type == "image/jpeg" and len(data) >= len(content):
+            data = content
+
+        self._cache_put(key, data)
+
+        with self._lock:
+            self.stats["misses"] += 1
+            self.stats["bytes_in"] += len(content)
+            self.stats["bytes_out"] += len(data)
+
+        logger.info(
+            "[MARKETPLACE_IMAGES] Normalizzata %s %d KB → %d KB",
+            content_type,
+            len(content) // 1024,
+            len(data) // 1024,
+        )
+        return data, "image/jpeg"
+
+
+_normalizer: ImageNormalizer | None = None
+_normalizer_lock = threading.Lock()
+
+if NORMALIZE_ENABLED and Image is None:
+    logger.warning("[MARKETPLACE_IMAGES] MARKETPLACE_IMAGE_NORMALIZE attivo ma Pillow non installato")
+
+
+def get_normalizer() -> ImageNormalizer:
+    """Normalizer di processo (creato alla prima chiamata)."""
+    global _normalizer
+    if _normalizer is None:
+        with _normalizer_lock:
+            if _normalizer is None:
+                _normalizer = ImageNormalizer()
+    return _normalizer
+
+
+def normalize_image(content: bytes, content_type: str) -> tuple[bytes, str]:
+    """Normalizza se MARKETPLACE_IMAGE_NORMALIZE=true, altrimenti passthrough."""
+    if not NORMALIZE_ENABLED:
+        return content, content_type
+    return get_normalizer().normalize(content, content_type)
+
+
+def normalization_stats() -> dict:
+    return dict(_normalizer.stats) if _normalizer is not None else {}
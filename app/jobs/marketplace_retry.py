@@ -0,0 +1,147 @@
+"""Marketplace — retry schedulati per autoscout_listings / asm_listings.
+
+Un errore AS24/ASM non lascia più la riga in ERROR "per sempre":
+- status = 'ERROR', retry_status = operazione da ritentare
+  (PENDING_CREATE / UPDATE_REQUIRED / DELETE_REQUIRED)
+- next_attempt_at = now() + backoff esponenziale con jitter
+- dopo MAX_ATTEMPTS tentativi → status = 'DEAD_LETTER' (niente più retry)
+
+I claim dei job prendono le righe in coda + le ERROR scadute (due_filter)
++ le PROCESSING con lease scaduto (worker morto a metà lavoro).
+Le ERROR storiche senza retry_status restano ferme come prima.
+Schema: sql/002_marketplace_retry_schedule.sql, sql/004_marketplace_processing_lease.sql
+"""
+
+import logging
+import os
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = int(os.getenv("MARKETPLACE_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE_SECONDS = int(os.getenv("MARKETPLACE_BACKOFF_BASE_SECONDS", "60"))
+BACKOFF_MAX_SECONDS = int(os.getenv("MARKETPLACE_BACKOFF_MAX_SECONDS", "21600"))  # 6h
+
+MARKETPLACE_TABLES = ("autoscout_listings", "asm_listings")
+
+
+def due_filter(*statuses: str) -> str:
+    """
+    Frammento WHERE: righe in coda con uno degli status dati
+    + righe ERROR il cui retry della stessa operazione è scaduto
+    + righe PROCESSING della stessa operazione con lease scaduto.
+    Righe rimesse in coda da CoreAPI mentre un run ha ancora il lease
+    (chiamata al portale in volo) restano fuori finché il lease non viene
+    rilasciato o scade: un nuovo claim sovrascriverebbe il token e l'esito
+    (es. listing_id appena creato) andrebbe perso.
+    """
+    in_list = ", ".join(f"'{s}'" for s in statuses)
+    return f"""(
+        (
+            status IN ({in_list})
+            AND (lease_expires_at IS NULL OR lease_expires_at <= now())
+        )
+        OR (
+            status = 'ERROR'
+            AND retry_status IN ({in_list})
+            AND next_attempt_at <= now()
+        )
+        OR (
+            status = 'PROCESSING'
+            AND lease_operation IN ({in_list})
+            AND lease_expires_at <= now()
+        )
+    )"""
+
+
+def as_operation(row) -> dict:
+    """
+    Riga claimata → dict con status = operazione effettiva
+    (ERROR → retry_status, PROCESSING → lease_operation).
+    """
+    row = dict(row)
+    if row.get("status") == "ERROR" and row.get("retry_status"):
+        row["status"] = row["retry_status"]
+    elif row.get("status") == "PROCESSING" and row.get("lease_operation"):
+        row["status"] = row["lease_operation"]
+    return row
+
+
+def schedule_retry(session, table: str, row_id, error: str, operation: str, lease_token=None) -> str | None:
+    """
+    Registra il fallimento e pianifica il prossimo tentativo.
+    Backoff: base * 2^retry_count (max BACKOFF_MAX_SECONDS), jitter 50–100%.
+    Con lease_token aggiorna solo la riga con quel lease. Se nel frattempo
+    CoreAPI l'ha rimessa in coda (status != PROCESSING) il lease viene
+    comunque rilasciato, ma status / retry restano quelli nuovi → None.
+    Ritorna lo status risultante ('ERROR' | 'DEAD_LETTER' | None).
+    """
+    if table not in MARKETPLACE_TABLES:
+        raise ValueError(f"Tabella marketplace non valida: {table}")
+
+    # false = riga rimessa in coda da CoreAPI durante il lease
+    held = "(CAST(:lease_token AS uuid) IS NULL OR status = 'PROCESSING')"
+
+    status = session.execute(
+        text(f"""
+            UPDATE {table}
+            SET
+                status = CASE
+                    WHEN NOT {held} THEN status
+                    WHEN retry_count + 1 >= :max_attempts THEN 'DEAD_LETTER'
+                    ELSE 'ERROR'
+                END,
+                retry_status = CASE WHEN {held} THEN :operation ELSE retry_status END,
+                last_error = :error,
+                retry_count = CASE WHEN {held} THEN retry_count + 1 ELSE retry_count END,
+                last_attempt_at = now(),
+                next_attempt_at = CASE
+                    WHEN NOT {held} THEN next_attempt_at
+                    WHEN retry_count + 1 >= :max_attempts THEN NULL
+                    ELSE now() + make_interval(
+                        secs => least(:base * power(2, retry_count), :cap) * (0.5 + random() * 0.5)
+                    )
+                END,
+                lease_token = NULL,
+                lease_expires_at = NULL
+            WHERE id = :id
+              AND (
+                  CAST(:lease_token AS uuid) IS NULL
+                  OR lease_token = CAST(:lease_token AS uuid)
+              )
+            RETURNING status
+        """),
+        {
+            "id": row_id,
+            "error": error,
+            "operation": operation,
+            "lease_token": lease_token,
+            "max_attempts": MAX_ATTEMPTS,
+            "base": BACKOFF_BASE_SECONDS,
+            "cap": BACKOFF_MAX_SECONDS,
+        },
+    ).scalar()
+
+    if status not in ("ERROR", "DEAD_LETTER"):
+        if status is not None:
+            logger.info(
+                "[MARKETPLACE_RETRY] %s id=%s rimessa in coda (%s) durante il lease: retry non schedulato | op=%s",
+                table,
+                row_id,
+                status,
+                operation,
+            )
+        return None
+
+    if status == "DEAD_LETTER":
+        logger.error(
+            "[MARKETPLACE_RETRY] %s id=%s in DEAD_LETTER dopo %d tentativi | op=%s err=%s",
+            table,
+            row_id,
+            MAX_ATTEMPTS,
+            operation,
+            error,
+        )
+
+    return status
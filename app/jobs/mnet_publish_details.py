@@ -0,0 +1,184 @@
+"""Motornet — snapshot materializzato dei dettagli usati dai payload marketplace.
+
+mnet_publish_details (sql/003_mnet_publish_details.sql) contiene per
+codice_motornet_uni solo i campi letti da AS24 / ASM:
+- base (vista v_mnet_dettagli_unificati): catalog, marca, modello, allestimento, trazione
+- det_auto (mnet_dettagli_usato) / det_vic (mnet_vcom_dettagli) come jsonb
+
+Refresh incrementale: upsert dei soli codici passati, riscrive la riga
+solo se qualcosa è cambiato (IS DISTINCT FROM). codici=None → refresh completo.
+"""
+
+import logging
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.database import DBSession
+
+logger = logging.getLogger(__name__)
+
+BASE_COLUMNS = ("catalog", "marca", "modello", "allestimento", "trazione")
+
+DET_AUTO_COLUMNS = (
+    "tipo",
+    "segmento",
+    "alimentazione",
+    "cambio",
+    "kw",
+    "cilindrata",
+    "cilindri",
+    "peso_vuoto",
+    "posti",
+    "porte",
+    "emissioni_co2",
+    "consumo_urbano",
+    "consumo_extraurbano",
+    "consumo_medio",
+    "descrizione_marce",
+)
+
+DET_VIC_COLUMNS = (
+    "tipo_codice",
+    "tipo_descrizione",
+    "categoria_codice",
+    "categoria_descrizione",
+    "cilindrata",
+    "hp",
+    "kw",
+    "alimentazione_codice",
+    "alimentazione_descrizione",
+    "cambio_codice",
+    "cambio_descrizione",
+    "trazione_codice",
+    "trazione_descrizione",
+    "lunghezza",
+    "larghezza",
+    "altezza",
+    "passo",
+    "porte",
+    "posti",
+    "peso_vuoto",
+    "peso_totale_terra",
+    "portata",
+)
+
+
+def _jsonb(alias: str, columns) -> str:
+    pairs = ", ".join(f"'{c}', {alias}.{c}" for c in columns)
+    return (
+        f"CASE WHEN {alias}.codice_motornet_uni IS NULL THEN NULL "
+        f"ELSE jsonb_build_object({pairs}) END"
+    )
+
+
+_UPSERT_SQL = f"""
+    INSERT INTO mnet_publish_details (
+        codice_motornet_uni, {", ".join(BASE_COLUMNS)}, det_auto, det_vic, refreshed_at
+    )
+    SELECT DISTINCT ON (v.codice_motornet_uni)
+        v.codice_motornet_uni,
+        {", ".join(f"v.{c}" for c in BASE_COLUMNS)},
+        {_jsonb("d", DET_AUTO_COLUMNS)},
+        {_jsonb("c", DET_VIC_COLUMNS)},
+        now()
+    FROM v_mnet_dettagli_unificati v
+    LEFT JOIN mnet_dettagli_usato d ON d.codice_motornet_uni = v.codice_motornet_uni
+    LEFT JOIN mnet_vcom_dettagli c ON c.codice_motornet_uni = v.codice_motornet_uni
+    WHERE {{where}}
+    ORDER BY v.codice_motornet_uni
+    ON CONFLICT (codice_motornet_uni) DO UPDATE SET
+        {", ".join(f"{c} = EXCLUDED.{c}" for c in BASE_COLUMNS)},
+        det_auto = EXCLUDED.det_auto,
+        det_vic = EXCLUDED.det_vic,
+        refreshed_at = now()
+    WHERE (
+        {", ".join(f"mnet_publish_details.{c}" for c in BASE_COLUMNS)},
+        mnet_publish_details.det_auto,
+        mnet_publish_details.det_vic
+    ) IS DISTINCT FROM (
+        {", ".join(f"EXCLUDED.{c}" for c in BASE_COLUMNS)},
+        EXCLUDED.det_auto,
+        EXCLUDED.det_vic
+    )
+"""
+
+
+def refresh_publish_details(session, codici=None) -> int:
+    """
+    Upsert nello snapshot dei codici dati (None = tutti).
+    Ritorna le righe inserite/aggiornate. Il commit è del chiamante.
+    Gira in un savepoint: un errore qui non annulla il lavoro del job chiamante.
+    """
+    t0 = time.monotonic()
+
+    if codici is not None:
+        codici = sorted({c for c in codici if c})
+        if not codici:
+            return 0
+
+    try:
+        with session.begin_nested():
+            if codici is None:
+                res = session.execute(text(_UPSERT_SQL.format(where="true")))
+            else:
+                res = session.execute(
+                    text(_UPSERT_SQL.format(where="v.codice_motornet_uni = ANY(:codici)")),
+                    {"codici": codici},
+                )
+    except SQLAlchemyError:
+        logger.exception("[MNET_PUBLISH_DETAILS] Refresh fallito")
+        return 0
+
+    logger.info(
+        "[MNET_PUBLISH_DETAILS] Refresh %s | righe cambiate=%d in %.2fs",
+        "completo" if codici is None else f"{len(codici)} codici",
+        res.rowcount,
+        time.monotonic() - t0,
+    )
+    return res.rowcount
+
+
+def load_publish_details(session, codici) -> dict:
+    """
+    codice_motornet_uni → {"base": {...}, "det_auto": {...} | None, "det_vic": {...} | None}
+    Point read a chiave primaria; i codici non ancora materializzati
+    vengono rinfrescati al volo (una volta) e riletti.
+    """
+    codici = sorted({c for c in codici if c})
+    if not codici:
+        return {}
+
+    def _read(keys):
+        return {
+            r["codice_motornet_uni"]: {
+                "base": {"codice_motornet_uni": r["codice_motornet_uni"], **{c: r[c] for c in BASE_COLUMNS}},
+                "det_auto": r["det_auto"],
+                "det_vic": r["det_vic"],
+            }
+            for r in session.execute(
+                text(f"""
+                    SELECT codice_motornet_uni, {", ".join(BASE_COLUMNS)}, det_auto, det_vic
+                    FROM mnet_publish_details
+                    WHERE codice_motornet_uni = ANY(:codici)
+                """),
+                {"codici": keys},
+            ).mappings().all()
+        }
+
+    details = _read(codici)
+
+    missing = [c for c in codici if c not in details]
+    if missing:
+        refresh_publish_details(session, missing)
+        details.update(_read(missing))
+
+    return details
+
+
+def refresh_publish_details_job() -> None:
+    """Refresh completo di sicurezza (schedulato): riscrive solo le righe cambiate."""
+    with DBSession("batch") as db:
+        db.execute(text("SET LOCAL statement_timeout = '10min'"))
+        refresh_publish_details(db, None)
@@ -48,16 +48,18 @@ def delete_nuovo_modello(db, codice_modello: str):
         {"codice_modello": codice_modello},
     )
 
-    # 2) modello NUOVO (best-effort)
+    # 2) modello NUOVO (best-effort, in savepoint: un FK violato non
+    #    invalida la transazione del chiamante)
     try:
-        db.execute(
-            text("""
-                DELETE FROM mnet_modelli
-                WHERE codice_modello = :codice_modello
-            """),
-            {"codice_modello": codice_modello},
-        )
-    except Exception as e:
+        with db.begin_nested():
+            db.execute(
+                text("""
+                    DELETE FROM mnet_modelli
+                    WHERE codice_modello = :codice_modello
+                """),
+                {"codice_modello": codice_modello},
+            )
+    except Exception:
         logging.warning(
             "[NUOVO][MODELLI] SKIP DELETE %s (referenced elsewhere)",
             codice_modello,
@@ -79,7 +81,7 @@ def sync_nuovo_marche():
 
     inserted = 0
 
-    with DBSession() as db:
+    with DBSession("batch") as db:
         for m in marche:
             res = db.execute(
                 text("""
@@ -129,7 +131,7 @@ def sync_nuovo_marche():
 def sync_nuovo_modelli():
     logging.info("[NUOVO][MODELLI] START")
 
-    with DBSession() as db:
+    with DBSession("batch") as db:
         rows = db.execute(
             text("SELECT acronimo FROM mnet_marche WHERE utile IS TRUE ORDER BY acronimo")
         ).fetchall()
@@ -174,7 +176,7 @@ def sync_nuovo_modelli():
         if not modelli:
             continue
 
-        with DBSession() as db:
+        with DBSession("batch") as db:
             for m in modelli:
                 gamma = m.get("gammaModello") or {}
                 gruppo = m.get("gruppoStorico") or {}
@@ -188,13 +190,13 @@ def sync_nuovo_modelli():
 
                 # REGOLA DOMINIO NUOVO (CONGELATA)
                 if fine_produzione:
-                    with DBSession() as db_del:
-                        delete_nuovo_modello(db_del, codice_modello)
-                        logging.info(
-                            "[NUOVO][MODELLI] DELETE %s (fineProduzione=%s)",
-                            codice_modello,
-                            fine_produzione,
-                        )
+                    # stessa sessione: niente seconda connessione batch per il job
+                    delete_nuovo_modello(db, codice_modello)
+                    logging.info(
+                        "[NUOVO][MODELLI] DELETE %s (fineProduzione=%s)",
+                        codice_modello,
+                        fine_produzione,
+                    )
                     continue
 
                 res = db.execute(
@@ -266,7 +268,7 @@ def sync_nuovo_modelli():
 def sync_nuovo_allestimenti():
     logging.info("[NUOVO][ALLESTIMENTI] START")
 
-    with DBSession() as db:
+    with DBSession("batch") as db:
         rows = db.execute(
             text("""
                 SELECT m.codice_modello
@@ -302,7 +304,7 @@ def sync_nuovo_allestimenti():
             if not versioni:
                 continue
 
-            with DBSession() as db:
+            with DBSession("batch") as db:
                 for v in versioni:
                     codice_uni = v.get("codiceMotornetUnivoco")
                     if not codice_uni:
@@ -381,7 +383,7 @@ def sync_nuovo_dettagli():
     logging.info("[NUOVO][DETTAGLI] START")
 
     # 1) SOLO allestimenti senza dettagli
-    with DBSession() as db:
+    with DBSession("batch") as db:
         rows = db.execute(
             text("""
                 SELECT a.codice_motornet_uni
@@ -417,7 +419,7 @@ def sync_nuovo_dettagli():
             if not modello:
                 raise RuntimeError("Empty dettaglio payload")
 
-            with DBSession() as db:
+            with DBSession("batch") as db:
                 res = db.execute(
                     text("""  -- (QUI resta IDENTICO il tuo INSERT in mnet_dettagli) 
                         INSERT INTO mnet_dettagli (
@@ -715,7 +717,7 @@ def sync_nuovo_dettagli():
 
             # 412 + "Veicolo fuori produzione" -> DELETE allestimento
             if "[412]" in msg and "Veicolo fuori produzione" in msg:
-                with DBSession() as db_del:
+                with DBSession("batch") as db_del:
                     try:
                         delete_nuovo_allestimento(db_del, codice_uni)
                         deleted_fuori_produzione += 1
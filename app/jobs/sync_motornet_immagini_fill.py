@@ -6,7 +6,7 @@ from collections import defaultdict
 
 from sqlalchemy import text
 
-from app.database import DBSession
+from app.database import AsyncDBSession, DBSession
 from app.external.motornet import motornet_get
 
 
@@ -183,7 +183,7 @@ async def fetch_one(code: str, sem: asyncio.Semaphore) -> Tuple[str, Optional[Di
 
 
 def load_codes() -> List[str]:
-    with DBSession() as db:
+    with DBSession("batch") as db:
         if ONLY_CODES_WITH_LT and ONLY_CODES_WITH_LT > 0:
             rows = db.execute(text(SQL_GET_CODES_ONLY_LT), {"max_n": ONLY_CODES_WITH_LT}).fetchall()
         else:
@@ -195,12 +195,11 @@ def load_codes() -> List[str]:
     return codes
 
 
-def db_count_for_code(code: str) -> int:
-    with DBSession() as db:
-        return int(db.execute(text(SQL_COUNT_FOR_CODE), {"codice": code}).scalar() or 0)
+async def db_count_for_code(db, code: str) -> int:
+    return int((await db.execute(text(SQL_COUNT_FOR_CODE), {"codice": code})).scalar() or 0)
 
 
-def upsert_selected(code: str, selected: List[Dict[str, Any]]) -> int:
+async def upsert_selected(db, code: str, selected: List[Dict[str, Any]]) -> int:
     if not selected:
         return 0
 
@@ -217,8 +216,7 @@ def upsert_selected(code: str, selected: List[Dict[str, Any]]) -> int:
             }
         )
 
-    with DBSession() as db:
-        db.execute(text(SQL_UPSERT_IMAGE), params_list)
+    await db.execute(text(SQL_UPSERT_IMAGE), params_list)
 
     return len(params_list)
 
@@ -247,42 +245,49 @@ def run() -> None:
     failed_total = 0
     processed = 0
 
-    async def _run_batch(batch: List[str]) -> List[Tuple[str, Optional[Dict[str, Any]], Optional[str]]]:
+    async def _run_batch(batch: List[str]) -> None:
+        """
+        Fetch Motornet in parallelo; ogni risposta viene scritta appena
+        arriva (AsyncDBSession) mentre le altre richieste sono in volo.
+        """
+        nonlocal inserted_total, failed_total, processed
+
         sem = asyncio.Semaphore(DEFAULT_CONCURRENCY)
-        tasks = [fetch_one(c, sem) for c in batch]
-        return await asyncio.gather(*tasks)
+        async with AsyncDBSession() as db:
+            for next_done in asyncio.as_completed([fetch_one(c, sem) for c in batch]):
+                code, payload, err = await next_done
+                processed += 1
+
+                if err:
+                    failed_total += 1
+                    logging.error("[NUOVO][IMMAGINI_FILL] %s FAILED (motornet=%s)", code, err)
+                    continue
+
+                selected = select_images(payload or {})
+                before = await db_count_for_code(db, code)
+
+                upserted = await upsert_selected(db, code, selected)
+                after = await db_count_for_code(db, code)
+                await db.commit()  # niente transazione aperta durante l'attesa HTTP
+
+                # Nota: upserted = righe inviate al DB, non “nuove”.
+                # Il delta reale è (after - before).
+                delta = after - before
+                inserted_total += max(delta, 0)
+
+                logging.info(
+                    "[NUOVO][IMMAGINI_FILL] %s raw=%d selected=%d before=%d after=%d delta=%d upserted=%d",
+                    code,
+                    len((payload or {}).get("immagini") or []),
+                    len(selected),
+                    before,
+                    after,
+                    delta,
+                    upserted,
+                )
 
     for batch in chunked(codes, DEFAULT_BATCH_SIZE):
-        results = asyncio.run(_run_batch(batch))
-
-        for code, payload, err in results:
-            processed += 1
-
-            if err:
-                failed_total += 1
-                logging.error("[NUOVO][IMMAGINI_FILL] %s FAILED (motornet=%s)", code, err)
-                continue
-
-            selected = select_images(payload or {})
-            before = db_count_for_code(code)
-
-            upserted = upsert_selected(code, selected)
-            after = db_count_for_code(code)
-
-            # Nota: upserted = righe inviate al DB, non “nuove”.
-            # Il delta reale è (after - before).
-            delta = after - before
-            inserted_total += max(delta, 0)
-
-            logging.info(
-                "[NUOVO][IMMAGINI_FILL] %s raw=%d selected=%d before=%d after=%d delta=%d",
-                code,
-                len((payload or {}).get("immagini") or []),
-                len(selected),
-                before,
-                after,
-                delta,
-            )
+        asyncio.run(_run_batch(batch))
 
     logging.info(
         "[NUOVO][IMMAGINI_FILL] DONE (processed=%d/%d, inserted_new=%d, failed=%d)",
@@ -5,8 +5,9 @@ import logging
 from datetime import date
 from sqlalchemy import text
 
-from app.database import DBSession
+from app.database import AsyncDBSession, DBSession
 from app.external.motornet import motornet_get
+from app.jobs.mnet_publish_details import refresh_publish_details
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -36,7 +37,7 @@ def sync_usato_marche():
         return
 
     inserted = 0
-    with DBSession() as db:
+    with DBSession("batch") as db:
         for m in marche:
             res = db.execute(
                 text("""
@@ -79,7 +80,7 @@ def sync_usato_anni():
     anno, mese = today.year, today.month
 
     inserted = 0
-    with DBSession() as db:
+    with DBSession("batch") as db:
         # marche già note (USATO)
         rows = db.execute(
             text("SELECT acronimo FROM mnet_marche_usato ORDER BY acronimo")
@@ -120,7 +121,7 @@ def sync_usato_anni():
 def sync_usato_modelli():
     logger.info("[USATO][MODELLI] START")
 
-    with DBSession() as db:
+    with DBSession("batch") as db:
         combos = db.execute(
             text("""
                 SELECT marca_acronimo, anno
@@ -143,7 +144,7 @@ def sync_usato_modelli():
             if not modelli:
                 continue
 
-            with DBSession() as db:
+            with DBSession("batch") as db:
                 for m in modelli:
                     cod_desc = (m.get("codDescModello") or {}).get("codice")
                     gamma = (m.get("gammaModello") or {}).get("codice")
@@ -214,7 +215,7 @@ def sync_usato_modelli():
 def sync_usato_allestimenti():
     logger.info("[USATO][ALLESTIMENTI] START")
 
-    with DBSession() as db:
+    with DBSession("batch") as db:
         rows = db.execute(
             text("""
                 SELECT DISTINCT m.marca_acronimo, a.anno, m.codice_modello
@@ -238,7 +239,7 @@ def sync_usato_allestimenti():
             if not versioni:
                 continue
 
-            with DBSession() as db:
+            with DBSession("batch") as db:
                 for v in versioni:
                     codice_uni = v.get("codiceMotornet")
                     if not codice_uni:
@@ -392,7 +393,13 @@ def build_params(modello: dict, codice: str) -> dict:
     }
 
 
-async def _sync_usato_dettagli_async(db, codici):
+async def _sync_usato_dettagli_async(codici):
+    """Insert dei dettagli via AsyncDBSession: DB e Motornet sullo stesso loop."""
+    async with AsyncDBSession() as db:
+        return await _insert_usato_dettagli(db, codici)
+
+
+async def _insert_usato_dettagli(db, codici):
     processed = 0
     inserted = 0
     seen = len(codici)
@@ -415,7 +422,7 @@ async def _sync_usato_dettagli_async(db, codici):
                     
                 params = build_params(modello, codice)
 
-                res = db.execute(
+                res = await db.execute(
                     text("""
                         INSERT INTO mnet_dettagli_usato (
                             codice_motornet_uni, modello, allestimento, immagine,
@@ -465,9 +472,10 @@ async def _sync_usato_dettagli_async(db, codici):
 
                 )
 
+                await db.commit()  # niente transazione aperta durante l'attesa HTTP
+
                 if res.rowcount == 1:
                     inserted += 1
-                    db.commit()
                     success = True
                 
                     await asyncio.sleep(random.uniform(0.7, 0.9))
@@ -520,7 +528,7 @@ async def _sync_usato_dettagli_async(db, codici):
 def sync_usato_dettagli():
     logger.info("[USATO][DETTAGLI] START")
 
-    with DBSession() as db:
+    with DBSession("batch") as db:
         rows = db.execute(
             text("""
                 SELECT DISTINCT a.codice_motornet_uni
@@ -536,23 +544,28 @@ def sync_usato_dettagli():
             """)
         ).fetchall()
 
-        codici = [r[0] for r in rows]
-        if not codici:
-            logger.info("[USATO][DETTAGLI] NOTHING TO DO")
-            return
+    codici = [r[0] for r in rows]
+    if not codici:
+        logger.info("[USATO][DETTAGLI] NOTHING TO DO")
+        return
 
-        processed, inserted, updated = asyncio.run(
-            _sync_usato_dettagli_async(db, codici)
-        )
+    # Sessione sync chiusa: durante le chiamate Motornet nessuna
+    # transazione resta aperta, le insert passano da AsyncDBSession
+    processed, inserted, updated = asyncio.run(
+        _sync_usato_dettagli_async(codici)
+    )
 
-        db.commit()
+    # Snapshot per i payload marketplace (solo codici ora presenti)
+    if inserted:
+        with DBSession("batch") as db:
+            refresh_publish_details(db, codici)
 
-        logger.info(
-            "[USATO][DETTAGLI] DONE processed=%d new=%d updated=%d",
-            processed,
-            inserted,
-            updated,
-        )
+    logger.info(
+        "[USATO][DETTAGLI] DONE processed=%d new=%d updated=%d",
+        processed,
+        inserted,
+        updated,
+    )
 
 # ============================================================
 # STOCK → VEHICLE_VERSIONS_CM (cod_versione_cm → Motornet mapping)
@@ -892,6 +905,14 @@ def _brand_matches(stock_brand: str | None, motornet_brand: str | None) -> bool:
 
 
 async def _sync_vehicle_versions_cm_async(
+    codici_map: Dict[str, str],
+) -> Tuple[int, int, int, int]:
+    """Upsert via AsyncDBSession: DB e Motornet sullo stesso loop."""
+    async with AsyncDBSession() as db:
+        return await _upsert_vehicle_versions_cm(db, codici_map)
+
+
+async def _upsert_vehicle_versions_cm(
     db,
     codici_map: Dict[str, str],
 ) -> Tuple[int, int, int, int]:
@@ -981,14 +1002,14 @@ async def _sync_vehicle_versions_cm_async(
                 skipped += 1
                 continue
 
-            db.execute(
+            await db.execute(
                 UPSERT_SQL,
                 {
                     **row,
                     "raw_payload": json.dumps(row["raw_payload"]),
                 },
             )
-            db.commit()
+            await db.commit()
             upserted += 1
 
 
@@ -1025,7 +1046,7 @@ def sync_vehicle_versions_cm_from_stock() -> None:
     """
     logger.info("[VEHICLE_VERSIONS_CM] START")
 
-    with DBSession() as db:
+    with DBSession("batch") as db:
        codici_map = _fetch_codici_da_stock(db)
 
 
@@ -1033,12 +1054,12 @@ def sync_vehicle_versions_cm_from_stock() -> None:
         logger.info("[VEHICLE_VERSIONS_CM] NOTHING TO DO")
         return
 
-    # eseguo in una sessione dedicata per le write
-    with DBSession() as db:
-        processed, upserted, skipped, failed = asyncio.run(
-            _sync_vehicle_versions_cm_async(db, codici_map)
-        )
-        
+    # write in AsyncDBSession (una connessione per tutto il run)
+    processed, upserted, skipped, failed = asyncio.run(
+        _sync_vehicle_versions_cm_async(codici_map)
+    )
+
+    with DBSession("batch") as db:
         # --------------------------------------------------
         # LINK STOCK → VEHICLE_VERSIONS_CM (idempotente)
         # --------------------------------------------------
@@ -45,7 +45,7 @@ from openai import OpenAI
 from sqlalchemy import text
 
 from app.database import SessionLocal
-from app.storage import upload_bytes_and_get_public_url
+from app.storage import upload_file_and_get_public_url
 
 logger = logging.getLogger(__name__)
 
@@ -430,44 +430,36 @@ def _preprocess_dialogue_for_tts(dialogue: str, primary_domain: str | None) -> s
     return dialogue
 
 
-def _pcm_to_wav(pcm_bytes: bytes, sample_rate: int = 24000) -> bytes:
+def _write_wav(pcm_bytes: bytes, wav_path: Path, sample_rate: int = 24000) -> None:
+    """Header WAV + PCM scritti su disco (nessuna copia WAV in memoria)."""
     num_channels = 1
     bits_per_sample = 16
     byte_rate = sample_rate * num_channels * bits_per_sample // 8
     block_align = num_channels * bits_per_sample // 8
     data_size = len(pcm_bytes)
-    fmt_chunk = struct.pack(
-        "<4sIHHIIHH",
-        b"fmt ", 16, 1, num_channels, sample_rate, byte_rate, block_align, bits_per_sample,
-    )
-    data_chunk = struct.pack("<4sI", b"data", data_size) + pcm_bytes
-    riff = struct.pack("<4sI4s", b"RIFF", 36 + data_size, b"WAVE")
-    return riff + fmt_chunk + data_chunk
-
-
-def _wav_to_mp3(wav_bytes: bytes) -> bytes | None:
-    """Converte WAV -> MP3 128k via ffmpeg. None se ffmpeg non disponibile."""
+    with open(wav_path, "wb") as f:
+        f.write(struct.pack("<4sI4s", b"RIFF", 36 + data_size, b"WAVE"))
+        f.write(struct.pack(
+            "<4sIHHIIHH",
+            b"fmt ", 16, 1, num_channels, sample_rate, byte_rate, block_align, bits_per_sample,
+        ))
+        f.write(struct.pack("<4sI", b"data", data_size))
+        f.write(pcm_bytes)
+
+
+def _wav_to_mp3(wav_path: Path) -> Path | None:
+    """Converte WAV -> MP3 128k via ffmpeg (file → file). None se ffmpeg non disponibile."""
+    mp3_path = wav_path.with_suffix(".mp3")
     try:
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tf_in:
-            tf_in.write(wav_bytes)
-            wav_path = tf_in.name
-        mp3_path = wav_path.replace(".wav", ".mp3")
-        try:
-            subprocess.run(
-                [
-                    "ffmpeg", "-y", "-i", wav_path,
-                    "-codec:a", "libmp3lame", "-b:a", "128k", "-ar", "24000",
-                    mp3_path,
-                ],
-                check=True, capture_output=True, timeout=60,
-            )
-            return Path(mp3_path).read_bytes()
-        finally:
-            for p in (wav_path, mp3_path):
-                try:
-                    os.remove(p)
-                except OSError:
-                    pass
+        subprocess.run(
+            [
+                "ffmpeg", "-y", "-i", str(wav_path),
+                "-codec:a", "libmp3lame", "-b:a", "128k", "-ar", "24000",
+                str(mp3_path),
+            ],
+            check=True, capture_output=True, timeout=60,
+        )
+        return mp3_path
     except (FileNotFoundError, subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
         logger.warning("[PODCAST] ffmpeg failed: %s — fallback WAV", e)
         return None
@@ -730,22 +722,28 @@ def _process_row(row_id: str, id_auto: str, dealer_id: int, attempts: int) -> No
 
     tts_dialogue = _preprocess_dialogue_for_tts(dialogue, ctx.get("_primary_domain"))
     pcm = _synthesize_pcm(tts_dialogue)
-    wav_bytes = _pcm_to_wav(pcm)
-    mp3_bytes = _wav_to_mp3(wav_bytes)
-
-    audio_bytes = mp3_bytes if mp3_bytes else wav_bytes
-    audio_mime = "audio/mpeg" if mp3_bytes else "audio/wav"
-    audio_ext = "mp3" if mp3_bytes else "wav"
     duration_sec = max(1, int(len(pcm) / 48000))  # PCM 16bit mono 24kHz
 
-    # Upload Supabase Storage
-    filename = f"{id_auto}.{audio_ext}"
-    audio_url = upload_bytes_and_get_public_url(
-        bucket=PODCAST_BUCKET,
-        path=filename,
-        content=audio_bytes,
-        content_type=audio_mime,
-    )
+    # WAV / MP3 su file temporanei: in memoria resta al più il PCM
+    with tempfile.TemporaryDirectory(prefix="podcast-") as tmp_dir:
+        wav_path = Path(tmp_dir) / f"{id_auto}.wav"
+        _write_wav(pcm, wav_path)
+        del pcm
+        mp3_path = _wav_to_mp3(wav_path)
+
+        audio_path = mp3_path or wav_path
+        audio_mime = "audio/mpeg" if mp3_path else "audio/wav"
+        audio_ext = "mp3" if mp3_path else "wav"
+        audio_size = audio_path.stat().st_size
+
+        # Upload Supabase Storage in streaming (resumable se grande)
+        filename = f"{id_auto}.{audio_ext}"
+        audio_url = upload_file_and_get_public_url(
+            bucket=PODCAST_BUCKET,
+            path=filename,
+            file_path=audio_path,
+            content_type=audio_mime,
+        )
     # Cache-bust per la UI
     audio_url_with_v = f"{audio_url}?v={int(datetime.utcnow().timestamp())}"
 
@@ -778,7 +776,7 @@ def _process_row(row_id: str, id_auto: str, dealer_id: int, attempts: int) -> No
                 "row_id": row_id,
                 "audio_url": audio_url_with_v,
                 "duration_sec": duration_sec,
-                "size_bytes": len(audio_bytes),
+                "size_bytes": audio_size,
                 "audio_mime": audio_mime,
                 "title": title,
                 "description": description,
@@ -1,16 +1,36 @@
 import csv
+import hashlib
 import io
+import json
 import logging
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
 from datetime import datetime
+from functools import lru_cache
 
 from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
 
-from app.database import engine
-from app.storage import download_bytes
+from app.database import engine, get_engine
+from app.sql_stats import propagate
+from app.storage import open_download_stream
 
 logger = logging.getLogger(__name__)
 
-import re
+# Timeout per gli statement dell'import (COPY / upsert / delete su export grandi)
+IMPORT_STATEMENT_TIMEOUT = os.getenv("VEHICLE_STOCK_IMPORT_STATEMENT_TIMEOUT", "5min")
+
+# Import di sorgenti diverse in parallelo (1 connessione DB ciascuno)
+IMPORT_WORKERS = int(os.getenv("VEHICLE_STOCK_IMPORT_WORKERS", "2"))
+
+# Auto sparite dal CSV: is_active = false (default) oppure DELETE come in passato
+HARD_DELETE_MISSING = os.getenv("VEHICLE_STOCK_HARD_DELETE_MISSING", "false").lower() == "true"
+
+_COD_VERSIONE_RE = re.compile(r'[^A-Z0-9]')
+
 
 def normalize_cod_versione_cm(raw: str | None) -> str | None:
     """
@@ -24,7 +44,7 @@ def normalize_cod_versione_cm(raw: str | None) -> str | None:
         return None
 
     raw = str(raw).strip().upper()
-    norm = re.sub(r'[^A-Z0-9]', '', raw)
+    norm = _COD_VERSIONE_RE.sub('', raw)
     return norm or None
 
 
@@ -40,309 +60,693 @@ def _parse_date(value):
     except Exception:
         return None
 
-def vehicle_stock_csv_import_job():
+# --------------------------------------------------
+# Staging (COPY) + upsert set-based
+# --------------------------------------------------
+# colonna staging → tipo. external_id + colonne dati di vehicles_stock_sale
+STAGING_COLUMNS = {
+    "external_id": "text",
+    "vid": "text",
+    "targa": "text",
+    "vin": "text",
+    "raw_linea": "text",
+    "raw_status": "text",
+    "raw_stato": "text",
+    "cod_versione_cm": "text",
+    "brand": "text",
+    "model": "text",
+    "version": "text",
+    "description": "text",
+    "vehicle_category": "text",
+    "kilometers": "bigint",
+    "first_registration_date": "date",
+    "fuel_type": "text",
+    "body_type": "text",
+    "color_ext": "text",
+    "color_int": "text",
+    "price_public": "numeric",
+    "price_showroom": "numeric",
+    "price_internal": "numeric",
+    "location": "text",
+    "arrival_date": "date",
+    "expected_arrival_date": "date",
+    "images_count": "integer",
+    "main_image_url": "text",
+    "dealer": "text",
+    "order_number": "text",
+    "stock_flag": "text",
+    "vehicle_type_raw": "text",
+    "price_reserved_1": "numeric",
+    "price_reserved_2": "numeric",
+    "confirmation_week": "text",
+    "row_hash": "text",
+}
+
+DATA_COLUMNS = [c for c in STAGING_COLUMNS if c != "external_id"]
+
+# Campi che entrano nell'hash (tutto tranne chiave e hash stesso)
+HASHED_COLUMNS = [c for c in DATA_COLUMNS if c != "row_hash"]
+
+# Righe scartate riportate nel log (le altre solo contate)
+BAD_ROWS_LOGGED = 20
+
+_UPSERT_SQL = f"""
+    insert into public.vehicles_stock_sale (
+        external_id,
+        {", ".join(DATA_COLUMNS)},
+        source,
+        last_import_id,
+        last_seen_at,
+        is_active
+    )
+    select {{distinct}}
+        s.external_id,
+        {", ".join(f"s.{c}" for c in DATA_COLUMNS)},
+        :source,
+        :import_id,
+        now(),
+        true
+    from vehicle_stock_staging s
+    where {{where}}
+    {{order}}
+    on conflict (external_id) do update set
+        {", ".join(f"{c} = excluded.{c}" for c in DATA_COLUMNS)},
+        last_import_id = excluded.last_import_id,
+        last_seen_at = excluded.last_seen_at,
+        is_active = true
+    -- riga invariata e attiva → nessuna riscrittura (solo bump più sotto)
+    where vehicles_stock_sale.row_hash is distinct from excluded.row_hash
+       or vehicles_stock_sale.is_active is not true
+    returning (xmax = 0) as inserted
+"""
+
+# Righe presenti nel CSV ma invariate: solo last_seen_at / last_import_id
+_TOUCH_UNCHANGED_SQL = """
+    update public.vehicles_stock_sale v
+    set last_seen_at = now(),
+        last_import_id = :import_id
+    from vehicle_stock_staging s
+    where v.external_id = s.external_id
+      and v.row_hash = s.row_hash
+      and v.last_import_id is distinct from :import_id
+"""
+
+
+# --------------------------------------------------
+# Normalizzazione colonnare (a chunk)
+# --------------------------------------------------
+# colonna staging → (header CSV, normalizzatore colonna)
+CSV_FIELDS = {
+    "external_id": ("ID MyGarage", "id"),
+    "vid": ("VID", "text"),
+    "targa": ("Targa", "text"),
+    "vin": ("Telaio", "text"),
+    "raw_linea": ("Linea", "text"),
+    "raw_status": ("Status", "text"),
+    "raw_stato": ("Stato", "text"),
+    "cod_versione_cm": ("Cod.Versione CM", "cod"),
+    "brand": ("Marca", "text"),
+    "model": ("Modello", "text"),
+    "version": ("Versione", "text"),
+    "description": ("Descrizione", "text"),
+    "vehicle_category": ("Veicolo comm.", "text"),
+    "kilometers": ("Chilometri", "int"),
+    "first_registration_date": ("Immatricolazione", "date"),
+    "fuel_type": ("Alimentazione", "text"),
+    "body_type": ("Tipo carrozzeria", "text"),
+    "color_ext": ("Colore esterni", "text"),
+    "color_int": ("Interni", "text"),
+    "price_public": ("Prezzo Internet", "price"),
+    "price_showroom": ("Prezzo Showroom", "price"),
+    "price_internal": ("Prezzo veicolo", "price"),
+    "location": ("Ubicazione", "text"),
+    "arrival_date": ("Data di arrivo", "date"),
+    "expected_arrival_date": ("Data prev. di arrivo", "date"),
+    "images_count": ("Immagini", "images"),
+    "main_image_url": ("Immagine", "text"),
+    "dealer": ("Dealer", "text"),
+    "order_number": ("Nr.Ordine", "text"),
+    "stock_flag": ("Stock", "text"),
+    "vehicle_type_raw": ("Tipo", "text"),
+    "price_reserved_1": ("Prezzo riservato 1", "price"),
+    "price_reserved_2": ("Prezzo riservato 2", "price"),
+    "confirmation_week": ("Sett.di conferma", "text"),
+}
+
+# Righe normalizzate per chunk prima del COPY
+NORMALIZE_CHUNK_ROWS = int(os.getenv("VEHICLE_STOCK_IMPORT_CHUNK_ROWS", "2000"))
+
+# Fast path: il caso comune senza try/except; tutto il resto passa dagli
+# helper riga per riga, quindi i valori sono identici per costruzione.
+_PRICE_FAST_RE = re.compile(r"\d+(?:\.\d+)?", re.ASCII)
+
+
+@lru_cache(maxsize=8192)
+def _parse_date_cached(value):
+    # poche date distinte per export: strptime una volta per valore
+    return _parse_date(value)
+
+
+@lru_cache(maxsize=8192)
+def _normalize_cod_cached(value):
+    return normalize_cod_versione_cm(value)
+
+
+def _col_text(values: list) -> tuple[list, int]:
+    return values, 0
+
+
+def _col_id(values: list) -> tuple[list, int]:
+    # ID mancanti: riportati dalla validazione SQL, non qui
+    return [(v or "").strip() or None for v in values], 0
+
+
+def _col_int(values: list) -> tuple[list, int]:
+    out, errors = [], 0
+    append = out.append
+    for v in values:
+        s = v.strip() if v is not None else ""
+        if not s:
+            append(None)
+            continue
+        digits = s.replace(".", "").replace(",", "").replace(" ", "")
+        if digits.isascii() and digits.isdigit():
+            append(int(digits))
+            continue
+        parsed = _parse_int(v)
+        append(parsed)
+        if parsed is None:
+            errors += 1
+    return out, errors
+
+
+def _col_images(values: list) -> tuple[list, int]:
+    out, errors = _col_int(values)
+    return [v or 0 for v in out], errors
+
+
+def _col_price(values: list) -> tuple[list, int]:
+    out, errors = [], 0
+    append = out.append
+    fast = _PRICE_FAST_RE.fullmatch
+    for v in values:
+        s = v.strip() if v is not None else ""
+        if not s:
+            append(None)
+            continue
+        number = s.replace("€", "").replace(" ", "").replace(".", "").replace(",", ".")
+        if fast(number):
+            append(float(number))
+            continue
+        parsed = _parse_price(v)
+        append(parsed)
+        if parsed is None:
+            errors += 1
+    return out, errors
+
+
+def _col_date(values: list) -> tuple[list, int]:
+    out = [_parse_date_cached(v) for v in values]
+    errors = sum(1 for v, d in zip(values, out) if d is None and v and v.strip())
+    return out, errors
+
+
+def _col_cod(values: list) -> tuple[list, int]:
+    out = [_normalize_cod_cached(v) for v in values]
+    errors = sum(1 for v, c in zip(values, out) if c is None and v and v.strip())
+    return out, errors
+
+
+_COLUMN_NORMALIZERS = {
+    "text": _col_text,
+    "id": _col_id,
+    "int": _col_int,
+    "images": _col_images,
+    "price": _col_price,
+    "date": _col_date,
+    "cod": _col_cod,
+}
+
+
+def _normalize_chunk(line_nos: list, rows: list, column_errors: dict) -> list[tuple]:
     """
-    Job schedulato:
-    - prende 1 CSV pending
-    - lo importa in vehicles_stock_sale
-    - aggiorna vehicle_stock_imports
+    Chunk di righe CSV → tuple staging (line_no + STAGING_COLUMNS).
+    Una colonna alla volta; column_errors: colonna → valori non vuoti scartati.
     """
+    columns = {}
+    for column, (header, kind) in CSV_FIELDS.items():
+        values, errors = _COLUMN_NORMALIZERS[kind]([row.get(header) for row in rows])
+        if errors:
+            column_errors[column] = column_errors.get(column, 0) + errors
+        columns[column] = values
 
-    logger.info("[CSV IMPORT] job start")
+    # hash dei campi normalizzati (repr della tupla: None ≠ '' ≠ 'None')
+    columns["row_hash"] = [
+        hashlib.sha1(repr(values).encode("utf-8")).hexdigest()
+        for values in zip(*(columns[c] for c in HASHED_COLUMNS))
+    ]
+
+    return list(zip(line_nos, *(columns[c] for c in STAGING_COLUMNS)))
+
+
+# Limiti delle colonne intere della staging (line_no compreso)
+_INT_LIMITS = {"integer": 2 ** 31 - 1, "bigint": 2 ** 63 - 1}
+_COPY_COLUMN_TYPES = ["integer", *STAGING_COLUMNS.values()]
+
+
+def _copy_row_error(values: tuple) -> str | None:
+    """
+    Controllo prima del COPY: una riga che Postgres rifiuterebbe farebbe
+    fallire l'intero COPY (e l'import). None = riga scrivibile.
+    """
+    for column, kind, value in zip(("line_no", *STAGING_COLUMNS), _COPY_COLUMN_TYPES, values):
+        if isinstance(value, str) and "\x00" in value:
+            return f"{column}: carattere NUL"
+        limit = _INT_LIMITS.get(kind)
+        if limit is not None and isinstance(value, int) and abs(value) > limit:
+            return f"{column}: {value} fuori range {kind}"
+    return None
+
+
+def _create_staging(conn) -> None:
+    conn.execute(
+        text(f"""
+            create temp table vehicle_stock_staging (
+                line_no integer not null,
+                {", ".join(f"{c} {t}" for c, t in STAGING_COLUMNS.items())}
+            ) on commit drop
+        """)
+    )
+
+
+def _copy_to_staging(conn, reader, stats: dict, column_errors: dict) -> float:
+    """
+    COPY FROM STDIN delle righe normalizzate nella staging (stessa transazione
+    della connessione SQLAlchemy), a chunk di NORMALIZE_CHUNK_ROWS righe.
+    Righe vuote / non scrivibili (_copy_row_error) → skipped, prima di
+    write_row: gli errori del COPY stesso non sono errori di riga e fanno
+    fallire l'import. Ritorna i secondi di normalizzazione.
+    """
+    cursor = conn.connection.dbapi_connection.cursor()
+    columns = ", ".join(["line_no", *STAGING_COLUMNS])
+    line_nos, rows = [], []
+    normalize_seconds = 0.0
+
+    with cursor.copy(f"copy vehicle_stock_staging ({columns}) from stdin") as copy:
+
+        def flush():
+            nonlocal normalize_seconds
+            t0 = time.monotonic()
+            staged = _normalize_chunk(line_nos, rows, column_errors)
+            normalize_seconds += time.monotonic() - t0
+
+            for values in staged:
+                error = _copy_row_error(values)
+                if error:
+                    stats["rows_skipped"] += 1
+                    logger.warning(f"[CSV IMPORT] row skipped (line={values[0]}): {error}")
+                    continue
+                copy.write_row(values)
+
+            line_nos.clear()
+            rows.clear()
+
+        for row in reader:
+            stats["rows_total"] += 1
+
+            if not any(row.values()):
+                stats["rows_skipped"] += 1
+                continue
+
+            line_nos.append(reader.line_num)
+            rows.append(row)
+            if len(rows) >= NORMALIZE_CHUNK_ROWS:
+                flush()
+
+        if rows:
+            flush()
+
+    return normalize_seconds
+
+
+def _index_staging(conn) -> None:
+    """Indice + statistiche sulla staging (le temp table non vengono analizzate da autovacuum)."""
+    conn.execute(text("create index on vehicle_stock_staging (external_id)"))
+    conn.execute(text("analyze vehicle_stock_staging"))
+
+
+def _deactivate_missing(conn, source: str, stats: dict) -> None:
+    """
+    Auto della sorgente attive ma assenti dalla staging (anti-join su
+    external_id): disattivate (o cancellate con VEHICLE_STOCK_HARD_DELETE_MISSING).
+    Costo proporzionale allo stock attivo, non allo storico della tabella.
+    """
+    staged = conn.execute(
+        text("select exists (select 1 from vehicle_stock_staging where external_id is not null)")
+    ).scalar()
+
+    if not staged:
+        # CSV vuoto / senza ID: non svuotiamo lo stock della sorgente
+        logger.warning(f"[CSV IMPORT] no valid rows staged, deactivation skipped (source={source})")
+        return
+
+    missing = """
+        v.source = :source
+        and v.is_active
+        and not exists (
+            select 1
+            from vehicle_stock_staging s
+            where s.external_id = v.external_id
+        )
+    """
+
+    if HARD_DELETE_MISSING:
+        result = conn.execute(
+            text(f"delete from public.vehicles_stock_sale v where {missing}"),
+            {"source": source},
+        )
+    else:
+        result = conn.execute(
+            text(f"""
+                update public.vehicles_stock_sale v
+                set is_active = false
+                where {missing}
+            """),
+            {"source": source},
+        )
+
+    stats["rows_deactivated"] += result.rowcount
+
+
+def _validate_staging(conn, stats: dict) -> None:
+    """
+    Validazione in SQL: righe senza external_id (scartate) e external_id
+    duplicati nel file (vince l'ultima riga, come con gli upsert in sequenza).
+    Le righe duplicate superate vanno in rows_duplicated: non sono né
+    inserite né aggiornate, così i contatori sommano a rows_total.
+    """
+    missing = conn.execute(
+        text("""
+            select line_no
+            from vehicle_stock_staging
+            where external_id is null
+            order by line_no
+        """)
+    ).scalars().all()
+
+    if missing:
+        stats["rows_skipped"] += len(missing)
+        logger.warning(
+            f"[CSV IMPORT] {len(missing)} rows without ID MyGarage skipped "
+            f"(lines: {missing[:BAD_ROWS_LOGGED]})"
+        )
+
+    duplicates = conn.execute(
+        text("""
+            select external_id, array_agg(line_no order by line_no) as lines
+            from vehicle_stock_staging
+            where external_id is not null
+            group by external_id
+            having count(*) > 1
+        """)
+    ).mappings().all()
+
+    if duplicates:
+        logger.warning(
+            f"[CSV IMPORT] {len(duplicates)} duplicated ID MyGarage, last row wins "
+            f"({[(d['external_id'], d['lines']) for d in duplicates[:BAD_ROWS_LOGGED]]})"
+        )
 
+    stats["rows_duplicated"] += sum(len(d["lines"]) - 1 for d in duplicates)
+
+
+def _upsert_from_staging(conn, import_id, source: str, stats: dict) -> None:
+    """
+    Un solo INSERT ... ON CONFLICT per tutta la staging (solo righe nuove o
+    con hash cambiato), poi un UPDATE leggero per le righe invariate.
+    Se l'upsert fallisce (valore fuori range / troppo lungo su una riga) ripiega
+    sull'upsert riga per riga con savepoint, così i conteggi restano quelli
+    del vecchio import e solo le righe invalide vengono scartate.
+    """
+    upsert_all = _UPSERT_SQL.format(
+        distinct="distinct on (s.external_id)",
+        where="s.external_id is not null",
+        order="order by s.external_id, s.line_no desc",
+    )
+
+    try:
+        with conn.begin_nested():
+            inserted, updated = conn.execute(
+                text(f"""
+                    with upserted as ({upsert_all})
+                    select
+                        count(*) filter (where inserted),
+                        count(*) filter (where not inserted)
+                    from upserted
+                """),
+                {"import_id": import_id, "source": source},
+            ).one()
+    except DBAPIError as e:
+        logger.warning(f"[CSV IMPORT] set-based upsert failed, falling back to per-row: {e.orig}")
+        _upsert_rows_one_by_one(conn, import_id, source, stats)
+    else:
+        stats["rows_inserted"] += inserted
+        stats["rows_updated"] += updated
+
+    stats["rows_unchanged"] += conn.execute(
+        text(_TOUCH_UNCHANGED_SQL),
+        {"import_id": import_id},
+    ).rowcount
+
+
+def _upsert_rows_one_by_one(conn, import_id, source: str, stats: dict) -> None:
+    # solo l'ultima riga per external_id, come l'upsert set-based
+    # (le duplicate superate sono già in rows_duplicated)
+    line_nos = conn.execute(
+        text("""
+            select line_no
+            from (
+                select distinct on (external_id) line_no
+                from vehicle_stock_staging
+                where external_id is not null
+                order by external_id, line_no desc
+            ) last_rows
+            order by line_no
+        """)
+    ).scalars().all()
+
+    upsert_one = text(_UPSERT_SQL.format(distinct="", where="s.line_no = :line_no", order=""))
+
+    for line_no in line_nos:
+        try:
+            with conn.begin_nested():
+                result = conn.execute(
+                    upsert_one,
+                    {"import_id": import_id, "source": source, "line_no": line_no},
+                ).scalar()
+
+            # None = riga invariata (contata dal bump in _upsert_from_staging)
+            if result is True:
+                stats["rows_inserted"] += 1
+            elif result is False:
+                stats["rows_updated"] += 1
+
+        except DBAPIError:
+            stats["rows_skipped"] += 1
+            logger.exception(f"[CSV IMPORT] row skipped (line={line_no})")
+
+
+def _claim_import(busy_sources: set) -> dict | None:
+    """
+    Claim atomico (race-safe) del pending più vecchio di una sorgente
+    che non ha già un import in corso in questo run.
+    """
     with engine.begin() as conn:
-        # --------------------------------------------------
-        # 1️⃣ Claim atomico import pending (race-safe)
-        # --------------------------------------------------
-        import_row = conn.execute(
+        return conn.execute(
             text("""
                 update public.vehicle_stock_imports
-                set status = 'processing'
+                set status = 'processing',
+                    started_at = now()
                 where id = (
                     select id
                     from public.vehicle_stock_imports
                     where status = 'pending'
+                      and source <> all(cast(:busy_sources as text[]))
                     order by created_at
                     for update skip locked
                     limit 1
                 )
-                returning id, file_path
-            """)
+                returning id, file_path, source
+            """),
+            {"busy_sources": sorted(busy_sources)},
         ).mappings().first()
 
-        if not import_row:
-            logger.debug("[CSV IMPORT] no pending import found")
+
+def _run_import(import_row) -> None:
+    """
+    Un import:
+    - download + parse in streaming direttamente nel COPY verso una staging
+      temporanea, validazione in SQL
+    - un upsert set-based in vehicles_stock_sale delle sole righe cambiate
+      (row_hash), bump last_seen_at per le invariate
+    - disattiva le auto sparite dal CSV della stessa sorgente (anti-join con la staging)
+    - aggiorna vehicle_stock_imports (conteggi, durata, throughput)
+    """
+    import_id = import_row["id"]
+    file_path = import_row["file_path"]
+    source = import_row["source"]
+
+    logger.info(f"[CSV IMPORT] processing import {import_id} (source={source})")
+
+    stats = {
+        "rows_total": 0,
+        "rows_inserted": 0,
+        "rows_updated": 0,
+        "rows_skipped": 0,
+        "rows_duplicated": 0,
+        "rows_unchanged": 0,
+        "rows_deactivated": 0,
+    }
+    column_errors: dict = {}
+
+    t0 = time.monotonic()
+
+    with ExitStack() as stack:
+        # --------------------------------------------------
+        # 2️⃣ Apre il download in streaming (fuori dalla transazione)
+        # --------------------------------------------------
+        try:
+            csv_stream = stack.enter_context(
+                open_download_stream(
+                    bucket="vehicle-stock-imports",
+                    path=file_path,
+                )
+            )
+        except Exception as e:
+            _fail_import(import_id, f"CSV download failed: {e}")
             return
 
-        import_id = import_row["id"]
-        file_path = import_row["file_path"]
+        # --------------------------------------------------
+        # 3️⃣ Parse CSV in streaming
+        # --------------------------------------------------
+        # decoder UTF-8 incrementale (BOM-aware): le righe arrivano al COPY
+        # mentre il download è ancora in corso, memoria costante
+        try:
+            csv_file = io.TextIOWrapper(csv_stream, encoding="utf-8-sig", newline="")
+            reader = csv.DictReader(csv_file)
+        except Exception as e:
+            _fail_import(import_id, f"CSV parse failed: {e}")
+            return
 
-        logger.info(f"[CSV IMPORT] processing import {import_id}")
+        try:
+            with get_engine("bulk").begin() as conn:
+                conn.execute(text(f"set local statement_timeout = '{IMPORT_STATEMENT_TIMEOUT}'"))
 
-    # --------------------------------------------------
-    # 3️⃣ Scarica CSV (fuori dalla transazione)
-    # --------------------------------------------------
-    try:
-        csv_bytes = download_bytes(
-            bucket="vehicle-stock-imports",
-            path=file_path,
-        )
-    except Exception as e:
-        _fail_import(import_id, f"CSV download failed: {e}")
-        return
+                # Import della stessa sorgente in serie anche tra processi diversi
+                conn.execute(
+                    text("select pg_advisory_xact_lock(hashtext(:key))"),
+                    {"key": f"vehicle_stock_import:{source}"},
+                )
 
-    # --------------------------------------------------
-    # 4️⃣ Parse CSV
-    # --------------------------------------------------
-    rows_total = 0
-    rows_inserted = 0
-    rows_updated = 0
-    rows_skipped = 0
+                # --------------------------------------------------
+                # 4️⃣ COPY → staging, validazione, upsert set-based
+                # --------------------------------------------------
+                _create_staging(conn)
+                normalize_seconds = _copy_to_staging(conn, reader, stats, column_errors)
+                _index_staging(conn)
+                _validate_staging(conn, stats)
+                _upsert_from_staging(conn, import_id, source, stats)
+
+                # --------------------------------------------------
+                # 5️⃣ Finalizza import
+                # --------------------------------------------------
+                # Auto non più presenti nel CSV della stessa sorgente
+                _deactivate_missing(conn, source, stats)
+
+                elapsed = time.monotonic() - t0
+
+                # Finalizza import
+                conn.execute(
+                    text("""
+                        update public.vehicle_stock_imports
+                        set status = 'done',
+                            rows_total = :rows_total,
+                            rows_inserted = :rows_inserted,
+                            rows_updated = :rows_updated,
+                            rows_skipped = :rows_skipped,
+                            rows_duplicated = :rows_duplicated,
+                            rows_unchanged = :rows_unchanged,
+                            rows_deactivated = :rows_deactivated,
+                            duration_ms = :duration_ms,
+                            rows_per_second = :rows_per_second,
+                            column_errors = cast(:column_errors as jsonb),
+                            processed_at = now()
+                        where id = :id
+                    """),
+                    {
+                        "id": import_id,
+                        **stats,
+                        "duration_ms": int(elapsed * 1000),
+                        "rows_per_second": round(stats["rows_total"] / elapsed, 1) if elapsed > 0 else None,
+                        "column_errors": json.dumps(column_errors),
+                    },
+                )
+        except Exception as e:
+            _fail_import(import_id, f"Import processing failed: {e}")
+            logger.exception("[CSV IMPORT] fatal processing error")
+            return
 
-    try:
-        csv_file = io.StringIO(csv_bytes.decode("utf-8-sig"))
-        reader = csv.DictReader(csv_file)
-    except Exception as e:
-        _fail_import(import_id, f"CSV parse failed: {e}")
-        return
+    logger.info(
+        f"[CSV IMPORT] import {import_id} (source={source}) completed in {elapsed:.1f}s: "
+        f"total={stats['rows_total']}, inserted={stats['rows_inserted']}, "
+        f"updated={stats['rows_updated']}, unchanged={stats['rows_unchanged']}, "
+        f"skipped={stats['rows_skipped']}, duplicated={stats['rows_duplicated']}, deactivated={stats['rows_deactivated']}, "
+        f"normalize={normalize_seconds:.2f}s, column_errors={column_errors or '-'}"
+    )
 
-    try:
-        with engine.begin() as conn:
-            for row in reader:
-                rows_total += 1
 
-                if not any(row.values()):
-                    rows_skipped += 1
-                    continue
+def vehicle_stock_csv_import_job():
+    """
+    Job schedulato: svuota la coda vehicle_stock_imports.
+    - import di sorgenti diverse in parallelo (max IMPORT_WORKERS)
+    - import della stessa sorgente in serie, in ordine di created_at
+    """
 
-                try:
-                    external_id = (row.get("ID MyGarage") or "").strip()
-                    if not external_id:
-                        rows_skipped += 1
-                        continue
-
-                    with conn.begin_nested():
-                        result = conn.execute(
-                            text("""
-                            insert into public.vehicles_stock_sale (
-                                external_id,
-                                vid,
-                                targa,
-                                vin,
-                                source,
-                                raw_linea,
-                                raw_status,
-                                raw_stato,
-                                cod_versione_cm,
-                                brand,
-                                model,
-                                version,
-                                description,
-                                vehicle_category,
-                                kilometers,
-                                first_registration_date,
-                                fuel_type,
-                                body_type,
-                                color_ext,
-                                color_int,
-                                price_public,
-                                price_showroom,
-                                price_internal,
-                                location,
-                                arrival_date,
-                                expected_arrival_date,
-                                images_count,
-                                main_image_url,
-                                last_import_id,
-                                last_seen_at,
-                                is_active,
-                                dealer,
-                                order_number,
-                                stock_flag,
-                                vehicle_type_raw,
-                                price_reserved_1,
-                                price_reserved_2,
-                                confirmation_week
-
-                            )
-                            values (
-                                :external_id,
-                                :vid,
-                                :targa,
-                                :vin,
-                                'mygarage',
-                                :raw_linea,
-                                :raw_status,
-                                :raw_stato,
-                                :cod_versione_cm,
-                                :brand,
-                                :model,
-                                :version,
-                                :description,
-                                :vehicle_category,
-                                :kilometers,
-                                :first_registration_date,
-                                :fuel_type,
-                                :body_type,
-                                :color_ext,
-                                :color_int,
-                                :price_public,
-                                :price_showroom,
-                                :price_internal,
-                                :location,
-                                :arrival_date,
-                                :expected_arrival_date,
-                                :images_count,
-                                :main_image_url,
-                                :last_import_id,
-                                now(),
-                                true,
-                                :dealer,
-                                :order_number,
-                                :stock_flag,
-                                :vehicle_type_raw,
-                                :price_reserved_1,
-                                :price_reserved_2,
-                                :confirmation_week
-
-                            )
-                            on conflict (external_id) do update set
-                                vid = excluded.vid,
-                                targa = excluded.targa,
-                                vin = excluded.vin,
-                                raw_linea = excluded.raw_linea,
-                                raw_status = excluded.raw_status,
-                                raw_stato = excluded.raw_stato,
-                                cod_versione_cm = excluded.cod_versione_cm,
-                                brand = excluded.brand,
-                                model = excluded.model,
-                                version = excluded.version,
-                                description = excluded.description,
-                                vehicle_category = excluded.vehicle_category,
-                                kilometers = excluded.kilometers,
-                                first_registration_date = excluded.first_registration_date,
-                                fuel_type = excluded.fuel_type,
-                                body_type = excluded.body_type,
-                                color_ext = excluded.color_ext,
-                                color_int = excluded.color_int,
-                                price_public = excluded.price_public,
-                                price_showroom = excluded.price_showroom,
-                                price_internal = excluded.price_internal,
-                                location = excluded.location,
-                                arrival_date = excluded.arrival_date,
-                                expected_arrival_date = excluded.expected_arrival_date,
-                                images_count = excluded.images_count,
-                                main_image_url = excluded.main_image_url,
-                                last_import_id = excluded.last_import_id,
-                                last_seen_at = excluded.last_seen_at,
-                                dealer = excluded.dealer,
-                                order_number = excluded.order_number,
-                                stock_flag = excluded.stock_flag,
-                                vehicle_type_raw = excluded.vehicle_type_raw,
-                                price_reserved_1 = excluded.price_reserved_1,
-                                price_reserved_2 = excluded.price_reserved_2,
-                                confirmation_week = excluded.confirmation_week,
-
-                                is_active = true
-                            returning (xmax = 0) as inserted
-                            """),
-                            {
-                                "external_id": external_id,
-                                "vid": row.get("VID"),
-                                "targa": row.get("Targa"),
-                                "vin": row.get("Telaio"),
-                                "raw_linea": row.get("Linea"),
-                                "raw_status": row.get("Status"),
-                                "raw_stato": row.get("Stato"),
-                                "cod_versione_cm": normalize_cod_versione_cm(
-                                    row.get("Cod.Versione CM")
-                                ),
-                                "brand": row.get("Marca"),
-                                "model": row.get("Modello"),
-                                "version": row.get("Versione"),
-                                "description": row.get("Descrizione"),
-                                "vehicle_category": row.get("Veicolo comm."),
-                                "kilometers": _parse_int(row.get("Chilometri")),
-                                "first_registration_date": _parse_date(row.get("Immatricolazione")),
-                                "fuel_type": row.get("Alimentazione"),
-                                "body_type": row.get("Tipo carrozzeria"),
-                                "color_ext": row.get("Colore esterni"),
-                                "color_int": row.get("Interni"),
-                                "price_public": _parse_price(row.get("Prezzo Internet")),
-                                "price_showroom": _parse_price(row.get("Prezzo Showroom")),
-                                "price_internal": _parse_price(row.get("Prezzo veicolo")),
-                                "location": row.get("Ubicazione"),
-                                "arrival_date": _parse_date(row.get("Data di arrivo")),
-                                "expected_arrival_date": _parse_date(row.get("Data prev. di arrivo")),
-                                "images_count": _parse_int(row.get("Immagini")) or 0,
-                                "main_image_url": row.get("Immagine"),
-                                "last_import_id": import_id,
-                                "dealer": row.get("Dealer"),
-                                "order_number": row.get("Nr.Ordine"),
-                                "stock_flag": row.get("Stock"),
-                                "vehicle_type_raw": row.get("Tipo"),
-                                "price_reserved_1": _parse_price(row.get("Prezzo riservato 1")),
-                                "price_reserved_2": _parse_price(row.get("Prezzo riservato 2")),
-                                "confirmation_week": row.get("Sett.di conferma"),
-                            },
-                        ).scalar()
-
-                        if result:
-                            rows_inserted += 1
-                        else:
-                            rows_updated += 1
+    logger.info("[CSV IMPORT] job start")
 
+    # --------------------------------------------------
+    # 1️⃣ Claim + dispatch finché ci sono pending
+    # --------------------------------------------------
+    running: dict = {}      # Future → source
+    processed = 0
+
+    with ThreadPoolExecutor(
+        max_workers=IMPORT_WORKERS,
+        thread_name_prefix="stock-import",
+    ) as ex:
+        while True:
+            while len(running) < IMPORT_WORKERS:
+                import_row = _claim_import(set(running.values()))
+                if not import_row:
+                    break
+                running[ex.submit(propagate(_run_import), import_row)] = import_row["source"]
+                processed += 1
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                running.pop(future)
+                try:
+                    future.result()
                 except Exception:
-                    rows_skipped += 1
-                    logger.exception(
-                        f"[CSV IMPORT] row skipped (external_id={external_id})"
-                    )
-
-        # --------------------------------------------------
-        # 5️⃣ Finalizza import
-        # --------------------------------------------------
-        with engine.begin() as conn:
-
-            # DELETE auto non più presenti nel CSV della stessa sorgente
-            conn.execute(
-                text("""
-                    delete from public.vehicles_stock_sale
-                    where source = 'mygarage'
-                      and last_import_id is distinct from :import_id
-                """),
-                {"import_id": import_id},
-            )
+                    logger.exception("[CSV IMPORT] import worker crashed")
 
-            # Finalizza import
-            conn.execute(
-                text("""
-                    update public.vehicle_stock_imports
-                    set status = 'done',
-                        rows_total = :rows_total,
-                        rows_inserted = :rows_inserted,
-                        rows_updated = :rows_updated,
-                        rows_skipped = :rows_skipped,
-                        processed_at = now()
-                    where id = :id
-                """),
-                {
-                    "id": import_id,
-                    "rows_total": rows_total,
-                    "rows_inserted": rows_inserted,
-                    "rows_updated": rows_updated,
-                    "rows_skipped": rows_skipped,
-                },
-            )
-    except Exception as e:
-        _fail_import(import_id, f"Import processing failed: {e}")
-        logger.exception("[CSV IMPORT] fatal processing error")
-        return
-
-    logger.info(
-        f"[CSV IMPORT] import {import_id} completed: "
-        f"total={rows_total}, inserted={rows_inserted}, "
-        f"updated={rows_updated}, skipped={rows_skipped}"
-    )
+    if processed:
+        logger.info(f"[CSV IMPORT] job done: {processed} imports processed")
+    else:
+        logger.debug("[CSV IMPORT] no pending import found")
 
 
 # --------------------------------------------------
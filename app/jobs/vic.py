@@ -5,6 +5,7 @@ from sqlalchemy import text
 
 from app.database import DBSession
 from app.external.motornet import motornet_get
+from app.jobs.mnet_publish_details import refresh_publish_details
 
 # ============================================================
 # ENDPOINTS
@@ -42,7 +43,7 @@ def sync_vic_marche():
 
     inserted = 0
 
-    with DBSession() as db:
+    with DBSession("batch") as db:
         for m in marche:
             result = db.execute(
                 text("""
@@ -93,7 +94,7 @@ def sync_vic_modelli():
     logging.info("[VIC][MODELLI] START")
 
     # 1. Carico marche dal DB (fonte di verità)
-    with DBSession() as db:
+    with DBSession("batch") as db:
         result = db.execute(
             text("SELECT acronimo FROM mnet_vcom_marche ORDER BY acronimo")
         ).fetchall()
@@ -124,7 +125,7 @@ def sync_vic_modelli():
             if not modelli:
                 continue
 
-            with DBSession() as db:
+            with DBSession("batch") as db:
                 for m in modelli:
                     gamma = m.get("gammaModello") or {}
                     gruppo = m.get("gruppoStorico") or {}
@@ -222,7 +223,7 @@ def sync_vic_versioni():
     logging.info("[VIC][VERSIONI] START")
 
     # 1. Carico modelli dal DB (fonte di verità)
-    with DBSession() as db:
+    with DBSession("batch") as db:
         rows = db.execute(
             text("""
                 SELECT codice_modello, marca_acronimo
@@ -257,7 +258,7 @@ def sync_vic_versioni():
             if not versioni:
                 continue
 
-            with DBSession() as db:
+            with DBSession("batch") as db:
                 for v in versioni:
                     codice_uni = v.get("codiceMotornetUnivoco")
                     if not codice_uni:
@@ -317,7 +318,7 @@ def sync_vic_versioni():
                 codice_modello,
             )
             # errore isolato: continuiamo
-            with DBSession() as db:
+            with DBSession("batch") as db:
                 db.execute(
                     text("""
                         INSERT INTO mnet_vcom_sync_errors (
@@ -348,7 +349,7 @@ def sync_vic_dettagli():
     logging.info("[VIC][DETTAGLI] START")
 
     # 1) Seleziona SOLO versioni senza dettaglio (DB = filtro)
-    with DBSession() as db:
+    with DBSession("batch") as db:
         rows = db.execute(
             text("""
                 SELECT v.codice_motornet_uni
@@ -367,6 +368,7 @@ def sync_vic_dettagli():
         return
 
     inserted = 0
+    inserted_codici = []
     seen = len(codici)
 
     # 2) Loop SOLO sui mancanti
@@ -385,7 +387,7 @@ def sync_vic_dettagli():
                 raise RuntimeError("Empty dettaglio payload")
 
             # INSERT-ONLY (no update)
-            with DBSession() as db:
+            with DBSession("batch") as db:
                 res = db.execute(
                     text("""
                         INSERT INTO mnet_vcom_dettagli (
@@ -528,12 +530,13 @@ def sync_vic_dettagli():
 
                 if res.rowcount == 1:
                     inserted += 1
+                    inserted_codici.append(codice_uni)
                     logging.info("[VIC][DETTAGLI] inserted %s", codice_uni)
 
         except Exception as exc:
             logging.exception("[VIC][DETTAGLI] FAILED %s", codice_uni)
             # audit errore, ma NON blocchiamo
-            with DBSession() as db:
+            with DBSession("batch") as db:
                 db.execute(
                     text("""
                         INSERT INTO mnet_vcom_sync_errors (job_name, key, error)
@@ -543,6 +546,11 @@ def sync_vic_dettagli():
                 )
             continue
 
+    # Snapshot per i payload marketplace
+    if inserted_codici:
+        with DBSession("batch") as db:
+            refresh_publish_details(db, inserted_codici)
+
     logging.info(
         "[VIC][DETTAGLI] DONE (new=%d, total_missing_seen=%d)",
         inserted,
@@ -18,8 +18,9 @@ import asyncio
 import logging
 from sqlalchemy import text
 
-from app.database import DBSession
+from app.database import AsyncDBSession
 from app.external.motornet import motornet_get
+from app.jobs.mnet_publish_details import refresh_publish_details
 from app.jobs.wltp_enrichment import is_vcom, build_wltp_url
 
 BATCH_SIZE = 100
@@ -72,26 +73,28 @@ def _pick_wltp_record(records: list[dict]) -> dict | None:
     return best
 
 
-async def _fetch_wltp_for_codes(codici: list[str]) -> dict[str, list[dict] | Exception]:
-    """Chiama /dettaglio/wltp in parallelo con semaphore per limitare il fan-out."""
+async def _iter_wltp_for_codes(codici: list[str]):
+    """
+    Chiama /dettaglio/wltp in parallelo con semaphore per limitare il fan-out.
+    Produce (codice, records | Exception) man mano che le risposte arrivano.
+    """
     sem = asyncio.Semaphore(MAX_CONCURRENCY)
-    results: dict[str, list[dict] | Exception] = {}
 
-    async def _one(codice: str) -> None:
+    async def _one(codice: str):
         async with sem:
             try:
                 data = await motornet_get(build_wltp_url(codice))
-                results[codice] = data.get("wltp", []) or []
+                return codice, data.get("wltp", []) or []
             except Exception as e:
-                results[codice] = e
+                return codice, e
 
-    await asyncio.gather(*(_one(c) for c in codici))
-    return results
+    for next_done in asyncio.as_completed([_one(c) for c in codici]):
+        yield await next_done
 
 
-def _fetch_batch_codes(db) -> list[dict]:
+async def _fetch_batch_codes(db) -> list[dict]:
     """Seleziona codici da arricchire. mnet_dettagli_usato prima, poi mnet_vcom_dettagli."""
-    usato = db.execute(
+    usato = (await db.execute(
         text("""
             SELECT codice_motornet_uni AS codice, 'AUTO' AS tipo
             FROM mnet_dettagli_usato
@@ -102,18 +105,18 @@ def _fetch_batch_codes(db) -> list[dict]:
             FOR UPDATE SKIP LOCKED
         """),
         {"limit": BATCH_SIZE},
-    ).mappings().all()
+    )).mappings().all()
     return [dict(r) for r in usato]
 
 
-def _update_consumi(db, codice: str, tipo: str, cc: float | None, co2: float | None) -> bool:
+async def _update_consumi(db, codice: str, tipo: str, cc: float | None, co2: float | None) -> bool:
     """UPDATE solo dove i campi sono ancora NULL. Ritorna True se qualcosa è stato scritto."""
     if cc is None and co2 is None:
         return False
 
     table = "mnet_dettagli_usato" if tipo == "AUTO" else "mnet_vcom_dettagli"
 
-    res = db.execute(
+    res = await db.execute(
         text(f"""
             UPDATE {table}
             SET consumo_medio = COALESCE(consumo_medio, :cc),
@@ -128,25 +131,31 @@ def _update_consumi(db, codice: str, tipo: str, cc: float | None, co2: float | N
 
 def wltp_consumi_enrichment_worker() -> None:
     logger.info("[WLTP-CONSUMI] START")
+    asyncio.run(_enrich_batch())
+
 
-    with DBSession() as db:
-        rows = _fetch_batch_codes(db)
+async def _enrich_batch() -> None:
+    """
+    Lock dei codici (FOR UPDATE SKIP LOCKED), fetch WLTP e UPDATE nella stessa
+    AsyncDBSession: ogni risposta Motornet viene scritta appena arriva,
+    mentre le altre richieste sono ancora in volo.
+    """
+    async with AsyncDBSession() as db:
+        rows = await _fetch_batch_codes(db)
 
         if not rows:
             logger.info("[WLTP-CONSUMI] NOTHING TO DO")
             return
 
-        codici = [r["codice"] for r in rows]
-        fetched = asyncio.run(_fetch_wltp_for_codes(codici))
+        tipi = {r["codice"]: r["tipo"] for r in rows}
 
         updated = 0
+        updated_codici = []
         nd_count = 0
         err_count = 0
 
-        for row in rows:
-            codice = row["codice"]
-            tipo = row["tipo"]
-            result = fetched.get(codice)
+        async for codice, result in _iter_wltp_for_codes(list(tipi)):
+            tipo = tipi[codice]
 
             try:
                 if isinstance(result, Exception):
@@ -168,12 +177,13 @@ def wltp_consumi_enrichment_worker() -> None:
                 cc = _to_float(best.get("consumoCombinato"))
                 co2 = _to_float(best.get("co2Combinato"))
 
-                if _update_consumi(db, codice, tipo, cc, co2):
+                if await _update_consumi(db, codice, tipo, cc, co2):
                     logger.info(
                         "[WLTP-CONSUMI] %s → consumo=%s co2=%s",
                         codice, cc, co2,
                     )
                     updated += 1
+                    updated_codici.append(codice)
                 else:
                     nd_count += 1
 
@@ -181,7 +191,8 @@ def wltp_consumi_enrichment_worker() -> None:
                 logger.exception("[WLTP-CONSUMI] %s PROCESS FAIL", codice)
                 err_count += 1
 
-        db.commit()
+        # Snapshot per i payload marketplace (consumi / CO2 cambiati)
+        await db.run_sync(refresh_publish_details, updated_codici)
 
     logger.info(
         "[WLTP-CONSUMI] DONE updated=%d nd=%d err=%d total=%d",
@@ -141,7 +141,7 @@ async def fetch_all_wltp(rows: list[dict]) -> dict[str, list[dict] | Exception]:
 def wltp_enrichment_worker():
     logger.info("[WLTP] START")
 
-    with DBSession() as db:
+    with DBSession("batch") as db:
         rows = db.execute(
             text("""
                 SELECT
@@ -25,6 +25,7 @@ from app.jobs.usato import (
 
 from app.jobs.wltp_enrichment import wltp_enrichment_worker
 from app.jobs.wltp_consumi_enrichment import wltp_consumi_enrichment_worker
+from app.jobs.mnet_publish_details import refresh_publish_details_job
 from app.jobs.vehicle_stock_csv_import import vehicle_stock_csv_import_job
 from app.jobs.sync_google_reviews import google_reviews_sync_job
 from app.jobs.sync_autoscout_reviews import autoscout_reviews_sync_job
@@ -223,11 +224,30 @@ def schedule_vcom_jobs(scheduler):
 
 from app.jobs.autoscout_sync import autoscout_sync_job
 from app.jobs.asm_sync import asm_sync_job
+from app.jobs.marketplace_dispatcher import MarketplaceDispatcher, exclusive
+from app.settings import (
+    ENABLE_MARKETPLACE_DISPATCHER,
+    MARKETPLACE_FALLBACK_MINUTES,
+    DB_POOL_STATS_MINUTES,
+    STORAGE_CACHE_STATS_MINUTES,
+)
+from app.database import log_pool_stats
+from app.storage_cache import STORAGE_CACHE_DIR, log_storage_cache_stats
+from app.sql_stats import instrument_job, instrument_scheduler
+
+
+def _marketplace_trigger(default_minute: str):
+    # Con il dispatcher attivo il cron è solo un fallback di sicurezza
+    # (intervallo: "*/N" non è valido / è fuorviante per N >= 60)
+    if ENABLE_MARKETPLACE_DISPATCHER:
+        return IntervalTrigger(minutes=MARKETPLACE_FALLBACK_MINUTES)
+    return CronTrigger(minute=default_minute)
+
 
 def schedule_asm_jobs(scheduler):
     scheduler.add_job(
-        func=asm_sync_job,
-        trigger=CronTrigger(minute="*/2"),  # ogni 2 minuti
+        func=exclusive("asm_sync", asm_sync_job),
+        trigger=_marketplace_trigger("*/2"),  # ogni 2 minuti
         id="asm_sync",
         replace_existing=True,
         max_instances=1,
@@ -241,8 +261,8 @@ def schedule_autoscout_jobs(scheduler):
     # --------------------------------------------------
 
     scheduler.add_job(
-        func=autoscout_sync_job,
-        trigger=CronTrigger(minute="*/1"),  # ogni 1 minuto
+        func=exclusive("autoscout_sync", autoscout_sync_job),
+        trigger=_marketplace_trigger("*/1"),  # ogni 1 minuto
         id="autoscout_sync",
         replace_existing=True,
         max_instances=1,
@@ -251,6 +271,33 @@ def schedule_autoscout_jobs(scheduler):
 
     logging.info("[SCHEDULER] AUTOSCOUT SYNC job registered")
 
+
+def build_marketplace_dispatcher():
+    """
+    Dispatcher LISTEN/NOTIFY per AS24 / ASM (None se disabilitato).
+    Avviato da main.py accanto allo scheduler.
+    """
+    if not ENABLE_MARKETPLACE_DISPATCHER:
+        return None
+
+    logging.info(
+        "[SCHEDULER] MARKETPLACE DISPATCHER enabled (fallback cron ogni %s min)",
+        MARKETPLACE_FALLBACK_MINUTES,
+    )
+
+    return MarketplaceDispatcher({
+        "autoscout_listings_queue": (
+            "autoscout_sync",
+            instrument_job("autoscout_sync", autoscout_sync_job),
+            "autoscout_listings",
+        ),
+        "asm_listings_queue": (
+            "asm_sync",
+            instrument_job("asm_sync", asm_sync_job),
+            "asm_listings",
+        ),
+    })
+
 def schedule_wltp_jobs(scheduler):
     # --------------------------------------------------
     # WLTP — ARRICCHIMENTO NORMATIVA EURO (AUTO + VCOM)
@@ -281,6 +328,19 @@ def schedule_wltp_jobs(scheduler):
 
     logging.info("[SCHEDULER] WLTP consumi/CO2 enrichment job registered")
 
+    # --------------------------------------------------
+    # MNET PUBLISH DETAILS — REFRESH COMPLETO DI SICUREZZA
+    # (il refresh incrementale gira dentro i job dettagli / WLTP)
+    # --------------------------------------------------
+    scheduler.add_job(
+        func=refresh_publish_details_job,
+        trigger=CronTrigger(hour=2, minute=30),
+        id="mnet_publish_details_refresh",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+
 
     # --------------------------------------------------
     # VEHICLE STOCK — CSV IMPORT (FULL SYNC)
@@ -453,6 +513,33 @@ def build_scheduler():
     )
     logging.info("[SCHEDULER] DMAX SUSPENSION WORKER job registered (daily 05:30)")
 
+    # DB POOL: attesa al checkout / tempo di possesso per profilo
+    # (oltp / batch / bulk, vedi app/database.py). Saturazione → WARNING.
+    scheduler.add_job(
+        func=log_pool_stats,
+        trigger=IntervalTrigger(minutes=DB_POOL_STATS_MINUTES),
+        id="db_pool_stats",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+    logging.info("[SCHEDULER] DB POOL STATS job registered (every %s min)", DB_POOL_STATS_MINUTES)
+
+    # STORAGE CACHE: hit rate della cache download (solo se STORAGE_CACHE_DIR è impostata)
+    if STORAGE_CACHE_DIR:
+        scheduler.add_job(
+            func=log_storage_cache_stats,
+            trigger=IntervalTrigger(minutes=STORAGE_CACHE_STATS_MINUTES),
+            id="storage_cache_stats",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+        logging.info("[SCHEDULER] STORAGE CACHE STATS job registered (every %s min)", STORAGE_CACHE_STATS_MINUTES)
+
+    # SQL STATS: statement attribuiti al job id, top N a fine run (app/sql_stats.py)
+    instrument_scheduler(scheduler)
+
     return scheduler
 
 
@@ -7,3 +7,15 @@ SCHEDULER_TIMEZONE = os.getenv("SCHEDULER_TIMEZONE", "Europe/Rome")
 ENABLE_NUOVO_SYNC = os.getenv("ENABLE_NUOVO_SYNC", "true").lower() == "true"
 ENABLE_USATO_SYNC = os.getenv("ENABLE_USATO_SYNC", "true").lower() == "true"
 ENABLE_VIC_SYNC   = os.getenv("ENABLE_VIC_SYNC", "true").lower() == "true"
+
+# Marketplace (AS24 / ASM): wake-up via LISTEN/NOTIFY, cron solo come fallback
+ENABLE_MARKETPLACE_DISPATCHER = os.getenv("ENABLE_MARKETPLACE_DISPATCHER", "false").lower() == "true"
+MARKETPLACE_FALLBACK_MINUTES = int(os.getenv("MARKETPLACE_FALLBACK_MINUTES", "10"))
+if MARKETPLACE_FALLBACK_MINUTES < 1:
+    raise ValueError("MARKETPLACE_FALLBACK_MINUTES deve essere >= 1")
+
+# Telemetria pool DB (app/database.py): intervallo del log per profilo
+DB_POOL_STATS_MINUTES = int(os.getenv("DB_POOL_STATS_MINUTES", "5"))
+
+# Cache download Supabase Storage (app/storage_cache.py): intervallo del log hit rate
+STORAGE_CACHE_STATS_MINUTES = int(os.getenv("STORAGE_CACHE_STATS_MINUTES", "30"))
@@ -0,0 +1,245 @@
+"""SQL — statistiche per statement attribuite al job schedulato in esecuzione.
+
+Hook SQLAlchemy (before/after_cursor_execute, a livello di classe Engine:
+coprono tutti i pool) che, durante un run di job strumentato, accumulano
+per statement normalizzato: chiamate, tempo totale / massimo, righe.
+A fine run: log dei top N per tempo totale, con evidenza degli statement
+ripetuti molte volte (tipico N+1); opzionale salvataggio su sql_job_stats
+(sql/009_sql_job_stats.sql).
+
+Attribuzione via contextvar: i thread aperti dal job la ereditano solo se
+il callable è passato da propagate() (ThreadPoolExecutor non copia il contesto).
+Le connessioni psycopg dirette (fuori da SQLAlchemy) non sono misurate.
+"""
+
+import contextvars
+import functools
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+SQL_STATS_ENABLED = os.getenv("SQL_STATS_ENABLED", "true").lower() == "true"
+SQL_STATS_TOP_N = int(os.getenv("SQL_STATS_TOP_N", "10"))
+SQL_STATS_N_PLUS_ONE_CALLS = int(os.getenv("SQL_STATS_N_PLUS_ONE_CALLS", "50"))
+SQL_STATS_PERSIST = os.getenv("SQL_STATS_PERSIST", "false").lower() == "true"
+SQL_STATS_MIN_SQL_SECONDS = float(os.getenv("SQL_STATS_MIN_SQL_SECONDS", "0"))
+
+_current: contextvars.ContextVar = contextvars.ContextVar("sql_job_stats", default=None)
+
+
+# ============================================================
+# NORMALIZZAZIONE STATEMENT
+# ============================================================
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM = r"(?:%\(\w+\)s|%s|\?)"
+_PARAM_LIST_RE = re.compile(rf"\(\s*{_PARAM}(?:\s*,\s*{_PARAM})+\s*\)")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def normalize_statement(statement: str) -> str:
+    """Letterali → ?, liste IN espanse → (...), spazi compattati."""
+    s = _STRING_RE.sub("?", statement)
+    s = _NUMBER_RE.sub("?", s)
+    s = _PARAM_LIST_RE.sub("(...)", s)
+    return _WHITESPACE_RE.sub(" ", s).strip()
+
+
+# ============================================================
+# COLLECTOR PER RUN
+# ============================================================
+
+class _StatementStats:
+    __slots__ = ("calls", "total", "max", "rows")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+
+class JobSqlStats:
+    """Statistiche SQL di un singolo run di job (thread-safe)."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.started_at = datetime.now(timezone.utc)
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self.statements: dict[str, _StatementStats] = {}
+
+    def record(self, statement: str, seconds: float, rows: int) -> None:
+        key = normalize_statement(statement)
+        with self._lock:
+            s = self.statements.get(key)
+            if s is None:
+                s = self.statements[key] = _StatementStats()
+            s.calls += 1
+            s.total += seconds
+            s.max = max(s.max, seconds)
+            s.rows += rows
+
+    def top(self, n: int = SQL_STATS_TOP_N) -> list[tuple[str, _StatementStats]]:
+        with self._lock:
+            items = list(self.statements.items())
+        return sorted(items, key=lambda kv: kv[1].total, reverse=True)[:n]
+
+    def finish(self) -> None:
+        run_seconds = time.perf_counter() - self._t0
+        with self._lock:
+            calls = sum(s.calls for s in self.statements.values())
+            sql_seconds = sum(s.total for s in self.statements.values())
+
+        if not calls or sql_seconds < SQL_STATS_MIN_SQL_SECONDS:
+            return
+
+        top = self.top()
+        self._log(top, run_seconds, calls, sql_seconds)
+        if SQL_STATS_PERSIST:
+            self._persist(top, run_seconds)
+
+    def _log(self, top, run_seconds: float, calls: int, sql_seconds: float) -> None:
+        logger.info(
+            "[SQL STATS] %s | run %.1fs, SQL %.2fs (%.0f%%) | %d statement, %d distinti",
+            self.job_id,
+            run_seconds,
+            sql_seconds,
+            100 * sql_seconds / run_seconds if run_seconds else 0,
+            calls,
+            len(self.statements),
+        )
+        for i, (statement, s) in enumerate(top, 1):
+            logger.info(
+                "[SQL STATS] %s #%d %d× tot %.3fs max %.1fms righe %d%s | %s",
+                self.job_id,
+                i,
+                s.calls,
+                s.total,
+                s.max * 1000,
+                s.rows,
+                " ⚠️ N+1?" if s.calls >= SQL_STATS_N_PLUS_ONE_CALLS else "",
+                statement[:240],
+            )
+
+    def _persist(self, top, run_seconds: float) -> None:
+        from app.database import engine
+
+        rows = [
+            {
+                "job_id": self.job_id,
+                "run_started_at": self.started_at,
+                "run_seconds": run_seconds,
+                "statement_hash": hashlib.sha1(statement.encode("utf-8")).hexdigest(),
+                "statement": statement,
+                "calls": s.calls,
+                "total_ms": s.total * 1000,
+                "max_ms": s.max * 1000,
+                "rows": s.rows,
+            }
+            for statement, s in top
+        ]
+
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    text("""
+                        insert into public.sql_job_stats (
+                            job_id, run_started_at, run_seconds, statement_hash,
+                            statement, calls, total_ms, max_ms, rows
+                        )
+                        values (
+                            :job_id, :run_started_at, :run_seconds, :statement_hash,
+                            :statement, :calls, :total_ms, :max_ms, :rows
+                        )
+                    """),
+                    rows,
+                )
+        except Exception:
+            logger.exception("[SQL STATS] Salvataggio su sql_job_stats fallito | job=%s", self.job_id)
+
+
+# ============================================================
+# HOOK SQLALCHEMY
+# ============================================================
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current.get() is not None:
+        context._sql_stats_t0 = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = getattr(context, "_sql_stats_t0", None)
+    if stats is None or started is None:
+        return
+    rowcount = getattr(cursor, "rowcount", -1)
+    stats.record(statement, time.perf_counter() - started, rowcount if rowcount and rowcount > 0 else 0)
+
+
+# ============================================================
+# STRUMENTAZIONE JOB
+# ============================================================
+
+def instrument_job(job_id: str, func):
+    """Wrapper: raccoglie le statistiche SQL del run e le emette a fine job."""
+    if not SQL_STATS_ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def _run(*args, **kwargs):
+        if _current.get() is not None:
+            # già dentro un job strumentato (es. dispatcher → run cron)
+            return func(*args, **kwargs)
+
+        stats = JobSqlStats(job_id)
+        token = _current.set(stats)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current.reset(token)
+            try:
+                stats.finish()
+            except Exception:
+                logger.exception("[SQL STATS] Riepilogo fallito | job=%s", job_id)
+
+    return _run
+
+
+def instrument_scheduler(scheduler) -> None:
+    """Avvolge con instrument_job tutti i job già registrati (id APScheduler = job_id)."""
+    if not SQL_STATS_ENABLED:
+        return
+    for job in scheduler.get_jobs():
+        job.modify(func=instrument_job(job.id, job.func))
+
+
+def propagate(fn):
+    """fn da eseguire in un altro thread mantenendo l'attribuzione al job corrente."""
+    stats = _current.get()
+    if stats is None:
+        return fn
+
+    @functools.wraps(fn)
+    def _run(*args, **kwargs):
+        token = _current.set(stats)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return _run
@@ -1,6 +1,38 @@
-﻿import os
+﻿"""Supabase Storage — client REST con pool di connessioni condiviso.
+
+StorageClient (sync, thread-safe) riusa un solo pool HTTP/2 keep-alive
+invece di un httpx.Client per chiamata:
+- retry con backoff su 5xx / 429 / timeout / errori di trasporto
+- upload_stream: upload in streaming da file / file-like / iteratori di
+  chunk, con callback di progresso
+- upload_resumable: protocollo TUS di Supabase a chunk da 6 MB; dopo un
+  errore di rete riprende dall'offset confermato dal server
+- download con cache read-through su disco opzionale (app/storage_cache,
+  attiva con STORAGE_CACHE_DIR): ETag + GET condizionale, mmap, LRU
+
+Le funzioni di modulo (upload_bytes_and_get_public_url, upload_file_and_get_public_url,
+upload_stream_and_get_public_url, download_bytes, open_download_stream,
+open_download_buffer) restano l'API per i job e usano il client condiviso.
+"""
+
+import base64
+import io
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+from urllib.parse import urljoin
+
 import httpx
 
+from app.storage_cache import StorageCache, get_storage_cache
+
+logger = logging.getLogger(__name__)
+
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
@@ -10,6 +42,478 @@ if not SUPABASE_URL:
 if not SUPABASE_KEY:
     raise RuntimeError("SUPABASE_KEY mancante")
 
+STORAGE_TIMEOUT = float(os.getenv("STORAGE_TIMEOUT", "60"))
+STORAGE_HTTP2 = os.getenv("STORAGE_HTTP2", "true").lower() == "true"
+STORAGE_MAX_CONNECTIONS = int(os.getenv("STORAGE_MAX_CONNECTIONS", "20"))
+STORAGE_MAX_RETRIES = int(os.getenv("STORAGE_MAX_RETRIES", "3"))
+STORAGE_BACKOFF_SECONDS = float(os.getenv("STORAGE_BACKOFF_SECONDS", "0.5"))
+
+# Upload in streaming / resumable
+STREAM_CHUNK_SIZE = 1024 * 1024
+RESUMABLE_CHUNK_SIZE = 6 * 1024 * 1024     # richiesto da Supabase per TUS
+RESUMABLE_THRESHOLD = int(os.getenv("STORAGE_RESUMABLE_THRESHOLD", str(RESUMABLE_CHUNK_SIZE)))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (httpx.TimeoutException, httpx.TransportError)
+
+
+# progress(byte inviati, totale | None)
+ProgressCallback = Callable[[int, int | None], None]
+
+
+@contextmanager
+def _open_source(source):
+    """Path → file aperto in lettura binaria; file-like passato così com'è."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield f
+    else:
+        yield source
+
+
+def _source_size(f) -> int | None:
+    try:
+        return os.fstat(f.fileno()).st_size - f.tell()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        pass
+    try:
+        pos = f.tell()
+        end = f.seek(0, os.SEEK_END)
+        f.seek(pos)
+        return end - pos
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+def _is_seekable(f) -> bool:
+    try:
+        return f.seekable()
+    except (AttributeError, ValueError):
+        return False
+
+
+def _iter_file(f, chunk_size: int, total, progress: ProgressCallback | None):
+    """Legge il file-like a chunk: in memoria c'è un solo buffer alla volta."""
+    sent = 0
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        sent += len(chunk)
+        yield chunk
+        if progress:
+            progress(sent, total)
+
+
+def _iter_chunks(chunks, total, progress: ProgressCallback | None):
+    sent = 0
+    for chunk in chunks:
+        sent += len(chunk)
+        yield chunk
+        if progress:
+            progress(sent, total)
+
+
+def _backoff(attempt: int) -> float:
+    # base * 2^attempt, jitter 50–100%
+    return STORAGE_BACKOFF_SECONDS * (2 ** attempt) * (0.5 + random.random() * 0.5)
+
+
+class _StorageBase:
+    def __init__(
+        self,
+        url: str = SUPABASE_URL,
+        key: str = SUPABASE_KEY,
+        max_retries: int = STORAGE_MAX_RETRIES,
+    ):
+        self.url = url.rstrip("/")
+        self.max_retries = max_retries
+        self._headers = {"Authorization": f"Bearer {key}"}
+
+    def _client_options(self) -> dict:
+        return {
+            "headers": self._headers,
+            "timeout": STORAGE_TIMEOUT,
+            "http2": STORAGE_HTTP2,
+            "limits": httpx.Limits(
+                max_connections=STORAGE_MAX_CONNECTIONS,
+                max_keepalive_connections=STORAGE_MAX_CONNECTIONS,
+            ),
+        }
+
+    def object_url(self, bucket: str, path: str) -> str:
+        return f"{self.url}/storage/v1/object/{bucket}/{path}"
+
+    def public_url(self, bucket: str, path: str) -> str:
+        return f"{self.url}/storage/v1/object/public/{bucket}/{path}"
+
+    @staticmethod
+    def _upload_headers(content_type: str) -> dict:
+        return {
+            "Content-Type": content_type,
+            "x-upsert": "true",
+        }
+
+    def _stream_headers(self, content_type: str, size: int | None) -> dict:
+        headers = self._upload_headers(content_type)
+        if size is not None:
+            headers["Content-Length"] = str(size)
+        return headers
+
+    def _tus_create_headers(self, bucket: str, path: str, size: int, content_type: str) -> dict:
+        def b64(value: str) -> str:
+            return base64.b64encode(value.encode("utf-8")).decode("ascii")
+
+        return {
+            "Tus-Resumable": "1.0.0",
+            "Upload-Length": str(size),
+            "Upload-Metadata": ",".join([
+                f"bucketName {b64(bucket)}",
+                f"objectName {b64(path)}",
+                f"contentType {b64(content_type)}",
+            ]),
+            "x-upsert": "true",
+        }
+
+    @property
+    def resumable_url(self) -> str:
+        return f"{self.url}/storage/v1/upload/resumable"
+
+    def _should_retry(self, attempt: int, response=None, exc=None) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if exc is not None:
+            return isinstance(exc, RETRY_EXCEPTIONS)
+        return response.status_code in RETRY_STATUS
+
+    @staticmethod
+    def _log_retry(method: str, url: str, attempt: int, reason) -> None:
+        logger.warning("[STORAGE] Retry %s %s (tentativo %d) | %s", method, url, attempt + 1, reason)
+
+
+# ============================================================
+# CLIENT SYNC (THREAD-SAFE)
+# ============================================================
+
+class StorageClient(_StorageBase):
+    """Client sync con pool condiviso. Sicuro da usare da più thread."""
+
+    def __init__(self, cache: StorageCache | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self._client = httpx.Client(**self._client_options())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self._client.close()
+
+    def _request(self, method: str, url: str, content_factory=None, **kwargs) -> httpx.Response:
+        """content_factory: body ricreato a ogni tentativo (stream riavvolto); None = niente retry."""
+        attempt = 0
+        while True:
+            if content_factory is not None:
+                kwargs["content"] = content_factory()
+            try:
+                r = self._client.request(method, url, **kwargs)
+            except RETRY_EXCEPTIONS as exc:
+                if not self._should_retry(attempt, exc=exc):
+                    raise
+                self._log_retry(method, url, attempt, exc)
+            else:
+                if not self._should_retry(attempt, response=r):
+                    if r.status_code != 304:    # GET condizionale della cache
+                        r.raise_for_status()
+                    return r
+                self._log_retry(method, url, attempt, f"HTTP {r.status_code}")
+                r.close()   # risposta scartata: libera lo stream HTTP/2 nel pool
+
+            time.sleep(_backoff(attempt))
+            attempt += 1
+
+    def upload(
+        self,
+        bucket: str,
+        path: str,
+        content: bytes,
+        content_type: str = "image/png",
+    ) -> str:
+        """Upload (upsert) e URL pubblico HTTPS."""
+        self._request(
+            "PUT",
+            self.object_url(bucket, path),
+            headers=self._upload_headers(content_type),
+            content=content,
+        )
+        return self.public_url(bucket, path)
+
+    def upload_stream(
+        self,
+        bucket: str,
+        path: str,
+        source,
+        content_type: str = "application/octet-stream",
+        size: int | None = None,
+        progress: ProgressCallback | None = None,
+    ) -> str:
+        """
+        Upload in streaming (PUT a chunk) da path, file-like binario o
+        iterabile di bytes. Retry solo se la sorgente si può riavvolgere.
+        """
+        if not isinstance(source, (str, os.PathLike)) and not hasattr(source, "read"):
+            # iterabile di chunk: un solo passaggio, niente retry
+            self._client.request(
+                "PUT",
+                self.object_url(bucket, path),
+                headers=self._stream_headers(content_type, size),
+                content=_iter_chunks(source, size, progress),
+            ).raise_for_status()
+            return self.public_url(bucket, path)
+
+        with _open_source(source) as f:
+            total = size if size is not None else _source_size(f)
+
+            if _is_seekable(f):
+                start = f.tell()
+
+                def body():
+                    f.seek(start)
+                    return _iter_file(f, STREAM_CHUNK_SIZE, total, progress)
+
+                self._request(
+                    "PUT",
+                    self.object_url(bucket, path),
+                    content_factory=body,
+                    headers=self._stream_headers(content_type, total),
+                )
+            else:
+                self._client.request(
+                    "PUT",
+                    self.object_url(bucket, path),
+                    headers=self._stream_headers(content_type, total),
+                    content=_iter_file(f, STREAM_CHUNK_SIZE, total, progress),
+                ).raise_for_status()
+
+        return self.public_url(bucket, path)
+
+    def upload_resumable(
+        self,
+        bucket: str,
+        path: str,
+        source,
+        content_type: str = "application/octet-stream",
+        progress: ProgressCallback | None = None,
+        chunk_size: int = RESUMABLE_CHUNK_SIZE,
+    ) -> str:
+        """
+        Upload resumable (TUS) da path o file-like riavvolgibile.
+        Un chunk alla volta in memoria; dopo un errore chiede al server
+        l'offset confermato (HEAD) e riparte da lì invece che da zero.
+        """
+        with _open_source(source) as f:
+            size = _source_size(f)
+            if size is None or not _is_seekable(f):
+                raise ValueError("upload_resumable richiede un file riavvolgibile di dimensione nota")
+
+            start = f.tell()
+            location = self._request(
+                "POST",
+                self.resumable_url,
+                headers=self._tus_create_headers(bucket, path, size, content_type),
+            ).headers["Location"]
+            location = urljoin(self.resumable_url, location)
+
+            offset = 0
+            failures = 0
+            while offset < size:
+                f.seek(start + offset)
+                chunk = f.read(chunk_size)
+
+                try:
+                    r = self._client.patch(
+                        location,
+                        headers={
+                            "Tus-Resumable": "1.0.0",
+                            "Upload-Offset": str(offset),
+                            "Content-Type": "application/offset+octet-stream",
+                        },
+                        content=chunk,
+                    )
+                except RETRY_EXCEPTIONS as exc:
+                    reason = exc
+                else:
+                    if r.status_code in (200, 204):
+                        offset = int(r.headers.get("Upload-Offset", offset + len(chunk)))
+                        failures = 0
+                        if progress:
+                            progress(offset, size)
+                        continue
+                    # 409 = offset non allineato → si riallinea con HEAD
+                    if r.status_code not in RETRY_STATUS and r.status_code != 409:
+                        r.raise_for_status()
+                    reason = f"HTTP {r.status_code}"
+                    r.close()
+
+                if failures >= self.max_retries:
+                    raise RuntimeError(f"Upload resumable interrotto a {offset}/{size} byte: {reason}")
+                self._log_retry("PATCH", location, failures, reason)
+                time.sleep(_backoff(failures))
+                failures += 1
+                offset = self._tus_offset(location, fallback=offset)
+
+        return self.public_url(bucket, path)
+
+    def _tus_offset(self, location: str, fallback: int) -> int:
+        try:
+            r = self._client.head(location, headers={"Tus-Resumable": "1.0.0"})
+            r.raise_for_status()
+            return int(r.headers["Upload-Offset"])
+        except (httpx.HTTPError, KeyError, ValueError):
+            return fallback
+
+    def upload_file(
+        self,
+        bucket: str,
+        path: str,
+        file_path,
+        content_type: str = "application/octet-stream",
+        progress: ProgressCallback | None = None,
+    ) -> str:
+        """File su disco: resumable oltre STORAGE_RESUMABLE_THRESHOLD, altrimenti streaming."""
+        if Path(file_path).stat().st_size >= RESUMABLE_THRESHOLD:
+            return self.upload_resumable(bucket, path, file_path, content_type, progress)
+        return self.upload_stream(bucket, path, file_path, content_type, progress=progress)
+
+    def _cached_entry(self, bucket: str, path: str):
+        """
+        (entry, valida): valida=True se servibile da disco senza rete (entro TTL).
+        Con valida=False l'entry (se c'è) va rivalidata con GET condizionale.
+        """
+        entry = self.cache.lookup(bucket, path)
+        return entry, entry is not None and self.cache.is_fresh(entry)
+
+    def download(self, bucket: str, path: str) -> bytes:
+        if self.cache is None:
+            return self._request("GET", self.object_url(bucket, path)).content
+
+        entry, fresh = self._cached_entry(bucket, path)
+        if fresh:
+            content = self.cache.read_bytes(entry)
+            if content is not None:
+                self.cache.record_hit(entry)
+                return content
+            entry = None
+
+        r = self._request("GET", self.object_url(bucket, path), headers=self.cache.conditional_headers(entry))
+        if r.status_code == 304:
+            content = self.cache.read_bytes(entry)
+            if content is not None:
+                self.cache.record_hit(entry, revalidated=True)
+                return content
+            r = self._request("GET", self.object_url(bucket, path))
+
+        self.cache.record_miss(len(r.content))
+        self.cache.store(bucket, path, r.headers.get("etag"), r.content)
+        return r.content
+
+    @contextmanager
+    def open_stream(self, bucket: str, path: str, chunk_size: int = 64 * 1024):
+        """
+        Download in streaming: file-like binario letto a chunk mentre il
+        download è in corso, memoria costante qualunque sia la dimensione.
+        Con la cache attiva i byte vengono scritti anche su disco (tee) e le
+        letture successive dello stesso oggetto non ri-scaricano il contenuto.
+        """
+        entry = None
+        if self.cache is not None:
+            entry, fresh = self._cached_entry(bucket, path)
+            f = self.cache.open(entry) if fresh else None
+            if f is not None:
+                self.cache.record_hit(entry)
+                with f:
+                    yield f
+                return
+
+        headers = self.cache.conditional_headers(entry) if self.cache is not None else {}
+        with self._client.stream("GET", self.object_url(bucket, path), headers=headers) as r:
+            if r.status_code == 304 and entry is not None:
+                f = self.cache.open(entry)
+                if f is None:
+                    # file sparito da disco: entry scartata, GET completo
+                    r.close()
+                    with self.open_stream(bucket, path, chunk_size) as stream:
+                        yield stream
+                    return
+                self.cache.record_hit(entry, revalidated=True)
+                with f:
+                    yield f
+                return
+
+            r.raise_for_status()
+            chunks = r.iter_bytes(chunk_size)
+            if self.cache is not None:
+                chunks = self.cache.tee(bucket, path, r.headers.get("etag"), chunks)
+            try:
+                yield io.BufferedReader(_ChunkReader(chunks), buffer_size=chunk_size)
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
+
+    @contextmanager
+    def open_buffer(self, bucket: str, path: str):
+        """
+        Contenuto dell'oggetto come buffer read-only (len / slicing / write su file).
+        Con la cache attiva e file grandi è un mmap sul file in cache;
+        altrimenti bytes.
+        """
+        entry = self._ensure_cached(bucket, path) if self.cache is not None else None
+        if entry is not None:
+            with self.cache.buffer(entry) as buf:
+                if buf is not None:
+                    yield buf
+                    return
+
+        yield self.download(bucket, path)
+
+    def _ensure_cached(self, bucket: str, path: str):
+        """Porta l'oggetto in cache (streaming su disco) e ritorna l'entry, None se non cachabile."""
+        entry, fresh = self._cached_entry(bucket, path)
+        if fresh:
+            self.cache.record_hit(entry)
+            return entry
+
+        headers = self.cache.conditional_headers(entry)
+        with self._client.stream("GET", self.object_url(bucket, path), headers=headers) as r:
+            if r.status_code == 304 and entry is not None:
+                self.cache.record_hit(entry, revalidated=True)
+                return entry
+            r.raise_for_status()
+            for _ in self.cache.tee(bucket, path, r.headers.get("etag"), r.iter_bytes(STREAM_CHUNK_SIZE)):
+                pass
+        return self.cache.lookup(bucket, path)
+
+
+# ============================================================
+# CLIENT CONDIVISO + API DI MODULO
+# ============================================================
+
+_client: StorageClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_storage_client() -> StorageClient:
+    """StorageClient di processo (creato alla prima chiamata)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = StorageClient(cache=get_storage_cache())
+    return _client
+
 
 def upload_bytes_and_get_public_url(
     bucket: str,
@@ -21,23 +525,31 @@ def upload_bytes_and_get_public_url(
     Upload diretto su Supabase Storage via REST API.
     Ritorna URL pubblico HTTPS.
     """
-    upload_url = f"{SUPABASE_URL}/storage/v1/object/{bucket}/{path}"
+    return get_storage_client().upload(bucket, path, content, content_type)
 
-    headers = {
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": content_type,
-        "x-upsert": "true",
-    }
 
-    with httpx.Client(timeout=60) as client:
-        r = client.put(
-            upload_url,
-            headers=headers,
-            content=content,
-        )
-        r.raise_for_status()
+def upload_stream_and_get_public_url(
+    bucket: str,
+    path: str,
+    source,
+    content_type: str = "application/octet-stream",
+    size: int | None = None,
+    progress: ProgressCallback | None = None,
+) -> str:
+    """Upload in streaming da path / file-like / iterabile di bytes. Ritorna URL pubblico."""
+    return get_storage_client().upload_stream(bucket, path, source, content_type, size, progress)
+
+
+def upload_file_and_get_public_url(
+    bucket: str,
+    path: str,
+    file_path,
+    content_type: str = "application/octet-stream",
+    progress: ProgressCallback | None = None,
+) -> str:
+    """Upload di un file su disco (resumable se grande). Ritorna URL pubblico."""
+    return get_storage_client().upload_file(bucket, path, file_path, content_type, progress)
 
-    return f"{SUPABASE_URL}/storage/v1/object/public/{bucket}/{path}"
 
 def download_bytes(
     bucket: str,
@@ -47,13 +559,60 @@ def download_bytes(
     Download diretto da Supabase Storage via REST API.
     Ritorna i bytes del file.
     """
-    download_url = f"{SUPABASE_URL}/storage/v1/object/{bucket}/{path}"
+    return get_storage_client().download(bucket, path)
 
-    headers = {
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-    }
 
-    with httpx.Client(timeout=60) as client:
-        r = client.get(download_url, headers=headers)
-        r.raise_for_status()
-        return r.content
+class _ChunkReader(io.RawIOBase):
+    """File-like binario sopra un iteratore di chunk (niente copia dell'intero file)."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            self._pending = next(self._chunks, b"")
+            if not self._pending:
+                return 0  # EOF
+
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+@contextmanager
+def open_download_buffer(
+    bucket: str,
+    path: str,
+):
+    """
+    Download come buffer read-only: mmap sul file in cache se grande
+    (cache attiva), altrimenti bytes.
+    """
+    with get_storage_client().open_buffer(bucket, path) as buf:
+        yield buf
+
+
+def storage_cache_stats() -> dict | None:
+    """Hit rate e contatori della cache download (None se disattivata)."""
+    cache = get_storage_client().cache
+    return cache.stats() if cache is not None else None
+
+
+@contextmanager
+def open_download_stream(
+    bucket: str,
+    path: str,
+    chunk_size: int = 64 * 1024,
+):
+    """
+    Download in streaming da Supabase Storage.
+    Ritorna un file-like binario letto a chunk mentre il download è in corso:
+    memoria costante qualunque sia la dimensione del file.
+    """
+    with get_storage_client().open_stream(bucket, path, chunk_size) as stream:
+        yield stream
@@ -0,0 +1,392 @@
+"""Supabase Storage — cache read-through su disco per i download.
+
+Una entry per (bucket, path), valida finché l'ETag di Supabase non cambia:
+- entro STORAGE_CACHE_TTL secondi dall'ultima validazione → letta da disco
+- oltre → GET condizionale (If-None-Match): 304 = hit rivalidato, 200 = riscritta
+- file grandi (>= STORAGE_CACHE_MMAP_THRESHOLD) esposti via mmap read-only
+- spazio totale limitato a STORAGE_CACHE_MAX_BYTES, eviction LRU
+- contatori hit / rivalidati / miss per il calcolo dell'hit rate
+
+Disattivata se STORAGE_CACHE_DIR non è impostata. L'indice è ricostruito
+all'avvio dai file .json accanto ai dati: la cache sopravvive ai restart.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+STORAGE_CACHE_DIR = os.getenv("STORAGE_CACHE_DIR")
+STORAGE_CACHE_MAX_BYTES = int(os.getenv("STORAGE_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+STORAGE_CACHE_TTL = float(os.getenv("STORAGE_CACHE_TTL", "300"))
+STORAGE_CACHE_MMAP_THRESHOLD = int(os.getenv("STORAGE_CACHE_MMAP_THRESHOLD", str(8 * 1024 * 1024)))
+
+
+@dataclass
+class CacheEntry:
+    bucket: str
+    path: str
+    etag: str
+    size: int
+    validated_at: float
+    last_access: float
+
+    @property
+    def key(self) -> str:
+        return _cache_key(self.bucket, self.path)
+
+
+def _cache_key(bucket: str, path: str) -> str:
+    return hashlib.sha1(f"{bucket}/{path}".encode("utf-8")).hexdigest()
+
+
+class _PendingEntry:
+    """Scrittura in corso su file temporaneo: visibile solo dopo commit()."""
+
+    def __init__(self, cache: "StorageCache", bucket: str, path: str, etag: str):
+        self.cache = cache
+        self.bucket = bucket
+        self.path = path
+        self.etag = etag
+        self.size = 0
+        self.tmp_path = cache.directory / f"{_cache_key(bucket, path)}.{uuid.uuid4().hex}.tmp"
+        self._file = open(self.tmp_path, "wb")
+        self._done = False
+
+    def write(self, chunk) -> bool:
+        """False se l'oggetto supera la dimensione massima (entry scartata)."""
+        if self._done:
+            return False
+        self.size += len(chunk)
+        if self.size > self.cache.max_bytes:
+            self.abort()
+            return False
+        self._file.write(chunk)
+        return True
+
+    def commit(self) -> CacheEntry | None:
+        if self._done:
+            return None
+        self._file.close()
+        self._done = True
+        return self.cache._commit(self)
+
+    def abort(self) -> None:
+        if self._done:
+            return
+        self._done = True
+        self._file.close()
+        _unlink(self.tmp_path)
+
+
+def _unlink(path: Path) -> None:
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class StorageCache:
+    """Cache su disco thread-safe. L'ordine di self._entries è l'LRU (primo = meno recente)."""
+
+    def __init__(
+        self,
+        directory,
+        max_bytes: int = STORAGE_CACHE_MAX_BYTES,
+        ttl: float = STORAGE_CACHE_TTL,
+        mmap_threshold: int = STORAGE_CACHE_MMAP_THRESHOLD,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.mmap_threshold = mmap_threshold
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._total = 0
+        self._stats = Counter()
+        self._load()
+
+    # ------------------------------------------------------------
+    # Indice su disco
+    # ------------------------------------------------------------
+
+    def _data_path(self, key: str) -> Path:
+        return self.directory / f"{key}.bin"
+
+    def _meta_path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _load(self) -> None:
+        for tmp in self.directory.glob("*.tmp"):
+            _unlink(tmp)
+
+        entries = []
+        for meta in self.directory.glob("*.json"):
+            try:
+                entry = CacheEntry(**json.loads(meta.read_text(encoding="utf-8")))
+                if self._data_path(entry.key).stat().st_size != entry.size:
+                    raise ValueError("dimensione non coerente")
+            except (OSError, ValueError, TypeError):
+                _unlink(meta)
+                _unlink(meta.with_suffix(".bin"))
+                continue
+            entries.append(entry)
+
+        for entry in sorted(entries, key=lambda e: e.last_access):
+            self._entries[entry.key] = entry
+            self._total += entry.size
+
+        with self._lock:
+            self._evict()
+
+        logger.info(
+            "[STORAGE CACHE] %s | oggetti=%d size=%.1f MB max=%.1f MB ttl=%ss",
+            self.directory,
+            len(self._entries),
+            self._total / 1024 ** 2,
+            self.max_bytes / 1024 ** 2,
+            self.ttl,
+        )
+
+    def _write_meta(self, entry: CacheEntry) -> None:
+        tmp = self.directory / f"{entry.key}.{uuid.uuid4().hex}.tmp"
+        tmp.write_text(json.dumps(asdict(entry)), encoding="utf-8")
+        os.replace(tmp, self._meta_path(entry.key))
+
+    def _drop(self, key: str) -> None:
+        """Rimuove entry e file. Chiamare con il lock preso."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total -= entry.size
+        _unlink(self._meta_path(key))
+        _unlink(self._data_path(key))
+
+    def _evict(self) -> None:
+        """LRU fino a rientrare in max_bytes. Chiamare con il lock preso."""
+        while self._total > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._drop(key)
+            self._stats["evictions"] += 1
+
+    # ------------------------------------------------------------
+    # Lookup / hit / miss
+    # ------------------------------------------------------------
+
+    def lookup(self, bucket: str, path: str) -> CacheEntry | None:
+        with self._lock:
+            return self._entries.get(_cache_key(bucket, path))
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.validated_at < self.ttl
+
+    def record_hit(self, entry: CacheEntry, revalidated: bool = False) -> None:
+        now = time.time()
+        with self._lock:
+            if entry.key not in self._entries:
+                return
+            entry.last_access = now
+            if revalidated:
+                entry.validated_at = now
+            self._entries.move_to_end(entry.key)
+            self._stats["revalidated" if revalidated else "hits"] += 1
+            self._stats["bytes_local"] += entry.size
+        try:
+            self._write_meta(entry)
+        except OSError:
+            logger.warning("[STORAGE CACHE] Scrittura metadati fallita | %s/%s", entry.bucket, entry.path)
+
+    def record_miss(self, size: int = 0) -> None:
+        with self._lock:
+            self._stats["misses"] += 1
+            self._stats["bytes_remote"] += size
+
+    def discard(self, entry: CacheEntry) -> None:
+        with self._lock:
+            self._drop(entry.key)
+
+    def conditional_headers(self, entry: CacheEntry | None) -> dict:
+        return {"If-None-Match": entry.etag} if entry is not None else {}
+
+    # ------------------------------------------------------------
+    # Scrittura
+    # ------------------------------------------------------------
+
+    def begin(self, bucket: str, path: str, etag: str | None) -> _PendingEntry | None:
+        """None se l'oggetto non è cachabile (senza ETag non si può rivalidare)."""
+        if not etag:
+            return None
+        try:
+            return _PendingEntry(self, bucket, path, etag)
+        except OSError:
+            logger.warning("[STORAGE CACHE] Impossibile scrivere in %s", self.directory)
+            return None
+
+    def _commit(self, pending: _PendingEntry) -> CacheEntry | None:
+        now = time.time()
+        entry = CacheEntry(
+            bucket=pending.bucket,
+            path=pending.path,
+            etag=pending.etag,
+            size=pending.size,
+            validated_at=now,
+            last_access=now,
+        )
+        with self._lock:
+            try:
+                os.replace(pending.tmp_path, self._data_path(entry.key))
+                self._write_meta(entry)
+            except OSError:
+                logger.warning("[STORAGE CACHE] Commit fallito | %s/%s", entry.bucket, entry.path)
+                _unlink(pending.tmp_path)
+                self._drop(entry.key)
+                return None
+
+            old = self._entries.pop(entry.key, None)
+            if old is not None:
+                self._total -= old.size
+            self._entries[entry.key] = entry
+            self._total += entry.size
+            self._stats["stored"] += 1
+            self._evict()
+        return entry
+
+    def store(self, bucket: str, path: str, etag: str | None, content: bytes) -> CacheEntry | None:
+        pending = self.begin(bucket, path, etag)
+        if pending is None:
+            return None
+        if not pending.write(content):
+            return None
+        return pending.commit()
+
+    def tee(self, bucket: str, path: str, etag: str | None, chunks):
+        """
+        Inoltra i chunk al chiamante scrivendoli anche in cache.
+        L'entry viene pubblicata solo se lo stream arriva a EOF.
+        """
+        pending = self.begin(bucket, path, etag)
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                if pending is not None and not pending.write(chunk):
+                    pending = None
+                yield chunk
+            if pending is not None:
+                pending.commit()
+        finally:
+            if pending is not None:
+                pending.abort()
+            self.record_miss(size)
+
+    # ------------------------------------------------------------
+    # Lettura
+    # ------------------------------------------------------------
+
+    def open(self, entry: CacheEntry):
+        """File binario dell'entry, None se sparito da disco (entry scartata)."""
+        try:
+            return open(self._data_path(entry.key), "rb")
+        except FileNotFoundError:
+            self.discard(entry)
+            return None
+
+    def read_bytes(self, entry: CacheEntry) -> bytes | None:
+        f = self.open(entry)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    @contextmanager
+    def buffer(self, entry: CacheEntry):
+        """
+        Contenuto come buffer read-only: mmap sopra la soglia (nessuna copia
+        in memoria del processo), bytes sotto. None se l'entry è sparita.
+        """
+        f = self.open(entry)
+        if f is None:
+            yield None
+            return
+
+        with f:
+            if entry.size < self.mmap_threshold or entry.size == 0:
+                yield f.read()
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
+
+    # ------------------------------------------------------------
+    # Statistiche
+    # ------------------------------------------------------------
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            objects = len(self._entries)
+            size = self._total
+
+        served = s.get("hits", 0) + s.get("revalidated", 0)
+        requests = served + s.get("misses", 0)
+        return {
+            "hits": s.get("hits", 0),
+            "revalidated": s.get("revalidated", 0),
+            "misses": s.get("misses", 0),
+            "hit_rate": served / requests if requests else 0.0,
+            "stored": s.get("stored", 0),
+            "evictions": s.get("evictions", 0),
+            "bytes_local": s.get("bytes_local", 0),
+            "bytes_remote": s.get("bytes_remote", 0),
+            "objects": objects,
+            "size_bytes": size,
+        }
+
+    def log_stats(self) -> None:
+        s = self.stats()
+        if not (s["hits"] or s["revalidated"] or s["misses"]):
+            return
+        logger.info(
+            "[STORAGE CACHE] hit rate=%.0f%% | hit=%d rivalidati=%d miss=%d evict=%d "
+            "locale=%.1f MB remoto=%.1f MB | oggetti=%d size=%.1f MB",
+            s["hit_rate"] * 100,
+            s["hits"],
+            s["revalidated"],
+            s["misses"],
+            s["evictions"],
+            s["bytes_local"] / 1024 ** 2,
+            s["bytes_remote"] / 1024 ** 2,
+            s["objects"],
+            s["size_bytes"] / 1024 ** 2,
+        )
+
+
+_cache: StorageCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_storage_cache() -> StorageCache | None:
+    """Cache di processo (None se STORAGE_CACHE_DIR non è impostata)."""
+    global _cache
+    if _cache is None and STORAGE_CACHE_DIR:
+        with _cache_lock:
+            if _cache is None:
+                _cache = StorageCache(STORAGE_CACHE_DIR)
+    return _cache
+
+
+def log_storage_cache_stats() -> None:
+    """Hit rate della cache di processo (contatori dall'avvio). Schedulato da app/scheduler."""
+    cache = get_storage_cache()
+    if cache is not None:
+        cache.log_stats()
@@ -12,7 +12,7 @@ load_dotenv(dotenv_path=ENV_PATH)
 
 import os
 
-from app.scheduler import build_scheduler
+from app.scheduler import build_scheduler, build_marketplace_dispatcher
 
 logging.basicConfig(
     level=logging.INFO,
@@ -27,12 +27,20 @@ def main():
 
     logging.info("🕒 scheduler started")
 
+    dispatcher = build_marketplace_dispatcher()
+    if dispatcher:
+        dispatcher.start()
+        logging.info("📣 marketplace dispatcher started")
+
     try:
         while True:
             time.sleep(60)
     except KeyboardInterrupt:
         logging.info("🛑 shutdown requested")
     finally:
+        if dispatcher:
+            dispatcher.stop()
+            dispatcher.join(timeout=30)
         scheduler.shutdown(wait=True)
         logging.info("✅ scheduler stopped")
 
@@ -0,0 +1,492 @@
+"""
+as24_mock_server.py — Stand-in locale della AutoScout24 Listing Creation API.
+
+Generato dallo spec OpenAPI incluso nel repo (`spec (2) (1).yml`): le route
+e gli schemi di request arrivano dallo spec, nessun modello duplicato a mano.
+Serve per load test del publishing path (autoscout_sync_job) senza toccare
+AS24 reale né X-Testmode.
+
+Endpoint implementati (come li usa app/external/autoscout.py):
+  GET    /customers
+  POST   /customers/{customerId}/listings            (validato: ListingPayload)
+  GET    /customers/{customerId}/listings/{listingId}
+  PUT    /customers/{customerId}/listings/{listingId} (validato)
+  PATCH  /customers/{customerId}/listings/{listingId} (validato)
+  DELETE /customers/{customerId}/listings/{listingId}
+  POST   /customers/{customerId}/images               (content-type dallo spec)
+Le altre operazioni dello spec rispondono 501.
+
+Endpoint di servizio:
+  GET  /__stats   → contatori + listings/minuto + immagini/secondo
+  POST /__reset   → azzera stato e contatori
+
+Simulazione:
+  --latency-ms / --latency-jitter-ms   latenza per richiesta
+  --image-latency-ms                   latenza extra per upload immagini
+  --error-rate                         frazione di 500/503 casuali
+  --rate-limit / --burst               token bucket per customer → 429
+
+Uso:
+  pip install pyyaml
+  python scripts/as24_mock_server.py --port 8024 --latency-ms 150 --error-rate 0.02
+  AUTOSCOUT_BASE_URL=http://127.0.0.1:8024 AUTOSCOUT_USER=x AUTOSCOUT_PASSWORD=x ...
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+try:
+    import yaml
+except ImportError:  # pragma: no cover
+    sys.exit("as24_mock_server richiede PyYAML: pip install pyyaml")
+
+_HERE = Path(__file__).resolve()
+DEFAULT_SPEC = _HERE.parents[1] / "spec (2) (1).yml"
+
+
+# ============================================================
+# SPEC OPENAPI → ROUTE + VALIDAZIONE
+# ============================================================
+
+class OpenApiSpec:
+    def __init__(self, path: Path):
+        with open(path, encoding="utf-8") as f:
+            self.doc = yaml.safe_load(f)
+        self.routes = self._build_routes()
+
+    def _build_routes(self) -> list:
+        routes = []
+        for template, ops in self.doc.get("paths", {}).items():
+            regex = "^" + re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", template) + "$"
+            for method, op in ops.items():
+                if not isinstance(op, dict) or "operationId" not in op:
+                    continue
+                routes.append((method.upper(), re.compile(regex), op))
+        return routes
+
+    def match(self, method: str, path: str):
+        """Ritorna (operation, path_params) oppure (None, None); 405 se path ok e metodo no."""
+        path_exists = False
+        for route_method, regex, op in self.routes:
+            m = regex.match(path)
+            if not m:
+                continue
+            path_exists = True
+            if route_method == method:
+                return op, m.groupdict()
+        return (False if path_exists else None), None
+
+    def resolve(self, schema: dict) -> dict:
+        while isinstance(schema, dict) and "$ref" in schema:
+            node = self.doc
+            for part in schema["$ref"].lstrip("#/").split("/"):
+                node = node[part]
+            schema = node
+        return schema
+
+    def request_content(self, op: dict) -> dict:
+        body = self.resolve(op.get("requestBody") or {})
+        return body.get("content") or {}
+
+    # ------------------------------------------------------------
+    # Validatore JSON Schema (sottoinsieme usato dallo spec AS24)
+    # ------------------------------------------------------------
+    _TYPES = {
+        "object": dict,
+        "array": list,
+        "string": str,
+        "boolean": bool,
+    }
+
+    def validate(self, schema: dict, value, path: str = "", errors: list | None = None) -> list:
+        errors = [] if errors is None else errors
+        schema = self.resolve(schema)
+        if not isinstance(schema, dict):
+            return errors
+
+        for sub in schema.get("allOf", []):
+            self.validate(sub, value, path, errors)
+
+        for key in ("oneOf", "anyOf"):
+            if key in schema:
+                if not any(not self.validate(sub, value, path) for sub in schema[key]):
+                    errors.append(("invalid-json", path, f"'{path}' non corrisponde a nessuna variante {key}"))
+
+        if value is None:
+            return errors
+
+        expected = schema.get("type")
+        if expected in ("integer", "number"):
+            ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if expected == "integer":
+                ok = ok and float(value).is_integer()
+            if not ok:
+                errors.append(("invalid-json", path, f"'{path}' deve essere {expected}"))
+                return errors
+        elif expected in self._TYPES and not isinstance(value, self._TYPES[expected]):
+            errors.append(("invalid-json", path, f"'{path}' deve essere {expected}"))
+            return errors
+
+        if "enum" in schema and value not in schema["enum"]:
+            errors.append(("invalid-json", path, f"'{path}' valore non ammesso: {value!r}"))
+
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            if "minimum" in schema and value < schema["minimum"]:
+                errors.append(("minimum-value-exceeded", path, f"'{path}' < {schema['minimum']}"))
+            if "maximum" in schema and value > schema["maximum"]:
+                errors.append(("maximum-value-exceeded", path, f"'{path}' > {schema['maximum']}"))
+
+        if isinstance(value, str):
+            if "minLength" in schema and len(value) < schema["minLength"]:
+                errors.append(("invalid-field-length", path, f"'{path}' più corto di {schema['minLength']}"))
+            if "maxLength" in schema and len(value) > schema["maxLength"]:
+                errors.append(("invalid-field-length", path, f"'{path}' più lungo di {schema['maxLength']}"))
+
+        if isinstance(value, list):
+            if "maxItems" in schema and len(value) > schema["maxItems"]:
+                errors.append(("invalid-field-length", path, f"'{path}' oltre {schema['maxItems']} elementi"))
+            if "minItems" in schema and len(value) < schema["minItems"]:
+                errors.append(("invalid-field-length", path, f"'{path}' meno di {schema['minItems']} elementi"))
+            if "items" in schema:
+                for i, item in enumerate(value):
+                    self.validate(schema["items"], item, f"{path}[{i}]", errors)
+
+        if isinstance(value, dict):
+            for name in schema.get("required", []):
+                if name not in value:
+                    full = f"{path}.{name}" if path else name
+                    errors.append(("mandatory-attribute-missing", full, f"The property '{full}' could not be found"))
+            for name, sub in (schema.get("properties") or {}).items():
+                if name in value:
+                    self.validate(sub, value[name], f"{path}.{name}" if path else name, errors)
+
+        return errors
+
+
+# ============================================================
+# SIMULAZIONE: LATENZA / ERRORI / RATE LIMIT
+# ============================================================
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """0 se concesso, altrimenti secondi di attesa suggeriti (Retry-After)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class MockState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.customers = {
+            str(2142082000 + i): sell_id
+            for i, sell_id in enumerate(args.customers.split(","))
+        }
+        self.buckets: dict = {}
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.listings: dict = {}        # (customer_id, listing_id) → payload
+            self.images: dict = {}          # image_id → size
+            self.counters = {
+                "requests": 0,
+                "listings_created": 0,
+                "listings_updated": 0,
+                "listings_deleted": 0,
+                "images_uploaded": 0,
+                "image_bytes": 0,
+                "validation_errors": 0,
+                "injected_errors": 0,
+                "rate_limited": 0,
+            }
+            self.started_at = time.monotonic()
+
+    def bump(self, key: str, n: int = 1) -> None:
+        with self.lock:
+            self.counters[key] += n
+
+    def throttle(self, key: str) -> float:
+        if not self.args.rate_limit:
+            return 0.0
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.args.rate_limit, self.args.burst)
+                self.buckets[key] = bucket
+            return bucket.take()
+
+    def stats(self) -> dict:
+        with self.lock:
+            elapsed = max(time.monotonic() - self.started_at, 1e-9)
+            c = dict(self.counters)
+        c["elapsed_seconds"] = round(elapsed, 3)
+        c["listings_per_minute"] = round((c["listings_created"] + c["listings_updated"]) * 60 / elapsed, 2)
+        c["images_per_second"] = round(c["images_uploaded"] / elapsed, 2)
+        return c
+
+
+# ============================================================
+# HTTP HANDLER
+# ============================================================
+
+class MockHandler(BaseHTTPRequestHandler):
+    server_version = "AS24Mock/1.0"
+    spec: OpenApiSpec = None
+    state: MockState = None
+
+    def log_message(self, fmt, *args):
+        if not self.state.args.quiet:
+            super().log_message(fmt, *args)
+
+    # ------------------------------------------------------------
+    # Risposte
+    # ------------------------------------------------------------
+    def _send(self, status: int, body=None, headers: dict | None = None) -> None:
+        data = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    def _error(self, status: int, code: str, message: str) -> None:
+        self._send(status, {"errors": [{"code": code, "message": message}]})
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    # ------------------------------------------------------------
+    # Dispatch
+    # ------------------------------------------------------------
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str) -> None:
+        path = urlsplit(self.path).path.rstrip("/") or "/"
+        args = self.state.args
+
+        if path == "/__stats" and method == "GET":
+            return self._send(200, self.state.stats())
+        if path == "/__reset" and method == "POST":
+            self.state.reset()
+            return self._send(204)
+
+        body = self._read_body()
+        self.state.bump("requests")
+
+        op, params = self.spec.match(method, path)
+        if op is None:
+            return self._error(404, "json-not-found", f"Nessuna route per {path}")
+        if op is False:
+            return self._send(405)
+
+        if not self.headers.get("Authorization", "").startswith("Basic "):
+            return self._send(401)
+
+        customer_id = (params or {}).get("customerId")
+        wait = self.state.throttle(customer_id or "__global__")
+        if wait:
+            self.state.bump("rate_limited")
+            return self._send(429, headers={"Retry-After": str(max(1, round(wait)))})
+
+        delay = args.latency_ms + random.uniform(0, args.latency_jitter_ms)
+        if op["operationId"] == "uploadImage":
+            delay += args.image_latency_ms
+        if delay:
+            time.sleep(delay / 1000)
+
+        if args.error_rate and random.random() < args.error_rate:
+            self.state.bump("injected_errors")
+            if random.random() < 0.5:
+                return self._send(500)
+            return self._error(503, "service-unavailable", "Errore simulato (mock)")
+
+        if customer_id is not None and customer_id not in self.state.customers:
+            return self._error(404, "customer-not-found-error", f"Customer {customer_id} inesistente")
+
+        handler = getattr(self, f"op_{op['operationId']}", None)
+        if handler is None:
+            return self._send(501, {"errors": [{"code": "not-implemented", "message": op["operationId"]}]})
+
+        handler(op, params or {}, body)
+
+    def _json_body(self, op: dict, body: bytes):
+        """Decodifica + validazione schema. None se ha già risposto con errore."""
+        if not body:
+            self._error(400, "empty-body", "Body mancante")
+            return None
+        try:
+            payload = json.loads(body)
+        except ValueError as exc:
+            self._error(400, "invalid-json", str(exc))
+            return None
+
+        if self.state.args.validate:
+            schema = self.spec.request_content(op).get("application/json", {}).get("schema")
+            errors = self.spec.validate(schema, payload) if schema else []
+            if errors:
+                self.state.bump("validation_errors")
+                self._send(400, {"errors": [
+                    {"code": code, "message": message} for code, _, message in errors[:50]
+                ]})
+                return None
+        return payload
+
+    # ------------------------------------------------------------
+    # Operazioni (operationId dello spec)
+    # ------------------------------------------------------------
+    def op_listCustomers(self, op, params, body):
+        self._send(200, {"customers": [
+            {
+                "id": cid,
+                "sellId": sell_id,
+                "companyName": f"Mock dealer {sell_id}",
+                "canSetMiaRequestedTier": False,
+                "canUseSellOnline": False,
+            }
+            for cid, sell_id in self.state.customers.items()
+        ]})
+
+    def op_createListing(self, op, params, body):
+        payload = self._json_body(op, body)
+        if payload is None:
+            return
+        listing_id = str(uuid.uuid4())
+        with self.state.lock:
+            self.state.listings[(params["customerId"], listing_id)] = payload
+        self.state.bump("listings_created")
+        self._send(201, {"id": listing_id, **payload})
+
+    def op_getListing(self, op, params, body):
+        key = (params["customerId"], params["listingId"])
+        payload = self.state.listings.get(key)
+        if payload is None:
+            return self._error(404, "listing-does-not-exist", f"Listing {params['listingId']} inesistente")
+        self._send(200, {"id": params["listingId"], **payload})
+
+    def _update(self, op, params, body, merge: bool):
+        key = (params["customerId"], params["listingId"])
+        if key not in self.state.listings:
+            return self._error(404, "listing-does-not-exist", f"Listing {params['listingId']} inesistente")
+        payload = self._json_body(op, body)
+        if payload is None:
+            return
+        with self.state.lock:
+            if merge:
+                self.state.listings[key] = {**self.state.listings[key], **payload}
+            else:
+                self.state.listings[key] = payload
+        self.state.bump("listings_updated")
+        self._send(200, {"id": params["listingId"], **self.state.listings[key]})
+
+    def op_updateListing(self, op, params, body):
+        self._update(op, params, body, merge=False)
+
+    def op_partiallyUpdateListing(self, op, params, body):
+        self._update(op, params, body, merge=True)
+
+    def op_deleteListing(self, op, params, body):
+        key = (params["customerId"], params["listingId"])
+        with self.state.lock:
+            existed = self.state.listings.pop(key, None) is not None
+        if not existed:
+            return self._error(404, "listing-does-not-exist", f"Listing {params['listingId']} inesistente")
+        self.state.bump("listings_deleted")
+        self._send(204)
+
+    def op_uploadImage(self, op, params, body):
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        if not content_type:
+            return self._error(400, "content-type-not-provided", "Content-Type mancante")
+        if content_type not in self.spec.request_content(op):
+            return self._error(400, "unsupported-image-type", f"Content-Type non supportato: {content_type}")
+        if not body:
+            return self._error(400, "empty-body", "Immagine vuota")
+
+        image_id = str(uuid.uuid4())
+        with self.state.lock:
+            self.state.images[image_id] = len(body)
+        self.state.bump("images_uploaded")
+        self.state.bump("image_bytes", len(body))
+        self._send(201, {"id": image_id})
+
+
+# ============================================================
+# MAIN
+# ============================================================
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock locale AutoScout24 Listing API")
+    parser.add_argument("--spec", type=Path, default=DEFAULT_SPEC)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8024)
+    parser.add_argument("--customers", default="892611", help="sellId separati da virgola")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--image-latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="0..1, frazione di 500/503")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="richieste/s per customer (0 = off)")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--no-validate", dest="validate", action="store_false")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    MockHandler.spec = OpenApiSpec(args.spec)
+    MockHandler.state = MockState(args)
+
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    print(
+        f"AS24 mock su http://{args.host}:{args.port} | "
+        f"operazioni spec={len(MockHandler.spec.routes)} customers={MockHandler.state.customers}",
+        flush=True,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(MockHandler.state.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
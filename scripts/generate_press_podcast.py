@@ -517,15 +517,22 @@ def main():
     audio_path = Path(f"{out_base}.{ext}")
     audio_path.write_bytes(audio)
     logger.info("Audio salvato: %s (%d KB)", audio_path, len(audio) // 1024)
+    del audio
 
     if args.upload:
         sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
-        from app.storage import upload_bytes_and_get_public_url  # noqa: E402
-        url = upload_bytes_and_get_public_url(
+        from app.storage import upload_file_and_get_public_url  # noqa: E402
+
+        def _progress(sent: int, total: int | None) -> None:
+            logger.info("Upload %d / %s KB", sent // 1024, total // 1024 if total else "?")
+
+        # Dal file su disco, in streaming (resumable oltre la soglia)
+        url = upload_file_and_get_public_url(
             bucket=PRESS_BUCKET,
             path=audio_path.name,
-            content=audio,
+            file_path=audio_path,
             content_type="audio/mpeg" if ext == "mp3" else "audio/wav",
+            progress=_progress,
         )
         logger.info("Upload OK: %s", url)
 
@@ -0,0 +1,36 @@
+-- ============================================================
+-- MARKETPLACE QUEUE — LISTEN/NOTIFY
+-- ============================================================
+-- Notifica il dispatcher di azurenet-engine (app/jobs/marketplace_dispatcher.py)
+-- quando una riga entra in coda su autoscout_listings / asm_listings.
+-- Payload = id della riga. Canale = argomento del trigger.
+--
+-- Schema condiviso con CoreAPI: applicare sul DB una sola volta (idempotente).
+
+CREATE OR REPLACE FUNCTION public.notify_marketplace_queue()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.status IS NOT DISTINCT FROM NEW.status THEN
+        RETURN NEW;
+    END IF;
+
+    PERFORM pg_notify(TG_ARGV[0], NEW.id::text);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS autoscout_listings_queue_notify ON public.autoscout_listings;
+CREATE TRIGGER autoscout_listings_queue_notify
+    AFTER INSERT OR UPDATE OF status ON public.autoscout_listings
+    FOR EACH ROW
+    WHEN (NEW.status IN ('PENDING_CREATE', 'UPDATE_REQUIRED', 'DELETE_REQUIRED'))
+    EXECUTE FUNCTION public.notify_marketplace_queue('autoscout_listings_queue');
+
+DROP TRIGGER IF EXISTS asm_listings_queue_notify ON public.asm_listings;
+CREATE TRIGGER asm_listings_queue_notify
+    AFTER INSERT OR UPDATE OF status ON public.asm_listings
+    FOR EACH ROW
+    WHEN (NEW.status IN ('PENDING_CREATE', 'UPDATE_REQUIRED', 'DELETE_REQUIRED'))
+    EXECUTE FUNCTION public.notify_marketplace_queue('asm_listings_queue');
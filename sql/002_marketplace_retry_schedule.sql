@@ -0,0 +1,27 @@
+-- ============================================================
+-- MARKETPLACE QUEUE — RETRY SCHEDULATI
+-- ============================================================
+-- Usato da app/jobs/marketplace_retry.py:
+-- - retry_status: operazione da ritentare quando status = 'ERROR'
+-- - next_attempt_at: prossimo tentativo (backoff esponenziale + jitter)
+-- - status = 'DEAD_LETTER' dopo MARKETPLACE_MAX_ATTEMPTS tentativi
+--
+-- Schema condiviso con CoreAPI: applicare sul DB una sola volta (idempotente).
+-- Se status ha un CHECK constraint, va esteso con 'DEAD_LETTER'.
+
+ALTER TABLE public.autoscout_listings
+    ADD COLUMN IF NOT EXISTS retry_status text,
+    ADD COLUMN IF NOT EXISTS next_attempt_at timestamptz;
+
+ALTER TABLE public.asm_listings
+    ADD COLUMN IF NOT EXISTS retry_status text,
+    ADD COLUMN IF NOT EXISTS next_attempt_at timestamptz;
+
+-- Claim: righe in coda + ERROR scadute. Indice parziale = solo righe "vive".
+CREATE INDEX IF NOT EXISTS autoscout_listings_queue_due_idx
+    ON public.autoscout_listings (status, next_attempt_at)
+    WHERE status IN ('PENDING_CREATE', 'UPDATE_REQUIRED', 'DELETE_REQUIRED', 'ERROR');
+
+CREATE INDEX IF NOT EXISTS asm_listings_queue_due_idx
+    ON public.asm_listings (status, next_attempt_at)
+    WHERE status IN ('PENDING_CREATE', 'UPDATE_REQUIRED', 'DELETE_REQUIRED', 'ERROR');
@@ -0,0 +1,26 @@
+-- ============================================================
+-- MNET PUBLISH DETAILS — SNAPSHOT PER I PAYLOAD MARKETPLACE
+-- ============================================================
+-- Usato da app/jobs/mnet_publish_details.py:
+-- una riga per codice_motornet_uni con SOLO i campi letti dai payload
+-- builder AS24 / ASM (vista unificata + mnet_dettagli_usato + mnet_vcom_dettagli).
+-- Lettura a chiave primaria invece di espandere v_mnet_dettagli_unificati.
+--
+-- Refresh incrementale (upsert solo se cambiato) dopo:
+-- - sync_usato_dettagli / sync_vic_dettagli (nuovi codici)
+-- - wltp_consumi_enrichment_worker (consumi / CO2)
+-- Codici mancanti vengono materializzati al primo publish.
+--
+-- Applicare sul DB una sola volta (idempotente).
+
+CREATE TABLE IF NOT EXISTS public.mnet_publish_details (
+    codice_motornet_uni text PRIMARY KEY,
+    catalog             text,
+    marca               text,
+    modello             text,
+    allestimento        text,
+    trazione            text,
+    det_auto            jsonb,      -- sottoinsieme mnet_dettagli_usato (catalog auto)
+    det_vic             jsonb,      -- sottoinsieme mnet_vcom_dettagli (catalog vic)
+    refreshed_at        timestamptz NOT NULL DEFAULT now()
+);
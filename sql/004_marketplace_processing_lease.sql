@@ -0,0 +1,31 @@
+-- ============================================================
+-- MARKETPLACE QUEUE — CLAIM CON LEASE (status PROCESSING)
+-- ============================================================
+-- Usato da app/jobs/marketplace_engine.py:
+-- il claim porta la riga a status = 'PROCESSING' e fa subito commit,
+-- le chiamate AS24 / ASM girano FUORI da ogni transazione.
+-- - lease_operation: operazione claimata (PENDING_CREATE / UPDATE_REQUIRED / DELETE_REQUIRED)
+-- - lease_token: id del claim, l'esito viene scritto solo se il token coincide
+-- - lease_expires_at: scaduto → la riga torna claimabile (worker morto / deploy)
+--
+-- Schema condiviso con CoreAPI: applicare sul DB una sola volta (idempotente).
+-- Se status ha un CHECK constraint, va esteso con 'PROCESSING'.
+
+ALTER TABLE public.autoscout_listings
+    ADD COLUMN IF NOT EXISTS lease_operation text,
+    ADD COLUMN IF NOT EXISTS lease_token uuid,
+    ADD COLUMN IF NOT EXISTS lease_expires_at timestamptz;
+
+ALTER TABLE public.asm_listings
+    ADD COLUMN IF NOT EXISTS lease_operation text,
+    ADD COLUMN IF NOT EXISTS lease_token uuid,
+    ADD COLUMN IF NOT EXISTS lease_expires_at timestamptz;
+
+-- Recupero lease scaduti
+CREATE INDEX IF NOT EXISTS autoscout_listings_lease_idx
+    ON public.autoscout_listings (lease_expires_at)
+    WHERE status = 'PROCESSING';
+
+CREATE INDEX IF NOT EXISTS asm_listings_lease_idx
+    ON public.asm_listings (lease_expires_at)
+    WHERE status = 'PROCESSING';
@@ -0,0 +1,19 @@
+-- ============================================================
+-- VEHICLE STOCK — ROW HASH PER IMPORT CSV DIFFERENZIALI
+-- ============================================================
+-- Usato da app/jobs/vehicle_stock_csv_import.py:
+-- - vehicles_stock_sale.row_hash: hash dei campi CSV normalizzati.
+--   L'upsert riscrive solo le righe con hash diverso (o non attive);
+--   le righe invariate ricevono solo last_seen_at / last_import_id.
+-- - vehicle_stock_imports.rows_unchanged: righe presenti ma invariate.
+--
+-- Le righe esistenti partono con row_hash NULL: il primo import le
+-- riscrive tutte una volta, poi solo il delta reale.
+--
+-- Applicare sul DB una sola volta (idempotente).
+
+ALTER TABLE public.vehicles_stock_sale
+    ADD COLUMN IF NOT EXISTS row_hash text;
+
+ALTER TABLE public.vehicle_stock_imports
+    ADD COLUMN IF NOT EXISTS rows_unchanged integer;
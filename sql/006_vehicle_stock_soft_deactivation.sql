@@ -0,0 +1,19 @@
+-- ============================================================
+-- VEHICLE STOCK — DISATTIVAZIONE SOFT DELLE AUTO SPARITE DAL CSV
+-- ============================================================
+-- Usato da app/jobs/vehicle_stock_csv_import.py:
+-- le auto della sorgente non più presenti nel CSV passano a
+-- is_active = false (anti-join con la staging dell'import) invece
+-- di essere cancellate. Un import successivo che le ripropone le riattiva.
+-- - indice parziale sulle sole righe attive della sorgente: il finalize
+--   legge lo stock attivo, non lo storico della tabella
+-- - vehicle_stock_imports.rows_deactivated: auto disattivate dall'import
+--
+-- Applicare sul DB una sola volta (idempotente).
+
+CREATE INDEX IF NOT EXISTS vehicles_stock_sale_active_source_idx
+    ON public.vehicles_stock_sale (source, external_id)
+    WHERE is_active;
+
+ALTER TABLE public.vehicle_stock_imports
+    ADD COLUMN IF NOT EXISTS rows_deactivated integer;
@@ -0,0 +1,19 @@
+-- ============================================================
+-- VEHICLE STOCK — IMPORT PARALLELI PER SORGENTE + METRICHE
+-- ============================================================
+-- Usato da app/jobs/vehicle_stock_csv_import.py:
+-- - source: sorgente del CSV (isolamento: disattivazione e serializzazione
+--   degli import avvengono per sorgente). Default 'mygarage'.
+-- - started_at / duration_ms / rows_per_second: tempi e throughput per import
+--
+-- Applicare sul DB una sola volta (idempotente).
+
+ALTER TABLE public.vehicle_stock_imports
+    ADD COLUMN IF NOT EXISTS source text NOT NULL DEFAULT 'mygarage',
+    ADD COLUMN IF NOT EXISTS started_at timestamptz,
+    ADD COLUMN IF NOT EXISTS duration_ms integer,
+    ADD COLUMN IF NOT EXISTS rows_per_second numeric;
+
+CREATE INDEX IF NOT EXISTS vehicle_stock_imports_pending_idx
+    ON public.vehicle_stock_imports (created_at)
+    WHERE status = 'pending';
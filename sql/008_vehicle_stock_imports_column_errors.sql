@@ -0,0 +1,11 @@
+-- ============================================================
+-- VEHICLE STOCK — ERRORI DI NORMALIZZAZIONE PER COLONNA
+-- ============================================================
+-- Usato da app/jobs/vehicle_stock_csv_import.py:
+-- column_errors = {"colonna": n} valori non vuoti del CSV scartati
+-- in normalizzazione (prezzi / interi / date / codice versione CM invalidi).
+--
+-- Applicare sul DB una sola volta (idempotente).
+
+ALTER TABLE public.vehicle_stock_imports
+    ADD COLUMN IF NOT EXISTS column_errors jsonb;
@@ -0,0 +1,29 @@
+-- ============================================================
+-- SQL STATS — TOP STATEMENT PER RUN DI JOB
+-- ============================================================
+-- Usato da app/sql_stats.py (solo con SQL_STATS_PERSIST=true):
+-- a fine run di ogni job schedulato, i top N statement normalizzati
+-- per tempo totale (chiamate, tempo totale / massimo, righe).
+-- statement_hash: sha1 dello statement normalizzato, per aggregare tra run.
+--
+-- Applicare sul DB una sola volta (idempotente).
+
+CREATE TABLE IF NOT EXISTS public.sql_job_stats (
+    id bigserial PRIMARY KEY,
+    job_id text NOT NULL,
+    run_started_at timestamptz NOT NULL,
+    run_seconds double precision NOT NULL,
+    statement_hash text NOT NULL,
+    statement text NOT NULL,
+    calls integer NOT NULL,
+    total_ms double precision NOT NULL,
+    max_ms double precision NOT NULL,
+    rows bigint NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS sql_job_stats_job_idx
+    ON public.sql_job_stats (job_id, run_started_at DESC);
+
+CREATE INDEX IF NOT EXISTS sql_job_stats_statement_idx
+    ON public.sql_job_stats (statement_hash, run_started_at DESC);
@@ -0,0 +1,12 @@
+-- ============================================================
+-- VEHICLE STOCK — RIGHE DUPLICATE NEL CSV
+-- ============================================================
+-- Usato da app/jobs/vehicle_stock_csv_import.py:
+-- rows_duplicated = righe con un ID MyGarage ripetuto più avanti nel file
+-- (vince l'ultima riga). Non sono contate in rows_updated / rows_unchanged:
+-- inserted + updated + unchanged + skipped + duplicated = rows_total.
+--
+-- Applicare sul DB una sola volta (idempotente).
+
+ALTER TABLE public.vehicle_stock_imports
+    ADD COLUMN IF NOT EXISTS rows_duplicated integer NOT NULL DEFAULT 0;